@@ -0,0 +1,84 @@
+"""
+Output helpers for batch runs that must not slow the processing loop down.
+
+ProgressLine keeps a single, rate-limited progress line on stderr instead of
+several printed lines per file. AsyncJsonlWriter writes per-file results to a
+JSON lines file from a background thread, so a slow disk or terminal never
+throttles the batch.
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+
+class ProgressLine:
+    """A batched progress line, redrawn at most once per interval."""
+
+    def __init__(self, stream=None, interval=None):
+        self.stream = stream or sys.stderr
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        # Redraw in place on a terminal; in a log file only add a line now and then
+        self.interval = interval if interval is not None else (0.5 if self.is_tty else 10.0)
+        self.started = time.monotonic()
+        self.last_draw = 0.0
+        self.done = self.skipped = self.failed = 0
+
+    def update(self, result):
+        """Counts one result dict from process_images and redraws the line if it is due."""
+        self.done += 1
+        if result.get('skipped'):
+            self.skipped += 1
+        elif not result['success']:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self.last_draw >= self.interval:
+            self.last_draw = now
+            self._draw(now)
+
+    def _draw(self, now, final=False):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        text = (f"{self.done} files ({self.skipped} skipped, {self.failed} failed) "
+                f"- {rate:.1f} files/s - {elapsed:.0f}s elapsed")
+        if self.is_tty:
+            self.stream.write(f"\r\033[K{text}" + ("\n" if final else ""))
+        else:
+            self.stream.write(text + "\n")
+        self.stream.flush()
+
+    def finish(self):
+        if self.done:
+            self._draw(time.monotonic(), final=True)
+
+class AsyncJsonlWriter:
+    """Appends records to a JSON lines file from a background thread."""
+
+    _STOP = object()
+
+    def __init__(self, path, max_pending=10000):
+        self.path = path
+        # Bounded so a stalled disk applies backpressure instead of growing memory forever
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='jsonl-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is self._STOP:
+                break
+            self._file.write(json.dumps(record) + '\n')
+            # Flush whenever we've caught up, so the file is useful while the run is going
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the Image Metadata Randomizer hot paths.
+
+This script:
+1. Generates synthetic JPEG corpora in several sizes and EXIF complexities
+2. Times randomize_metadata, get_metadata_string and process_images end to end
+3. Times the individual stages of the randomize pipeline (via instrumentation.FileStats)
+4. Reports files/sec, MB/s and peak RSS, optionally as JSON for comparing commits
+
+Every timed benchmark runs in a freshly spawned interpreter, so its peak RSS
+covers that benchmark alone (see peak_rss_mb).
+
+Examples:
+    python benchmark_randomizer.py
+    python benchmark_randomizer.py --sizes thumb,12mp,50mp --exif full --files 10
+    python benchmark_randomizer.py --json results.json
+    python benchmark_randomizer.py --compare results.json --tolerance 0.15
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+import piexif
+
+from image_metadata_randomizer import (randomize_metadata, get_metadata_string, process_images,
+                                       build_random_exif, ENGINES, logger)
+from instrumentation import FileStats, BatchStats
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# Image sizes (width, height) for the synthetic corpora
+SIZE_PRESETS = {
+    'thumb': (160, 120),
+    '2mp': (1632, 1224),
+    '12mp': (4000, 3000),
+    '24mp': (6000, 4000),
+    '50mp': (8688, 5792),
+}
+
+EXIF_COMPLEXITIES = ('none', 'basic', 'full')
+
+DEFAULT_SIZES = 'thumb,2mp,12mp'
+DEFAULT_EXIF = 'basic,full'
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size in MB of the largest process so far (None if unknown).
+
+    That is this process or, if it was bigger, one of its finished children
+    (pool workers). Both values are lifetime high-water marks, which is why
+    measure() runs each benchmark in a fresh process.
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return peak / divisor
+
+def _run_measured(function, args):
+    return function(*args), peak_rss_mb()
+
+def measure(function, *args):
+    """Runs function(*args) in a freshly spawned interpreter and returns (its result, that process's peak_rss_mb())."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_measured, function, args).result()
+
+@contextlib.contextmanager
+def quiet_logging():
+    """Hides the randomizer's per-file log messages; pool workers inherit the level, so they are quiet too."""
+    previous = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
+
+def build_source_exif(complexity, rng):
+    """Builds the EXIF block a synthetic source image carries for the given complexity."""
+    if complexity == 'none':
+        return None
+    if complexity == 'basic':
+        exif_dict = {"0th": {piexif.ImageIFD.Make: b"BenchCamera", piexif.ImageIFD.Model: b"BenchModel"},
+                     "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+        return piexif.dump(exif_dict)
+
+    # 'full': everything a phone camera writes, plus a maker note and an embedded thumbnail
+    exif_dict, _ = build_random_exif(True, rng=rng, reference_date=datetime.datetime(2025, 1, 1))
+    exif_dict['Exif'][piexif.ExifIFD.MakerNote] = bytes(rng.getrandbits(8) for _ in range(16 * 1024))
+    exif_dict['Exif'][piexif.ExifIFD.UserComment] = b"ASCII\x00\x00\x00" + b"benchmark " * 200
+    thumbnail = Image.new('RGB', (160, 120), color=(rng.randrange(256), 90, 30))
+    with tempfile.SpooledTemporaryFile() as buffer:
+        thumbnail.save(buffer, "jpeg", quality=80)
+        buffer.seek(0)
+        exif_dict['thumbnail'] = buffer.read()
+    exif_dict['1st'] = {piexif.ImageIFD.XResolution: (72, 1), piexif.ImageIFD.YResolution: (72, 1)}
+    return piexif.dump(exif_dict)
+
+def make_synthetic_image(size):
+    """Creates an RGB image whose noise compresses about as badly as a real photo."""
+    bands = [Image.effect_noise(size, sigma) for sigma in (40, 60, 80)]
+    gradient = Image.linear_gradient('L').resize(size)
+    bands[0] = Image.blend(bands[0], gradient, 0.5)
+    return Image.merge('RGB', bands)
+
+def generate_corpus(corpus_dir, size_name, complexity, count, seed=0):
+    """Creates (or reuses) count JPEGs for one size/complexity combination and returns their paths."""
+    folder = os.path.join(corpus_dir, f"{size_name}_{complexity}")
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(f"{seed}-{size_name}-{complexity}")
+    paths = []
+    image = None
+    for index in range(count):
+        path = os.path.join(folder, f"img_{index:04d}.jpg")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        if image is None:
+            image = make_synthetic_image(SIZE_PRESETS[size_name])
+        exif_bytes = build_source_exif(complexity, rng)
+        save_args = {"quality": 92}
+        if exif_bytes:
+            save_args["exif"] = exif_bytes
+        if complexity == 'full':
+            save_args["comment"] = b"synthetic benchmark image"
+        image.save(path, "jpeg", **save_args)
+    return paths
+
+def remove_outputs(paths):
+    for path in paths:
+        output_path = os.path.join(os.path.dirname(path), f"modified_{os.path.basename(path)}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+def total_megabytes(paths):
+    return sum(os.path.getsize(path) for path in paths) / (1024 * 1024)
+
+def make_record(corpus, benchmark, paths, measured, stages=None):
+    """Builds a result record from measure()'s (seconds, peak RSS) for a benchmark."""
+    seconds, peak_rss = measured
+    megabytes = total_megabytes(paths)
+    return {
+        'corpus': corpus,
+        'benchmark': benchmark,
+        'files': len(paths),
+        'seconds': seconds,
+        'files_per_sec': len(paths) / seconds if seconds > 0 else None,
+        'mb_per_sec': megabytes / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_rss,
+        'stages': stages or {},
+    }
+
+def bench_randomize(paths, engine):
+    started = time.perf_counter()
+    with quiet_logging():
+        for path in paths:
+            randomize_metadata(path, randomize_windows_props=False, engine=engine)
+    return time.perf_counter() - started
+
+def bench_read(paths):
+    started = time.perf_counter()
+    for path in paths:
+        get_metadata_string(path)
+    return time.perf_counter() - started
+
+def bench_process_images(paths, engine, workers):
+    started = time.perf_counter()
+    with quiet_logging():
+        process_images(paths, display_after=False, randomize_windows_props=False, engine=engine, workers=workers)
+    return time.perf_counter() - started
+
+def bench_stages(paths, engine):
+    """Runs randomize_metadata with instrumentation and returns the average seconds per file for each stage."""
+    batch = BatchStats()
+    with quiet_logging():
+        for path in paths:
+            stats = FileStats(path)
+            randomize_metadata(path, randomize_windows_props=False, engine=engine, stats=stats)
+            batch.add(stats.to_dict())
+    return {name: seconds / len(paths) for name, seconds in batch.durations.items()}
+
+def run_benchmarks(corpus_dir, sizes, complexities, count, engine, workers):
+    records = []
+    for size_name in sizes:
+        for complexity in complexities:
+            corpus = f"{size_name}/{complexity}"
+            print(f"Preparing corpus {corpus} ({count} files)...")
+            paths = generate_corpus(corpus_dir, size_name, complexity, count)
+
+            remove_outputs(paths)
+            stages = bench_stages(paths, engine)
+            remove_outputs(paths)
+            records.append(make_record(corpus, f"randomize_metadata[{engine}]", paths,
+                                       measure(bench_randomize, paths, engine), stages))
+
+            records.append(make_record(corpus, "get_metadata_string", paths, measure(bench_read, paths)))
+
+            remove_outputs(paths)
+            records.append(make_record(corpus, f"process_images[{engine},workers={workers}]", paths,
+                                       measure(bench_process_images, paths, engine, workers)))
+            remove_outputs(paths)
+    return records
+
+def format_number(value, fmt):
+    return "-" if value is None else format(value, fmt)
+
+def print_report(records):
+    print(f"\n{'corpus':<16} {'benchmark':<40} {'files/s':>10} {'MB/s':>10} {'peak MB':>9}")
+    print("-" * 89)
+    for record in records:
+        print(f"{record['corpus']:<16} {record['benchmark']:<40} "
+              f"{format_number(record['files_per_sec'], '10.1f')} {format_number(record['mb_per_sec'], '10.1f')} "
+              f"{format_number(record['peak_rss_mb'], '9.1f')}")
+        if record['stages']:
+            stage_text = ", ".join(f"{name} {seconds * 1000:.2f}ms" for name, seconds in record['stages'].items())
+            print(f"{'':<16}   per file: {stage_text}")
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(records, baseline_path, tolerance):
+    """Prints benchmarks that got slower than the baseline by more than tolerance and returns their count."""
+    with open(baseline_path) as f:
+        baseline = {(r['corpus'], r['benchmark']): r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"\n=== Comparison with {baseline_path} ===")
+    for record in records:
+        old = baseline.get((record['corpus'], record['benchmark']))
+        if not old or not old['files_per_sec'] or not record['files_per_sec']:
+            continue
+        change = record['files_per_sec'] / old['files_per_sec'] - 1
+        marker = ""
+        if change < -tolerance:
+            marker = "  <-- REGRESSION"
+            regressions += 1
+        print(f"{record['corpus']:<16} {record['benchmark']:<40} {change:+8.1%}{marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Image Metadata Randomizer')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f"Comma separated size presets: {', '.join(SIZE_PRESETS)} (default: {DEFAULT_SIZES})")
+    parser.add_argument('--exif', default=DEFAULT_EXIF,
+                        help=f"Comma separated EXIF complexities: {', '.join(EXIF_COMPLEXITIES)} (default: {DEFAULT_EXIF})")
+    parser.add_argument('--files', type=int, default=20, help='Files per corpus (default: 20)')
+    parser.add_argument('--engine', choices=ENGINES, default='splice', help='Engine to benchmark (default: splice)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Workers for the process_images benchmark (default: CPU count)')
+    parser.add_argument('--corpus-dir', help='Where to generate (and reuse) the corpora (default: a temp folder)')
+    parser.add_argument('--json', metavar='PATH', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='PATH', help='Compare against a previous --json result file')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed files/sec slowdown before --compare reports a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    sizes = [name.strip() for name in args.sizes.split(',') if name.strip()]
+    complexities = [name.strip() for name in args.exif.split(',') if name.strip()]
+    unknown = [name for name in sizes if name not in SIZE_PRESETS] + \
+              [name for name in complexities if name not in EXIF_COMPLEXITIES]
+    if unknown:
+        parser.error(f"Unknown size preset or EXIF complexity: {', '.join(unknown)}")
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='randomizer_bench_')
+    records = run_benchmarks(corpus_dir, sizes, complexities, args.files, args.engine, args.workers)
+    print_report(records)
+
+    if args.json:
+        report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'settings': {'files': args.files, 'engine': args.engine, 'workers': args.workers},
+            'results': records,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote results to {args.json}")
+
+    if args.compare and compare_results(records, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
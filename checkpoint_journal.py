@@ -0,0 +1,89 @@
+"""
+Checkpoint journal for resuming an interrupted batch.
+
+The journal is an append-only JSON lines file with one line per finished input
+({"original": ..., "modified": ...}, absolute paths). Lines are buffered and
+written out in checkpoints of CHECKPOINT_INTERVAL files (flushed and fsync'ed),
+so a run that is killed loses at most the last unwritten checkpoint. A resumed
+run loads the journal and skips every input it lists whose output still exists.
+
+Unlike the processing manifest, the journal doesn't look at the inputs at all:
+it records the progress of one run, including runs over explicit file lists,
+without a manifest, or in place (where re-processing would randomize an
+already randomized file again).
+"""
+
+import json
+import os
+
+# Default journal file name, created next to the manifest
+JOURNAL_FILENAME = '.metadata_randomizer_journal.jsonl'
+
+# Finished files between checkpoints (each checkpoint is a disk sync)
+CHECKPOINT_INTERVAL = 100
+
+
+class CheckpointJournal:
+    """Append-only record of the inputs a batch has finished."""
+
+    def __init__(self, path, resume=False, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.done = {}
+        self._pending = []
+        if resume and os.path.exists(path):
+            self._load()
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            # A fresh run starts a fresh journal
+            self.file = open(path, 'w', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # A line cut short by the crash is dropped, so appended lines start cleanly
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) != len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(complete))
+        for line in complete.decode('utf-8', errors='replace').splitlines():
+            try:
+                entry = json.loads(line)
+                self.done[entry['original']] = entry['modified']
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def output_for(self, image_path):
+        """Returns the recorded output of image_path if the journal lists it and the output still exists."""
+        output = self.done.get(os.path.abspath(image_path))
+        if output is not None and os.path.exists(output):
+            return output
+        return None
+
+    def record(self, image_path, output_path):
+        """Records that image_path was finished and written to output_path."""
+        image_path = os.path.abspath(image_path)
+        output_path = os.path.abspath(output_path)
+        self.done[image_path] = output_path
+        self._pending.append(json.dumps({'original': image_path, 'modified': output_path}) + '\n')
+        if len(self._pending) >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Writes the buffered records out and syncs them to disk."""
+        if not self._pending:
+            return
+        self.file.writelines(self._pending)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._pending = []
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,130 @@
+"""
+Precompiled EXIF blocks for the metadata randomizer.
+
+Every randomized EXIF block has the same layout: the same tags in the same IFDs,
+with values of the same (or a bounded) size. ExifTemplate serializes that layout
+once with piexif.dump and records where each value lives in the result. Per file,
+the random values are packed straight into a copy of those bytes, which skips
+building an exif_dict and running the (slow, pure Python) serializer every time.
+"""
+
+import struct
+
+import piexif
+
+# The block piexif.dump produces: the APP1 identifier, then a big-endian TIFF header
+EXIF_PREFIX = b'Exif\x00\x00'
+TIFF_START = len(EXIF_PREFIX)
+
+# Tags in IFD0 that point to the Exif and GPS sub-IFDs
+EXIF_IFD_POINTER = piexif.ImageIFD.ExifTag
+GPS_IFD_POINTER = piexif.ImageIFD.GPSTag
+
+# Bytes per item for the TIFF field types the randomizer writes
+TYPE_SIZES = {
+    piexif.TYPES.Byte: 1,
+    piexif.TYPES.Ascii: 1,
+    piexif.TYPES.Short: 2,
+    piexif.TYPES.Long: 4,
+    piexif.TYPES.Rational: 8,
+    piexif.TYPES.Undefined: 1,
+    piexif.TYPES.SRational: 8,
+}
+
+# Room reserved for every templated ASCII value (including its NUL terminator)
+DEFAULT_ASCII_CAPACITY = 32
+
+
+def _read_ifd(data, ifd_offset):
+    """Returns {tag: (entry_offset, type, count, value_offset)} for the IFD at ifd_offset (relative to the TIFF header)."""
+    entries = {}
+    pos = TIFF_START + ifd_offset
+    (count,) = struct.unpack_from('>H', data, pos)
+    for index in range(count):
+        entry = pos + 2 + index * 12
+        tag, value_type, value_count, value_field = struct.unpack_from('>HHLL', data, entry)
+        if TYPE_SIZES.get(value_type, 8) * value_count <= 4:
+            value_offset = entry + 8
+        else:
+            value_offset = TIFF_START + value_field
+        entries[tag] = (entry, value_type, value_count, value_offset)
+    return entries
+
+
+def _pack_items(value_type, value):
+    """Packs a piexif-style value for a non-ASCII field and returns (bytes, item count)."""
+    if value_type in (piexif.TYPES.Byte, piexif.TYPES.Undefined):
+        packed = bytes(value) if not isinstance(value, int) else bytes((value,))
+        return packed, len(packed)
+    if value_type in (piexif.TYPES.Rational, piexif.TYPES.SRational):
+        items = (value,) if isinstance(value[0], int) else value
+        fmt = '>LL' if value_type == piexif.TYPES.Rational else '>ll'
+        return b''.join(struct.pack(fmt, *item) for item in items), len(items)
+    items = (value,) if isinstance(value, int) else value
+    fmt = '>H' if value_type == piexif.TYPES.Short else '>L'
+    return b''.join(struct.pack(fmt, item) for item in items), len(items)
+
+
+class ExifTemplate:
+    """
+    A serialized EXIF block whose variable fields can be patched in place.
+
+    prototype is an exif_dict with every field the files will carry, and fields
+    maps value names to the (ifd, tag) pairs they fill, e.g.
+    {'date': [('0th', DateTime), ('Exif', DateTimeOriginal)]}. Fields listed there
+    are patched by render(); everything else in the prototype is copied as is.
+    ASCII fields get ascii_capacity bytes each (short ones that fit inside their
+    IFD entry keep their size); numeric fields keep their prototype item count.
+    """
+
+    def __init__(self, prototype, fields, ascii_capacity=DEFAULT_ASCII_CAPACITY):
+        # Serialize with the widest possible strings so every value fits later on.
+        # Strings short enough to be stored inside their IFD entry stay that size.
+        padded = {ifd: dict(tags) if isinstance(tags, dict) else tags for ifd, tags in prototype.items()}
+        for targets in fields.values():
+            for ifd, tag in targets:
+                value = padded[ifd][tag]
+                if piexif.TAGS[ifd][tag]['type'] == piexif.TYPES.Ascii and len(value) + 1 > 4:
+                    padded[ifd][tag] = b'X' * (max(ascii_capacity, len(value) + 1) - 1)
+        self.data = piexif.dump(padded)
+        if not self.data.startswith(EXIF_PREFIX + b'MM'):
+            raise ValueError("Unexpected EXIF layout from piexif.dump")
+
+        (ifd0_offset,) = struct.unpack_from('>L', self.data, TIFF_START + 4)
+        ifds = {'0th': _read_ifd(self.data, ifd0_offset)}
+        for name, pointer in (('Exif', EXIF_IFD_POINTER), ('GPS', GPS_IFD_POINTER)):
+            if pointer in ifds['0th']:
+                (sub_offset,) = struct.unpack_from('>L', self.data, ifds['0th'][pointer][3])
+                ifds[name] = _read_ifd(self.data, sub_offset)
+
+        # name -> [(entry_offset, type, count, value_offset), ...]
+        self.slots = {name: [ifds[ifd][tag] for ifd, tag in targets] for name, targets in fields.items()}
+        # The prototype's own values, written to slots render() isn't given a value for
+        self.defaults = {name: prototype[targets[0][0]][targets[0][1]] for name, targets in fields.items()}
+
+    def render(self, values):
+        """
+        Returns a copy of the block with values (name -> piexif-style value) patched in.
+
+        Slots that are not in values get the prototype's value, never the padding
+        their serialized placeholder holds. Raises ValueError if a value doesn't
+        fit its slot.
+        """
+        data = bytearray(self.data)
+        for name, value in {**self.defaults, **values}.items():
+            for entry, value_type, count, value_offset in self.slots[name]:
+                if value_type == piexif.TYPES.Ascii:
+                    if isinstance(value, str):
+                        value = value.encode('ascii')
+                    packed = value + b'\x00'
+                    # A string short enough to sit inline would have to move into the entry itself
+                    if len(packed) > count or len(packed) <= 4 < count:
+                        raise ValueError(f"Value for '{name}' doesn't fit its template slot")
+                    struct.pack_into('>L', data, entry + 4, len(packed))
+                    data[value_offset:value_offset + count] = packed.ljust(count, b'\x00')
+                else:
+                    packed, items = _pack_items(value_type, value)
+                    if items != count:
+                        raise ValueError(f"Value for '{name}' has {items} items, the template slot {count}")
+                    data[value_offset:value_offset + len(packed)] = packed
+        return bytes(data)
@@ -0,0 +1,104 @@
+"""
+EXIF thumbnails for randomized JPEGs.
+
+Viewers and file managers show the small JPEG stored in the 1st IFD of the EXIF
+block instead of decoding the whole photo; without one, every tool that lists the
+archive has to regenerate it. make_thumbnail() builds one from the image using
+PIL's draft mode, which lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while
+decoding (reduced DCT), so only a fraction of the pixels is ever produced.
+attach_thumbnail() appends it to an already serialized EXIF block, so it works
+the same for template-rendered and piexif.dump blocks.
+"""
+
+import io
+import struct
+
+import piexif
+from PIL import Image
+
+from image_formats import tiff_byte_order, tiff_payload, read_tiff_ifd
+from jpeg_segments import EXIF_HEADER, MAX_SEGMENT_PAYLOAD
+
+# Largest thumbnail (width, height); 160x120 is what the EXIF standard suggests
+THUMBNAIL_SIZE = (160, 120)
+
+THUMBNAIL_QUALITY = 75
+
+# Compression value for a JPEG thumbnail in the 1st IFD
+JPEG_COMPRESSION = 6
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    """
+    Returns a baseline JPEG of image (an open PIL image) scaled to fit size, without any metadata.
+
+    If image hasn't been decoded yet, JPEGs are decoded at the smallest DCT scale
+    that still covers size. An already decoded image is only resized, never changed.
+    """
+    if image.mode not in ('RGB', 'L'):
+        image.draft('RGB', size)
+    else:
+        image.draft(image.mode, size)
+    width, height = image.size
+    scale = min(size[0] / width, size[1] / height, 1)
+    thumbnail = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BICUBIC,
+                             reducing_gap=2.0)
+    if thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, "jpeg", quality=quality)
+    return buffer.getvalue()
+
+
+def attach_thumbnail(exif_bytes, thumbnail):
+    """
+    Returns exif_bytes (an EXIF block starting with the APP1 identifier) with
+    thumbnail (JPEG bytes) stored in a new 1st IFD.
+
+    Raises ValueError if the block already has a 1st IFD or the result wouldn't
+    fit in a single APP1 segment.
+    """
+    if not exif_bytes.startswith(EXIF_HEADER):
+        raise ValueError("EXIF block without the Exif identifier")
+    tiff = bytearray(tiff_payload(exif_bytes))
+    order = tiff_byte_order(tiff)
+    (ifd0,) = struct.unpack_from(order + 'L', tiff, 4)
+    entries, next_ifd = read_tiff_ifd(tiff, ifd0, order)
+    if next_ifd:
+        raise ValueError("EXIF block already has a 1st IFD")
+    next_pointer = ifd0 + 2 + 12 * len(entries)
+    if next_pointer + 4 > len(tiff):
+        raise ValueError("EXIF block has no room for a 1st IFD pointer")
+
+    # TIFF offsets have to be even
+    ifd1 = len(tiff) + len(tiff) % 2
+    tags = [
+        (piexif.ImageIFD.Compression, piexif.TYPES.Short, JPEG_COMPRESSION),
+        (piexif.ImageIFD.XResolution, piexif.TYPES.Rational, (72, 1)),
+        (piexif.ImageIFD.YResolution, piexif.TYPES.Rational, (72, 1)),
+        (piexif.ImageIFD.ResolutionUnit, piexif.TYPES.Short, 2),
+        (piexif.ImageIFD.JPEGInterchangeFormat, piexif.TYPES.Long, None),
+        (piexif.ImageIFD.JPEGInterchangeFormatLength, piexif.TYPES.Long, len(thumbnail)),
+    ]
+    values_start = ifd1 + 2 + 12 * len(tags) + 4
+    thumbnail_start = values_start + 8 * sum(1 for _, value_type, _ in tags if value_type == piexif.TYPES.Rational)
+
+    ifd = bytearray(struct.pack(order + 'H', len(tags)))
+    values = bytearray()
+    for tag, value_type, value in tags:
+        if tag == piexif.ImageIFD.JPEGInterchangeFormat:
+            value = thumbnail_start
+        if value_type == piexif.TYPES.Rational:
+            ifd += struct.pack(order + 'HHLL', tag, value_type, 1, values_start + len(values))
+            values += struct.pack(order + 'LL', *value)
+        elif value_type == piexif.TYPES.Short:
+            ifd += struct.pack(order + 'HHLHH', tag, value_type, 1, value, 0)
+        else:
+            ifd += struct.pack(order + 'HHLL', tag, value_type, 1, value)
+    ifd += b'\x00\x00\x00\x00'
+
+    struct.pack_into(order + 'L', tiff, next_pointer, ifd1)
+    block = EXIF_HEADER + bytes(tiff) + b'\x00' * (ifd1 - len(tiff)) + bytes(ifd) + bytes(values) + thumbnail
+    if len(block) > MAX_SEGMENT_PAYLOAD:
+        raise ValueError(f"EXIF data with a thumbnail is too large for an APP1 segment ({len(block)} bytes)")
+    return block
@@ -0,0 +1,697 @@
+"""
+Metadata writers for every image format the randomizer supports.
+
+Like jpeg_segments does for JPEG, each writer here only rewrites the containers
+that hold metadata and copies everything else (the compressed image data
+included) through unchanged:
+
+- PNG: the eXIf, tEXt, zTXt, iTXt and tIME chunks are dropped and a new eXIf
+  chunk goes in front of the image data.
+- TIFF: the metadata tags of the first IFD (and the Exif/GPS IFDs they point
+  to) are zeroed, and a new first IFD with the kept image tags and the new
+  metadata is appended to the file.
+- WebP: the EXIF and XMP chunks are dropped and a new EXIF chunk is added
+  (simple lossy/lossless files get the VP8X header that announces it).
+- HEIF/HEIC: the Exif item's data is overwritten in place (or moved to a new
+  box at the end of the file if it doesn't fit) and XMP items are zeroed.
+
+All functions take the same bytes-like inputs as jpeg_segments (bytes,
+memoryview, mmap) and return lists of buffers that can go straight to
+file.writelines.
+"""
+
+import os
+import struct
+import zlib
+
+import jpeg_segments
+from jpeg_segments import EXIF_HEADER
+
+# File extension -> format name, for everything the randomizer can process
+FORMAT_EXTENSIONS = {
+    '.jpg': 'jpeg',
+    '.jpeg': 'jpeg',
+    '.png': 'png',
+    '.tif': 'tiff',
+    '.tiff': 'tiff',
+    '.webp': 'webp',
+    '.heic': 'heif',
+    '.heif': 'heif',
+}
+SUPPORTED_EXTENSIONS = tuple(FORMAT_EXTENSIONS)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Ancillary PNG chunks that only carry metadata. Colour chunks (iCCP, sRGB,
+# gAMA, cHRM) change how the pixels look and are kept.
+PNG_METADATA_CHUNKS = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+
+# WebP chunks that only carry metadata, and the VP8X flags announcing them
+WEBP_METADATA_CHUNKS = {b'EXIF', b'XMP '}
+WEBP_FLAG_XMP = 0x04
+WEBP_FLAG_EXIF = 0x08
+WEBP_FLAG_ALPHA = 0x10
+# Chunks that make up the image itself; EXIF goes right after the last of them
+WEBP_IMAGE_CHUNKS = {b'VP8X', b'ICCP', b'ANIM', b'ANMF', b'ALPH', b'VP8 ', b'VP8L'}
+
+# ftyp brands of HEIF files (HEIC, and plain HEIF image collections)
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1'}
+XMP_CONTENT_TYPE = b'application/rdf+xml'
+
+# Bytes per item for each TIFF field type
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TIFF_RATIONAL_TYPES = {5, 10}
+
+# TIFF tags (from piexif.ImageIFD) that point to sub-IFDs holding metadata
+EXIF_IFD_TAG = 34665
+GPS_IFD_TAG = 34853
+INTEROP_IFD_TAG = 40965
+TIFF_SUB_IFD_TAGS = {EXIF_IFD_TAG, GPS_IFD_TAG, INTEROP_IFD_TAG}
+
+# First-IFD tags that only describe the picture, not how to decode it
+TIFF_METADATA_TAGS = TIFF_SUB_IFD_TAGS | {
+    269,    # DocumentName
+    270,    # ImageDescription
+    271,    # Make
+    272,    # Model
+    285,    # PageName
+    305,    # Software
+    306,    # DateTime
+    315,    # Artist
+    316,    # HostComputer
+    700,    # XMLPacket (XMP)
+    18246,  # Rating
+    18249,  # RatingPercent
+    32781,  # ImageID
+    33432,  # Copyright
+    33723,  # IPTC
+    34377,  # ImageResources (Photoshop)
+    37393,  # ImageNumber
+    40091, 40092, 40093, 40094, 40095,  # XPTitle, XPComment, XPAuthor, XPKeywords, XPSubject
+    42016,  # ImageUniqueID
+    50341,  # PrintImageMatching
+}
+
+# Kept when the metadata of a TIFF is read (they affect how it is displayed)
+TIFF_DISPLAY_TAGS = {274, 282, 283, 296}  # Orientation, XResolution, YResolution, ResolutionUnit
+
+
+def detect_format(data):
+    """Return the format name ('jpeg', 'png', 'tiff', 'webp', 'heif') of the image in `data`, or None."""
+    head = bytes(data[:16])
+    if head.startswith(b'\xff\xd8'):
+        return 'jpeg'
+    if head.startswith(PNG_SIGNATURE):
+        return 'png'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+        return 'heif'
+    return None
+
+
+def format_for_path(path):
+    """Return the format name for a file name's extension, or None if it isn't supported."""
+    return FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def tiff_payload(exif_bytes):
+    """Strip the APP1 identifier from a piexif.dump blob, leaving the bare TIFF structure."""
+    if exif_bytes[:len(EXIF_HEADER)] == EXIF_HEADER:
+        return exif_bytes[len(EXIF_HEADER):]
+    return exif_bytes
+
+
+def _patched_parts(data, start, patches):
+    """
+    Return slices of `data` from `start` on, with each (begin, end, replacement)
+    patch applied; a replacement of None zeroes the range.
+
+    Zeroed ranges may overlap each other; ranges with a replacement must not overlap anything.
+    """
+    parts = []
+    pos = start
+    for begin, end, replacement in sorted(patches, key=lambda patch: patch[0]):
+        end = min(end, len(data))
+        if begin < pos:
+            if replacement is not None:
+                raise ValueError(f"Overlapping metadata at offset {begin}")
+            begin = pos
+        if end <= begin:
+            continue
+        parts.append(data[pos:begin])
+        parts.append(replacement if replacement is not None else bytes(end - begin))
+        pos = end
+    parts.append(data[pos:])
+    return parts
+
+
+# --- PNG ---
+
+def _iter_png_chunks(data):
+    """Yield (type, start, end) for every chunk of the PNG in `data`, up to and including IEND."""
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    pos = 8
+    size = len(data)
+    while pos + 12 <= size:
+        length, chunk_type = struct.unpack_from('>L4s', data, pos)
+        end = pos + 12 + length
+        if end > size:
+            raise ValueError(f"Corrupt PNG: truncated chunk at offset {pos}")
+        yield chunk_type, pos, end
+        if chunk_type == b'IEND':
+            return
+        pos = end
+    raise ValueError("Corrupt PNG: missing IEND chunk")
+
+
+def png_chunk(chunk_type, payload):
+    """Build a PNG chunk (length, type, payload and CRC)."""
+    return struct.pack('>L', len(payload)) + chunk_type + payload + struct.pack('>L', zlib.crc32(chunk_type + payload))
+
+
+def png_splice_parts(data, exif_bytes):
+    """
+    Return the pieces of the PNG `data` with its text, time and EXIF chunks
+    removed and `exif_bytes` stored as the only eXIf chunk, in front of the first IDAT.
+    """
+    exif_chunk = png_chunk(b'eXIf', bytes(tiff_payload(exif_bytes)))
+    parts = [data[:8]]
+    inserted = False
+    for chunk_type, start, end in _iter_png_chunks(data):
+        if chunk_type in PNG_METADATA_CHUNKS:
+            continue
+        if not inserted and chunk_type == b'IDAT':
+            parts.append(exif_chunk)
+            inserted = True
+        parts.append(data[start:end])
+    if not inserted:
+        raise ValueError("Corrupt PNG: no image data")
+    return parts
+
+
+def _png_exif_payload(data):
+    for chunk_type, start, end in _iter_png_chunks(data):
+        if chunk_type == b'eXIf':
+            return EXIF_HEADER + bytes(data[start + 8:end - 4])
+    return None
+
+
+# --- WebP ---
+
+def _iter_riff_chunks(data):
+    """Yield (fourcc, start, end) for every chunk of the WebP in `data`; `end` includes the pad byte."""
+    if data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise ValueError("Not a WebP file")
+    (riff_size,) = struct.unpack_from('<L', data, 4)
+    size = min(8 + riff_size, len(data))
+    pos = 12
+    while pos + 8 <= size:
+        fourcc, length = struct.unpack_from('<4sL', data, pos)
+        if pos + 8 + length > size:
+            raise ValueError(f"Corrupt WebP: truncated chunk at offset {pos}")
+        end = min(pos + 8 + length + (length & 1), size)
+        yield fourcc, pos, end
+        pos = end
+
+
+def _webp_canvas(data, fourcc, start):
+    """Return (width, height, has_alpha) from the bitstream header of a simple (VP8/VP8L) WebP."""
+    payload = start + 8
+    if fourcc == b'VP8 ':
+        # 3 byte frame tag, 3 byte start code, then 14 bit width and height
+        if data[payload + 3:payload + 6] != b'\x9d\x01\x2a':
+            raise ValueError("Corrupt WebP: bad VP8 frame header")
+        width, height = struct.unpack_from('<HH', data, payload + 6)
+        return width & 0x3FFF, height & 0x3FFF, False
+    if fourcc == b'VP8L':
+        if data[payload] != 0x2F:
+            raise ValueError("Corrupt WebP: bad VP8L signature")
+        (bits,) = struct.unpack_from('<L', data, payload + 1)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    raise ValueError(f"Unsupported WebP: unexpected first chunk {fourcc!r}")
+
+
+def webp_splice_parts(data, exif_bytes):
+    """
+    Return the pieces of the WebP `data` with its EXIF and XMP chunks removed and
+    `exif_bytes` stored as the only EXIF chunk, with the RIFF size and VP8X flags updated.
+    """
+    payload = bytes(tiff_payload(exif_bytes))
+    exif_chunk = b'EXIF' + struct.pack('<L', len(payload)) + payload + b'\x00' * (len(payload) & 1)
+
+    chunks = list(_iter_riff_chunks(data))
+    if not chunks:
+        raise ValueError("Corrupt WebP: no image data")
+    fourcc, start, end = chunks[0]
+    if fourcc == b'VP8X':
+        header = bytearray(data[start:end])
+        header[8] = (header[8] & ~WEBP_FLAG_XMP) | WEBP_FLAG_EXIF
+        chunks = chunks[1:]
+    else:
+        # A simple file can't carry metadata; give it the extended header
+        width, height, has_alpha = _webp_canvas(data, fourcc, start)
+        flags = WEBP_FLAG_EXIF | (WEBP_FLAG_ALPHA if has_alpha else 0)
+        header = (b'VP8X' + struct.pack('<LB3x', 10, flags) +
+                  (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+    parts = [bytes(header)]
+
+    inserted = False
+    for fourcc, start, end in chunks:
+        if fourcc in WEBP_METADATA_CHUNKS:
+            continue
+        if not inserted and fourcc not in WEBP_IMAGE_CHUNKS:
+            parts.append(exif_chunk)
+            inserted = True
+        parts.append(data[start:end])
+    if not inserted:
+        parts.append(exif_chunk)
+
+    riff_size = 4 + sum(len(part) for part in parts)
+    return [b'RIFF' + struct.pack('<L', riff_size) + b'WEBP'] + parts
+
+
+def _webp_exif_payload(data):
+    for fourcc, start, end in _iter_riff_chunks(data):
+        if fourcc == b'EXIF':
+            (length,) = struct.unpack_from('<L', data, start + 4)
+            payload = bytes(data[start + 8:start + 8 + length])
+            return payload if payload.startswith(EXIF_HEADER) else EXIF_HEADER + payload
+    return None
+
+
+# --- TIFF ---
+
+def tiff_byte_order(data):
+    if data[:4] == b'II*\x00':
+        return '<'
+    if data[:4] == b'MM\x00*':
+        return '>'
+    if data[:2] in (b'II', b'MM'):
+        raise ValueError("BigTIFF files are not supported")
+    raise ValueError("Not a TIFF file")
+
+
+def read_tiff_ifd(data, offset, order):
+    """
+    Return ([(tag, type, count, entry_offset, value_offset, size)], next_ifd_offset)
+    for the IFD at `offset` (offsets are relative to the start of `data`).
+    """
+    if offset + 2 > len(data):
+        raise ValueError(f"Corrupt TIFF: IFD offset {offset} is past the end of the file")
+    (count,) = struct.unpack_from(order + 'H', data, offset)
+    end = offset + 2 + 12 * count
+    if end > len(data):
+        raise ValueError(f"Corrupt TIFF: truncated IFD at offset {offset}")
+    entries = []
+    for index in range(count):
+        entry = offset + 2 + 12 * index
+        tag, value_type, value_count = struct.unpack_from(order + 'HHL', data, entry)
+        size = TIFF_TYPE_SIZES.get(value_type, 1) * value_count
+        if size <= 4:
+            value_offset = entry + 8
+        else:
+            (value_offset,) = struct.unpack_from(order + 'L', data, entry + 8)
+        entries.append((tag, value_type, value_count, entry, value_offset, size))
+    # Some writers (piexif among them) leave out the next-IFD pointer of the last IFD
+    next_ifd = struct.unpack_from(order + 'L', data, end)[0] if end + 4 <= len(data) else 0
+    return entries, next_ifd
+
+
+def _convert_byte_order(value, value_type, source, target):
+    """Re-pack the items of a TIFF value from one byte order to the other."""
+    size = 4 if value_type in TIFF_RATIONAL_TYPES else TIFF_TYPE_SIZES.get(value_type, 1)
+    if source == target or size == 1:
+        return value
+    return b''.join(value[i:i + size][::-1] for i in range(0, len(value), size))
+
+
+def _pack_tiff_ifd(entries, offset, next_ifd, order):
+    """
+    Serialize an IFD that will live at `offset`, followed by its out-of-line values.
+
+    `entries` are (tag, type, count, value) tuples; a type of None means value
+    is a complete 12-byte entry to copy as is. The result has an even length.
+    """
+    entries = sorted(entries, key=lambda entry: entry[0])
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    table = [struct.pack(order + 'H', len(entries))]
+    values = []
+    for tag, value_type, count, value in entries:
+        if value_type is None:
+            table.append(value)
+        elif len(value) <= 4:
+            table.append(struct.pack(order + 'HHL', tag, value_type, count) + value.ljust(4, b'\x00'))
+        else:
+            table.append(struct.pack(order + 'HHLL', tag, value_type, count, data_offset))
+            padded = value + b'\x00' * (len(value) & 1)
+            values.append(padded)
+            data_offset += len(padded)
+    table.append(struct.pack(order + 'L', next_ifd))
+    return b''.join(table + values)
+
+
+def _tiff_values(data, entries, source, target):
+    """Return (tag, type, count, value) tuples for `entries`, converted to the `target` byte order."""
+    return [(tag, value_type, count,
+             _convert_byte_order(bytes(data[value_offset:value_offset + size]), value_type, source, target))
+            for tag, value_type, count, entry, value_offset, size in entries]
+
+
+def _tiff_metadata_ranges(data, tag, value_offset, size, order, seen):
+    """Return the byte ranges holding a metadata tag's value, including any sub-IFD it points to."""
+    ranges = []
+    if size > 4:
+        ranges.append((value_offset, value_offset + size))
+    if tag in TIFF_SUB_IFD_TAGS and size == 4:
+        (sub_ifd,) = struct.unpack_from(order + 'L', data, value_offset)
+        if sub_ifd in seen or sub_ifd + 2 > len(data):
+            return ranges
+        seen.add(sub_ifd)
+        entries, _ = read_tiff_ifd(data, sub_ifd, order)
+        ranges.append((sub_ifd, sub_ifd + 6 + 12 * len(entries)))
+        for sub_tag, _, _, _, sub_value_offset, sub_size in entries:
+            ranges.extend(_tiff_metadata_ranges(data, sub_tag if sub_tag == INTEROP_IFD_TAG else None,
+                                                sub_value_offset, sub_size, order, seen))
+    return ranges
+
+
+def _read_generated_ifds(exif_bytes, order):
+    """Return {'0th': [...], 'Exif': [...], 'GPS': [...]} value tuples from a piexif.dump blob."""
+    tiff = memoryview(tiff_payload(exif_bytes))
+    source = tiff_byte_order(tiff)
+    (ifd0,) = struct.unpack_from(source + 'L', tiff, 4)
+    entries, _ = read_tiff_ifd(tiff, ifd0, source)
+    ifds = {'0th': [], 'Exif': [], 'GPS': []}
+    for name, pointer in (('Exif', EXIF_IFD_TAG), ('GPS', GPS_IFD_TAG)):
+        for tag, _, _, _, value_offset, _ in entries:
+            if tag == pointer:
+                (sub_ifd,) = struct.unpack_from(source + 'L', tiff, value_offset)
+                sub_entries, _ = read_tiff_ifd(tiff, sub_ifd, source)
+                ifds[name] = _tiff_values(tiff, [e for e in sub_entries if e[0] != INTEROP_IFD_TAG], source, order)
+    ifds['0th'] = _tiff_values(tiff, [e for e in entries if e[0] not in TIFF_SUB_IFD_TAGS], source, order)
+    return ifds
+
+
+def tiff_splice_parts(data, exif_bytes):
+    """
+    Return the pieces of the TIFF `data` with the metadata of its first IFD
+    replaced by the tags in `exif_bytes` (a piexif.dump blob).
+
+    The old metadata values, the Exif/GPS IFDs they point to and the old IFD
+    table are zeroed in place. A new first IFD (the kept image tags, which still
+    point at the unchanged strips/tiles, plus the new metadata) and new Exif/GPS
+    IFDs are appended at the end of the file and the header is pointed at them.
+    Tags the file already has (resolution, orientation) are not overridden.
+    Further IFDs (pages, thumbnails) are left as they are.
+    """
+    order = tiff_byte_order(data)
+    (ifd0,) = struct.unpack_from(order + 'L', data, 4)
+    entries, next_ifd = read_tiff_ifd(data, ifd0, order)
+
+    zeroed = [(ifd0, ifd0 + 6 + 12 * len(entries), None)]
+    kept = []
+    seen = {ifd0}
+    for tag, value_type, count, entry, value_offset, size in entries:
+        if tag in TIFF_METADATA_TAGS:
+            zeroed.extend((start, end, None)
+                          for start, end in _tiff_metadata_ranges(data, tag, value_offset, size, order, seen))
+        else:
+            kept.append((tag, None, None, bytes(data[entry:entry + 12])))
+    kept_tags = {entry[0] for entry in kept}
+
+    generated = _read_generated_ifds(exif_bytes, order)
+    offset = len(data) + (len(data) & 1)
+    appended = [b'\x00' * (len(data) & 1)]
+    ifd0_entries = kept + [entry for entry in generated['0th'] if entry[0] not in kept_tags]
+    for name, pointer in (('Exif', EXIF_IFD_TAG), ('GPS', GPS_IFD_TAG)):
+        if generated[name]:
+            ifd = _pack_tiff_ifd(generated[name], offset, 0, order)
+            appended.append(ifd)
+            ifd0_entries.append((pointer, 4, 1, struct.pack(order + 'L', offset)))
+            offset += len(ifd)
+    appended.append(_pack_tiff_ifd(ifd0_entries, offset, next_ifd, order))
+
+    header = bytes(data[:4]) + struct.pack(order + 'L', offset)
+    return [header] + _patched_parts(data, 8, zeroed) + appended
+
+
+def _tiff_exif_payload(data):
+    """Build a standalone EXIF block from the metadata tags of a TIFF's first IFD (and its Exif/GPS IFDs)."""
+    order = tiff_byte_order(data)
+    (ifd0,) = struct.unpack_from(order + 'L', data, 4)
+    entries, _ = read_tiff_ifd(data, ifd0, order)
+    wanted = (TIFF_METADATA_TAGS | TIFF_DISPLAY_TAGS) - TIFF_SUB_IFD_TAGS
+    ifd0_entries = _tiff_values(data, [e for e in entries if e[0] in wanted], order, order)
+
+    # Lay out [header][Exif IFD][GPS IFD][IFD0] with offsets relative to the header
+    offset = 8
+    blocks = []
+    for pointer in (EXIF_IFD_TAG, GPS_IFD_TAG):
+        for tag, _, _, _, value_offset, size in entries:
+            if tag == pointer and size == 4:
+                (sub_ifd,) = struct.unpack_from(order + 'L', data, value_offset)
+                sub_entries, _ = read_tiff_ifd(data, sub_ifd, order)
+                sub_entries = [e for e in sub_entries if e[0] != INTEROP_IFD_TAG]
+                block = _pack_tiff_ifd(_tiff_values(data, sub_entries, order, order), offset, 0, order)
+                blocks.append(block)
+                ifd0_entries.append((pointer, 4, 1, struct.pack(order + 'L', offset)))
+                offset += len(block)
+    if not ifd0_entries:
+        return None
+    blocks.append(_pack_tiff_ifd(ifd0_entries, offset, 0, order))
+    return EXIF_HEADER + bytes(data[:4]) + struct.pack(order + 'L', offset) + b''.join(blocks)
+
+
+# --- HEIF ---
+
+def _iter_boxes(data, start, end):
+    """Yield (type, box_start, payload_start, box_end) for the ISO BMFF boxes between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>L4s', data, pos)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from('>Q', data, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"Corrupt HEIF: bad box size at offset {pos}")
+        yield box_type, pos, pos + header, pos + size
+        pos += size
+
+
+def _read_uint(data, pos, size):
+    return int.from_bytes(data[pos:pos + size], 'big') if size else 0
+
+
+def _heif_items(data):
+    """
+    Return (item types, item locations, iloc field sizes) from the HEIF meta box.
+
+    Item types map item_ID -> (item_type, content_type). Locations map
+    item_ID -> [(absolute_offset, length, offset_field, length_field, base_offset)],
+    where the field offsets point at the iloc bytes holding each extent's position.
+    """
+    meta = None
+    for box_type, _, payload, end in _iter_boxes(data, 0, len(data)):
+        if box_type == b'meta':
+            meta = (payload + 4, end)  # meta is a FullBox
+            break
+    if meta is None:
+        raise ValueError("Corrupt HEIF: no meta box")
+
+    items = {}
+    locations = {}
+    iloc_sizes = None
+    idat_start = None
+    iloc = None
+    for box_type, _, payload, end in _iter_boxes(data, *meta):
+        if box_type == b'idat':
+            idat_start = payload
+        elif box_type == b'iloc':
+            iloc = (payload, end)
+        elif box_type == b'iinf':
+            version = data[payload]
+            pos = payload + 4 + (2 if version == 0 else 4)
+            for info_type, _, info, info_end in _iter_boxes(data, pos, end):
+                if info_type != b'infe' or data[info] < 2:
+                    continue
+                id_size = 2 if data[info] == 2 else 4
+                item_id = _read_uint(data, info + 4, id_size)
+                type_pos = info + 4 + id_size + 2
+                item_type = bytes(data[type_pos:type_pos + 4])
+                content_type = None
+                if item_type == b'mime':
+                    name_end = type_pos + 4 + bytes(data[type_pos + 4:info_end]).find(b'\x00')
+                    content_type = bytes(data[name_end + 1:info_end]).split(b'\x00')[0]
+                items[item_id] = (item_type, content_type)
+    if iloc is None:
+        raise ValueError("Corrupt HEIF: no iloc box")
+
+    pos, end = iloc
+    version = data[pos]
+    offset_size, length_size = data[pos + 4] >> 4, data[pos + 4] & 0x0F
+    base_offset_size = data[pos + 5] >> 4
+    index_size = data[pos + 5] & 0x0F if version in (1, 2) else 0
+    iloc_sizes = (offset_size, length_size)
+    id_size = 2 if version < 2 else 4
+    pos += 6
+    item_count = _read_uint(data, pos, id_size)
+    pos += id_size
+    for _ in range(item_count):
+        item_id = _read_uint(data, pos, id_size)
+        pos += id_size
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = data[pos + 1] & 0x0F
+            pos += 2
+        pos += 2  # data_reference_index
+        base_offset = _read_uint(data, pos, base_offset_size)
+        pos += base_offset_size
+        extent_count = _read_uint(data, pos, 2)
+        pos += 2
+        extents = []
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset = _read_uint(data, pos, offset_size)
+            length = _read_uint(data, pos + offset_size, length_size)
+            if construction_method == 0:
+                start = base_offset + extent_offset
+            elif construction_method == 1 and idat_start is not None:
+                start = idat_start + base_offset + extent_offset
+            else:
+                start = None
+            extents.append((start, length, pos, pos + offset_size, base_offset))
+            pos += offset_size + length_size
+        locations[item_id] = (construction_method, extents)
+        if pos > end:
+            raise ValueError("Corrupt HEIF: truncated iloc box")
+    return items, locations, iloc_sizes
+
+
+def _heif_metadata_items(data):
+    """Return (Exif item IDs, XMP item IDs, locations, iloc field sizes)."""
+    items, locations, iloc_sizes = _heif_items(data)
+    exif_ids = [item_id for item_id, (item_type, _) in items.items() if item_type == b'Exif']
+    xmp_ids = [item_id for item_id, (item_type, content_type) in items.items()
+               if item_type == b'mime' and content_type == XMP_CONTENT_TYPE]
+    for item_id in exif_ids + xmp_ids:
+        if item_id not in locations or any(start is None for start, *_ in locations[item_id][1]):
+            raise ValueError(f"Unsupported HEIF: can't locate the data of metadata item {item_id}")
+    return exif_ids, xmp_ids, locations, iloc_sizes
+
+
+def heif_splice_parts(data, exif_bytes):
+    """
+    Return the pieces of the HEIF `data` with the Exif item replaced by
+    `exif_bytes` and every XMP item zeroed.
+
+    The new block is written over the old one (padded with zeros) when it fits.
+    Otherwise it goes into a new mdat box at the end of the file, the item's
+    location is updated and the old data is zeroed. The image items and the
+    meta box layout are not changed. Files without an Exif item can't get one
+    without rebuilding the meta box and raise ValueError.
+    """
+    exif_ids, xmp_ids, locations, (offset_size, length_size) = _heif_metadata_items(data)
+    if not exif_ids:
+        raise ValueError("Unsupported HEIF: no Exif item to replace")
+    tiff = bytes(tiff_payload(exif_bytes))
+    # An Exif item starts with the offset from the end of that field to the TIFF header
+    payload = struct.pack('>L', len(EXIF_HEADER)) + EXIF_HEADER + tiff
+
+    patches = []
+    appended = []
+    for item_id in exif_ids + xmp_ids:
+        for start, length, _, _, _ in locations[item_id][1]:
+            patches.append((start, start + length, None))
+
+    construction_method, extents = locations[exif_ids[0]]
+    start, length, offset_field, length_field, base_offset = extents[0]
+    if len(extents) == 1 and 0 < len(payload) <= length:
+        patches[0] = (start, start + length, payload.ljust(length, b'\x00'))
+    else:
+        new_offset = len(data) + 8 - base_offset
+        if (construction_method != 0 or len(extents) != 1 or not offset_size or not length_size
+                or new_offset >= 1 << (8 * offset_size) or len(payload) >= 1 << (8 * length_size)):
+            raise ValueError("Unsupported HEIF: the Exif item can't be moved")
+        last_box = None
+        for last_box in _iter_boxes(data, 0, len(data)):
+            pass
+        if last_box is not None and _read_uint(data, last_box[1], 4) == 0:
+            raise ValueError("Unsupported HEIF: the last box runs to the end of the file")
+        patches.append((offset_field, offset_field + offset_size, new_offset.to_bytes(offset_size, 'big')))
+        patches.append((length_field, length_field + length_size, len(payload).to_bytes(length_size, 'big')))
+        appended.append(struct.pack('>L4s', 8 + len(payload), b'mdat') + payload)
+
+    return _patched_parts(data, 0, patches) + appended
+
+
+def _heif_exif_payload(data):
+    exif_ids, _, locations, _ = _heif_metadata_items(data)
+    if not exif_ids:
+        return None
+    payload = b''.join(bytes(data[start:start + length]) for start, length, *_ in locations[exif_ids[0]][1])
+    if len(payload) < 4:
+        return None
+    tiff_start = 4 + _read_uint(payload, 0, 4)
+    tiff = payload[tiff_start:]
+    return EXIF_HEADER + tiff if tiff[:2] in (b'II', b'MM') else None
+
+
+# --- Dispatch ---
+
+_SPLICERS = {
+    'png': png_splice_parts,
+    'tiff': tiff_splice_parts,
+    'webp': webp_splice_parts,
+    'heif': heif_splice_parts,
+}
+
+_EXIF_READERS = {
+    'jpeg': jpeg_segments.find_exif_payload,
+    'png': _png_exif_payload,
+    'tiff': _tiff_exif_payload,
+    'webp': _webp_exif_payload,
+    'heif': _heif_exif_payload,
+}
+
+
+def splice_metadata_parts(data, exif_bytes, keep_icc=False):
+    """
+    Return the pieces of the image in `data` with all its metadata replaced by
+    `exif_bytes` (a piexif.dump blob), as a list of buffers.
+
+    The format is detected from the content, so misnamed files are handled.
+    `keep_icc` keeps a JPEG's ICC profile segments; the other formats always
+    keep their colour profile (PNG iCCP, WebP ICCP, the TIFF ICC tag, HEIF colr).
+    Raises ValueError for unsupported or corrupt files.
+    """
+    image_format = detect_format(data)
+    if image_format is None:
+        raise ValueError("Unsupported image format")
+    if image_format == 'jpeg':
+        return jpeg_segments.splice_parts(data, exif_bytes, keep_icc=keep_icc)
+    return _SPLICERS[image_format](data, exif_bytes)
+
+
+def find_exif_payload(data):
+    """
+    Return the EXIF block (starting with b'Exif\\0\\0') of the image in `data`, or None.
+
+    Only the metadata containers are parsed; the image data is skipped over.
+    Raises ValueError for unsupported or corrupt files.
+    """
+    image_format = detect_format(data)
+    if image_format is None:
+        raise ValueError("Unsupported image format")
+    return _EXIF_READERS[image_format](data)
+
+
+def read_exif_payload(path):
+    """Return the EXIF block of the image file at `path` (see find_exif_payload), or None."""
+    with jpeg_segments.mapped_file(path) as data:
+        return find_exif_payload(data)
@@ -7,185 +7,840 @@ import io
 import subprocess
 import sys
 import argparse
-import glob
-
-def randomize_metadata(image_path, randomize_all=True, randomize_windows_props=True):
-    # Get the directory and filename from the input path
-    directory = os.path.dirname(image_path)
-    filename = os.path.basename(image_path)
-    # Create output path in the same directory but with "modified_" prefix
-    output_path = os.path.join(directory, f"modified_{filename}")
-    
+import fnmatch
+import shutil
+import re
+import logging
+import hashlib
+import json
+import sqlite3
+import secrets
+import asyncio
+import threading
+import struct
+import socket
+import time
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from functools import partial
+
+from jpeg_segments import mapped_file, frame_size
+from image_formats import (SUPPORTED_EXTENSIONS, detect_format, format_for_path, splice_metadata_parts,
+                           find_exif_payload, read_exif_payload)
+from metadata_policy import compile_policy, load_policy, read_source_tags, KEEP, DROP, RANDOMIZE, FIXED
+from processing_manifest import ProcessingManifest, MANIFEST_FILENAME
+from checkpoint_journal import CheckpointJournal, JOURNAL_FILENAME
+from instrumentation import FileStats, BatchStats
+from exif_template import ExifTemplate
+from exif_thumbnail import make_thumbnail, attach_thumbnail
+from work_queue import open_queue, PENDING, LEASED, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+from result_cache import ResultCache, content_digest, DEFAULT_MAX_BYTES as DEFAULT_CACHE_BYTES
+
+try:
+    import numpy as np
+except ImportError: # Optional: only used to pre-draw random values in bulk
+    np = None
+from batch_reporting import ProgressLine, AsyncJsonlWriter
+
+logger = logging.getLogger('image_metadata_randomizer')
+
+# Seeded runs date their photos relative to this fixed point instead of "now",
+# so the same seed gives the same output on any day
+SEEDED_REFERENCE_DATE = datetime.datetime(2025, 1, 1, 12, 0, 0)
+
+# Prefix added to the file name of every output image
+OUTPUT_PREFIX = 'modified_'
+
+# Output file name next to the source. Templates can use {name} (the input file
+# name), {stem} (without extension) and {ext} (with the dot).
+DEFAULT_NAME_TEMPLATE = OUTPUT_PREFIX + '{name}'
+
+# JPEG file extensions (compared case-insensitively). The batch tools pick up
+# every format in image_formats.SUPPORTED_EXTENSIONS.
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Output engines for randomize_metadata
+ENGINES = ('splice', 're-encode')
+
+# Largest image (width * height) the re-encode engine will decode. A 100 MP RGB
+# image already needs ~300 MB for the pixel buffer alone. None disables the check.
+DEFAULT_MAX_PIXELS = 100_000_000
+
+# Suffix of the temp files outputs are written to before being renamed into place
+TEMP_SUFFIX = '.tmp'
+
+# Names atomic_output gives its temp files: .<name>.<12 hex digits>.tmp
+TEMP_OUTPUT_PATTERN = re.compile(r'\..+\.[0-9a-f]{12}' + re.escape(TEMP_SUFFIX))
+
+# Temp files younger than this (in seconds) may belong to a batch that is still running
+TEMP_SWEEP_MIN_AGE = 60
+
+# How many files each pool worker may have queued at once in process_images
+QUEUE_DEPTH_PER_WORKER = 2
+
+# Files arandomize_many() works on at once unless told otherwise
+DEFAULT_ASYNC_CONCURRENCY = 4
+
+# Seconds between queue polls of idle queue workers and of the coordinator
+QUEUE_POLL_INTERVAL = 1.0
+
+# Seconds a paused batch waits for files in flight before checking whether it was resumed
+PAUSE_POLL_INTERVAL = 0.1
+
+# Paths put on a work queue per transaction
+ENQUEUE_BATCH_SIZE = 1000
+
+def exceeds_pixel_limit(image, max_pixels):
+    """
+    Checks the dimensions of image (a path or a bytes-like buffer) against max_pixels without decoding it.
+
+    JPEG dimensions come from the frame header. Other formats are probed with
+    PIL, and images past its decompression bomb limit count as too large.
+    """
+    if not max_pixels:
+        return False
+    size = None
+    with ExitStack() as stack:
+        data = stack.enter_context(mapped_file(image)) if isinstance(image, (str, os.PathLike)) else image
+        if detect_format(data) == 'jpeg':
+            try:
+                size = frame_size(data)
+            except ValueError:
+                pass
+    if size is None:
+        try:
+            with Image.open(image if isinstance(image, (str, os.PathLike)) else io.BytesIO(image)) as probe:
+                size = probe.size
+        except Image.DecompressionBombError:
+            return True
+    width, height = size
+    return width * height > max_pixels
+
+def strip_metadata(image):
+    """Decodes the image in place and drops all parsed metadata, reusing the pixel buffer."""
+    image.load()
+    # JPEG/PNG save reads things like comments and ICC profiles back out of image.info
+    image.info = {}
+    return image
+
+@contextmanager
+def atomic_output(output_path, fsync=False, mode_from=None):
+    """
+    Context manager yielding a binary file that replaces output_path when the block succeeds.
+
+    Data goes to a hidden temp file in the target folder which is then renamed over
+    output_path, so readers never see a half-written file and Windows Explorer picks
+    the output up as a brand new file. On error the temp file is removed. With
+    mode_from (a path), the output gets that file's permission bits instead of the umask's.
+    """
+    directory, filename = os.path.split(output_path)
+    temp_path = os.path.join(directory, f".{filename}.{secrets.token_hex(6)}{TEMP_SUFFIX}")
+    # os.open instead of tempfile so the output gets normal (umask based) permissions
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
     try:
-        # Open the image
-        print(f"Processing image: {image_path}")
-        image = Image.open(image_path)
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode_from is not None:
+            shutil.copymode(mode_from, temp_path)
+        os.replace(temp_path, output_path)
+        if fsync and hasattr(os, 'O_DIRECTORY'):
+            # Make the rename itself durable
+            dir_fd = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def sweep_temp_outputs(folder, recursive=True, min_age=TEMP_SWEEP_MIN_AGE):
+    """
+    Removes the temp files atomic_output left in folder (and its subfolders) when a run was killed.
+
+    Only files named like atomic_output's temp files and not modified for
+    min_age seconds are removed. Returns the number of files removed.
+    """
+    removed = 0
+    cutoff = time.time() - min_age
+    for directory, subdirectories, filenames in os.walk(folder):
+        if not recursive:
+            subdirectories.clear()
+        for filename in filenames:
+            if not TEMP_OUTPUT_PATTERN.fullmatch(filename):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+                    logger.debug("Removed orphaned temp output %s", path)
+            except OSError as e:
+                logger.warning("Could not remove temp output %s: %s", path, e)
+    return removed
+
+def sweep_output_folders(image_paths, layout, min_age=TEMP_SWEEP_MIN_AGE):
+    """
+    Yields image_paths, first sweeping (see sweep_temp_outputs) the folder layout writes each one's output to.
+
+    Every folder is swept once, when the first input that writes there comes up,
+    so a streamed scan starts right away and folders the scan skips (excluded,
+    too deep) are never walked.
+    """
+    swept = set()
+    for image_path in image_paths:
+        directory = os.path.dirname(layout.path_for(image_path)) or os.curdir
+        if directory not in swept:
+            swept.add(directory)
+            if os.path.isdir(directory):
+                removed = sweep_temp_outputs(directory, recursive=False, min_age=min_age)
+                if removed:
+                    logger.info("Removed %d temp files left by an interrupted run in '%s'", removed, directory)
+        yield image_path
+
+class OutputLayout:
+    """
+    Decides where the randomized copy of each input is written.
+
+    By default outputs go next to their source, named by name_template. With
+    output_dir they go into a separate tree instead (named '{name}' unless a
+    template is given): files under input_root keep their relative folders there,
+    other files land at its top (batches reject an input whose output another one
+    already writes, see _output_conflict). With in_place the source itself is replaced;
+    like every output it is written to a temp file and renamed over the original.
+    """
+
+    def __init__(self, output_dir=None, input_root=None, name_template=None, in_place=False):
+        if in_place and (output_dir or name_template):
+            raise ValueError("In-place mode can't be combined with an output folder or name template")
+        if name_template is None:
+            name_template = '{name}' if output_dir else DEFAULT_NAME_TEMPLATE
+        self.output_dir = output_dir
+        self.input_root = input_root
+        self.name_template = name_template
+        self.in_place = in_place
+        try:
+            self.output_name('image.jpg')
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"Invalid name template '{name_template}': {e}")
+
+    def output_name(self, filename):
+        stem, ext = os.path.splitext(filename)
+        return self.name_template.format(name=filename, stem=stem, ext=ext)
+
+    def path_for(self, image_path):
+        """Returns the output path for image_path."""
+        if self.in_place:
+            return image_path
+        directory, filename = os.path.split(image_path)
+        if self.output_dir:
+            directory = self.output_dir
+            if self.input_root:
+                relative_dir = os.path.relpath(os.path.dirname(os.path.abspath(image_path)),
+                                               os.path.abspath(self.input_root))
+                if relative_dir != os.curdir and not relative_dir.startswith(os.pardir):
+                    directory = os.path.join(self.output_dir, relative_dir)
+        return os.path.join(directory, self.output_name(filename))
+
+    def scan_excludes(self, folder):
+        """Returns scan_images exclude patterns that keep a scan of folder from picking up outputs."""
+        if self.in_place:
+            return []
+        if self.output_dir:
+            relative = os.path.relpath(os.path.abspath(self.output_dir), os.path.abspath(folder))
+            if relative.startswith(os.pardir):
+                # Outputs are outside the scanned tree
+                return []
+            if relative != os.curdir:
+                return [relative.replace(os.sep, '/')]
+        return [self.name_template.format(name='*', stem='*', ext='*')]
+
+# Where outputs go when no layout is given
+DEFAULT_LAYOUT = OutputLayout()
+
+def _output_conflict(claimed, layout, image_path):
+    """
+    Records image_path's output path (under layout) in claimed and returns None, or returns a
+    failed result if an earlier input of the batch already writes there.
+
+    Same-named files from different folders flattened into one output folder
+    would otherwise overwrite each other.
+    """
+    output_path = os.path.normcase(os.path.abspath(layout.path_for(image_path)))
+    owner = claimed.setdefault(output_path, image_path)
+    if owner == image_path:
+        return None
+    error = f"its output {output_path} is already written for '{owner}'"
+    logger.error("Skipping image '%s': %s", image_path, error)
+    return {'original': image_path, 'modified': None, 'success': False, 'skipped': False, 'error': error}
+
+def file_rng(seed, relative_path):
+    """
+    Returns a random.Random seeded from the batch seed and the file's relative path.
+
+    The derivation uses SHA-256 rather than hash() so it is the same in every
+    process, which keeps seeded outputs identical whatever the worker count or order.
+    """
+    key = f"{seed}\0{relative_path.replace(os.sep, '/')}".encode('utf-8')
+    return random.Random(int.from_bytes(hashlib.sha256(key).digest(), 'big'))
+
+# Which EXIF tags each randomly drawn value goes into
+RANDOM_FIELD_TAGS = {
+    'make': [('0th', piexif.ImageIFD.Make)],
+    'model': [('0th', piexif.ImageIFD.Model)],
+    'software': [('0th', piexif.ImageIFD.Software)],
+    'date': [('0th', piexif.ImageIFD.DateTime), ('Exif', piexif.ExifIFD.DateTimeOriginal),
+             ('Exif', piexif.ExifIFD.DateTimeDigitized)],
+    'iso': [('Exif', piexif.ExifIFD.ISOSpeedRatings)],
+    'exposure': [('Exif', piexif.ExifIFD.ExposureTime)],
+    'fnumber': [('Exif', piexif.ExifIFD.FNumber)],
+    'focal_length': [('Exif', piexif.ExifIFD.FocalLength)],
+    'document_name': [('0th', piexif.ImageIFD.DocumentName)],
+    'description': [('0th', piexif.ImageIFD.ImageDescription)],
+    'artist': [('0th', piexif.ImageIFD.Artist)],
+    'copyright': [('0th', piexif.ImageIFD.Copyright)],
+    'unique_id': [('Exif', piexif.ExifIFD.ImageUniqueID)],
+    'latitude_ref': [('GPS', piexif.GPSIFD.GPSLatitudeRef)],
+    'latitude': [('GPS', piexif.GPSIFD.GPSLatitude)],
+    'longitude_ref': [('GPS', piexif.GPSIFD.GPSLongitudeRef)],
+    'longitude': [('GPS', piexif.GPSIFD.GPSLongitude)],
+    'altitude': [('GPS', piexif.GPSIFD.GPSAltitude)],
+    'gps_time': [('GPS', piexif.GPSIFD.GPSTimeStamp)],
+    'gps_date': [('GPS', piexif.GPSIFD.GPSDateStamp)],
+}
+
+# Options the random camera settings are picked from
+ISO_OPTIONS = [100, 200, 400, 800, 1600, 3200]
+EXPOSURE_OPTIONS = [(1, 10), (1, 20), (1, 40), (1, 80), (1, 125), (1, 250), (1, 500), (1, 1000)]
+FNUMBER_OPTIONS = [(28, 10), (35, 10), (40, 10), (56, 10), (80, 10)]
+FOCAL_OPTIONS = [(180, 10), (240, 10), (350, 10), (500, 10), (700, 10)]
+
+# How many files' values are pre-drawn at once when NumPy is available
+BULK_DRAW_SIZE = 256
+
+# Display tags. The default policy keeps the file's own values and only
+# writes these when it has none.
+FIXED_TAGS = [
+    # Add resolution info (needed for proper image display)
+    ('0th', piexif.ImageIFD.XResolution, (72, 1)),
+    ('0th', piexif.ImageIFD.YResolution, (72, 1)),
+    ('0th', piexif.ImageIFD.ResolutionUnit, 2),  # inches
+    # Add orientation
+    ('0th', piexif.ImageIFD.Orientation, 1),  # Normal orientation
+]
+
+# Tags that get the same value in every file with randomize_all
+FIXED_TAGS_ALL = [
+    # Required EXIF versions
+    ('Exif', piexif.ExifIFD.ExifVersion, b'0230'),
+    ('Exif', piexif.ExifIFD.FlashpixVersion, b'0100'),
+    # Color space
+    ('Exif', piexif.ExifIFD.ColorSpace, 1),  # sRGB
+    # GPS version tag
+    ('GPS', piexif.GPSIFD.GPSVersionID, (2, 2, 0, 0)),
+    ('GPS', piexif.GPSIFD.GPSAltitudeRef, 0),  # Above sea level
+]
+
+def convert_to_dms(coordinate):
+    """Converts a decimal coordinate to EXIF GPS (degrees, minutes, seconds) rationals."""
+    # Absolute value of the coordinate
+    coordinate_abs = abs(coordinate)
+    # Degrees is the integer part
+    degrees = int(coordinate_abs)
+    # Minutes is the fractional part * 60
+    minutes_float = (coordinate_abs - degrees) * 60
+    minutes = int(minutes_float)
+    # Seconds is the fractional part of minutes * 60
+    seconds = int((minutes_float - minutes) * 60 * 100)
+    return (degrees, 1), (minutes, 1), (seconds, 100)
+
+def convert_to_dms_array(coordinates):
+    """Vectorized convert_to_dms: returns integer arrays of degrees, minutes and hundredths of seconds."""
+    # Same arithmetic as convert_to_dms, so the results match it exactly
+    coordinate_abs = np.abs(coordinates)
+    degrees = coordinate_abs.astype(np.int64)
+    minutes_float = (coordinate_abs - degrees) * 60
+    minutes = minutes_float.astype(np.int64)
+    seconds = ((minutes_float - minutes) * 60 * 100).astype(np.int64)
+    return degrees, minutes, seconds
+
+def _format_dms(dms):
+    (degrees, _), (minutes, _), (seconds, _) = dms
+    return f"{degrees}\u00b0{minutes}'{seconds / 100:.2f}\""
+
+def describe_values(values):
+    """Returns the human readable list of changes for a set of draw_random_values() values."""
+    changes = [f"Make: {values['make'].decode('ascii')}",
+               f"Model: {values['model'].decode('ascii')}",
+               f"Software: {values['software'].decode('ascii')}"]
+    if 'date' in values:
+        exposure, fnumber, focal = values['exposure'], values['fnumber'], values['focal_length']
+        changes += [f"DateTime: {values['date'].decode('ascii')}",
+                    f"ISO: {values['iso']}",
+                    f"ExposureTime: {exposure[0]}/{exposure[1]}s",
+                    f"FNumber: f/{fnumber[0]/fnumber[1]}",
+                    f"FocalLength: {focal[0]/focal[1]}mm",
+                    f"ImageUniqueID: {values['unique_id'].decode('ascii')}",
+                    f"GPS Latitude: {_format_dms(values['latitude'])} ({values['latitude_ref']})",
+                    f"GPS Longitude: {_format_dms(values['longitude'])} ({values['longitude_ref']})",
+                    f"GPS Altitude: {values['altitude'][0] / values['altitude'][1]:.2f}m"]
+    return changes
+
+def draw_random_values(randomize_all=True, rng=None, reference_date=None):
+    """
+    Draws the random metadata values for one file and returns them with a list of changes.
+
+    The values are keyed like RANDOM_FIELD_TAGS and already in piexif's format.
+    Values are drawn from rng (a random.Random, default: the global random module).
+    Random dates fall within the two years before reference_date (default: now).
+    """
+    values = _draw_values(randomize_all, rng, reference_date)
+    return values, describe_values(values)
+
+def _draw_values(randomize_all, rng, reference_date):
+    if rng is None:
+        rng = random
+    if reference_date is None:
+        reference_date = datetime.datetime.now()
+    values = {}
+    
+    # Generate random camera details
+    random_make = f"Camera{rng.randint(1, 100)}"
+    random_model = f"Model{rng.randint(1, 100)}"
+    random_software = f"Software{rng.randint(1, 100)}"
+    
+    # Basic device info that Windows Explorer will show
+    values['make'] = random_make.encode('ascii')
+    values['model'] = random_model.encode('ascii')
+    values['software'] = random_software.encode('ascii')
+    
+    if randomize_all:
+        # Generate random date (within last 2 years)
+        random_days = rng.randint(1, 730)
+        random_date = (reference_date - datetime.timedelta(days=random_days))
+        random_date_str = random_date.strftime("%Y:%m:%d %H:%M:%S")
         
-        # Step 1: Completely strip all metadata by saving to a new image without EXIF
-        # This removes all metadata including the problematic ones Windows caches
-        image_without_exif = Image.new(image.mode, image.size)
-        image_without_exif.putdata(list(image.getdata()))
+        # Add date/time 
+        values['date'] = random_date_str.encode('ascii')
         
-        # Step 2: Create brand new EXIF data from scratch
-        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
-        changes = []
+        # Camera settings
+        random_iso = rng.choice(ISO_OPTIONS)
+        values['iso'] = random_iso
         
-        # Generate random camera details
-        random_make = f"Camera{random.randint(1, 100)}"
-        random_model = f"Model{random.randint(1, 100)}"
-        random_software = f"Software{random.randint(1, 100)}"
+        # Exposure settings
+        random_exposure = rng.choice(EXPOSURE_OPTIONS)
+        values['exposure'] = random_exposure
         
-        # Basic device info that Windows Explorer will show
-        exif_dict['0th'][piexif.ImageIFD.Make] = random_make.encode('ascii')
-        exif_dict['0th'][piexif.ImageIFD.Model] = random_model.encode('ascii')
-        exif_dict['0th'][piexif.ImageIFD.Software] = random_software.encode('ascii')
-        changes.append(f"Make: {random_make}")
-        changes.append(f"Model: {random_model}")
-        changes.append(f"Software: {random_software}")
+        # F-number (aperture)
+        random_fnumber = rng.choice(FNUMBER_OPTIONS)
+        values['fnumber'] = random_fnumber
         
-        # Add resolution info (needed for proper image display)
-        exif_dict['0th'][piexif.ImageIFD.XResolution] = (72, 1)
-        exif_dict['0th'][piexif.ImageIFD.YResolution] = (72, 1)
-        exif_dict['0th'][piexif.ImageIFD.ResolutionUnit] = 2  # inches
+        # Focal length
+        random_focal = rng.choice(FOCAL_OPTIONS)
+        values['focal_length'] = random_focal
         
-        # Add orientation
-        exif_dict['0th'][piexif.ImageIFD.Orientation] = 1  # Normal orientation
+        # Add title, subject, author and comments (Windows properties)
+        values['document_name'] = f"Photo{rng.randint(1000, 9999)}".encode('ascii')
+        values['description'] = f"Description{rng.randint(1000, 9999)}".encode('ascii')
+        values['artist'] = f"Photographer{rng.randint(1000, 9999)}".encode('ascii')
+        values['copyright'] = f"Copyright{rng.randint(1000, 9999)}".encode('ascii')
         
-        if randomize_all:
-            # Generate random date (within last 2 years)
-            random_days = random.randint(1, 730)
-            random_date = (datetime.datetime.now() - datetime.timedelta(days=random_days))
-            random_date_str = random_date.strftime("%Y:%m:%d %H:%M:%S")
-            
-            # Add date/time 
-            exif_dict['0th'][piexif.ImageIFD.DateTime] = random_date_str.encode('ascii')
-            exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal] = random_date_str.encode('ascii')
-            exif_dict['Exif'][piexif.ExifIFD.DateTimeDigitized] = random_date_str.encode('ascii')
-            changes.append(f"DateTime: {random_date_str}")
-            
-            # Camera settings
-            random_iso = random.choice([100, 200, 400, 800, 1600, 3200])
-            exif_dict['Exif'][piexif.ExifIFD.ISOSpeedRatings] = random_iso
-            changes.append(f"ISO: {random_iso}")
-            
-            # Exposure settings
-            exposure_options = [(1, 10), (1, 20), (1, 40), (1, 80), (1, 125), (1, 250), (1, 500), (1, 1000)]
-            random_exposure = random.choice(exposure_options)
-            exif_dict['Exif'][piexif.ExifIFD.ExposureTime] = random_exposure
-            changes.append(f"ExposureTime: {random_exposure[0]}/{random_exposure[1]}s")
-            
-            # F-number (aperture)
-            fnumber_options = [(28, 10), (35, 10), (40, 10), (56, 10), (80, 10)]
-            random_fnumber = random.choice(fnumber_options)
-            exif_dict['Exif'][piexif.ExifIFD.FNumber] = random_fnumber
-            changes.append(f"FNumber: f/{random_fnumber[0]/random_fnumber[1]}")
-            
-            # Focal length
-            focal_options = [(180, 10), (240, 10), (350, 10), (500, 10), (700, 10)]
-            random_focal = random.choice(focal_options)
-            exif_dict['Exif'][piexif.ExifIFD.FocalLength] = random_focal
-            changes.append(f"FocalLength: {random_focal[0]/random_focal[1]}mm")
-            
-            # Required EXIF versions
-            exif_dict['Exif'][piexif.ExifIFD.ExifVersion] = b'0230'
-            exif_dict['Exif'][piexif.ExifIFD.FlashpixVersion] = b'0100'
-            
-            # Color space
-            exif_dict['Exif'][piexif.ExifIFD.ColorSpace] = 1  # sRGB
-            
-            # Add title, subject, author and comments (Windows properties)
-            exif_dict['0th'][piexif.ImageIFD.DocumentName] = f"Photo{random.randint(1000, 9999)}".encode('ascii')
-            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = f"Description{random.randint(1000, 9999)}".encode('ascii')
-            exif_dict['0th'][piexif.ImageIFD.Artist] = f"Photographer{random.randint(1000, 9999)}".encode('ascii')
-            exif_dict['0th'][piexif.ImageIFD.Copyright] = f"Copyright{random.randint(1000, 9999)}".encode('ascii')
-            
-            # Random camera ID
-            random_id = ''.join(random.choice('0123456789ABCDEF') for _ in range(10))
-            exif_dict['Exif'][piexif.ExifIFD.ImageUniqueID] = random_id.encode('ascii')
-            changes.append(f"ImageUniqueID: {random_id}")
-            
-            # Randomize GPS data
-            # Generate random GPS coordinates
-            # Latitude between -90 and 90 degrees
-            random_lat = random.uniform(-90, 90)
-            # Longitude between -180 and 180 degrees
-            random_long = random.uniform(-180, 180)
-            
-            # Convert to EXIF GPS format (degrees, minutes, seconds)
-            def convert_to_dms(coordinate):
-                # Absolute value of the coordinate
-                coordinate_abs = abs(coordinate)
-                # Degrees is the integer part
-                degrees = int(coordinate_abs)
-                # Minutes is the fractional part * 60
-                minutes_float = (coordinate_abs - degrees) * 60
-                minutes = int(minutes_float)
-                # Seconds is the fractional part of minutes * 60
-                seconds = int((minutes_float - minutes) * 60 * 100)
-                return (degrees, 1), (minutes, 1), (seconds, 100)
-            
-            # Convert latitude and longitude to degrees, minutes, seconds format
-            lat_dms = convert_to_dms(random_lat)
-            long_dms = convert_to_dms(random_long)
-            
-            # Add GPS tags
-            # GPS version tag
-            exif_dict['GPS'][piexif.GPSIFD.GPSVersionID] = (2, 2, 0, 0)
-            
-            # Latitude tags
-            exif_dict['GPS'][piexif.GPSIFD.GPSLatitudeRef] = 'N' if random_lat >= 0 else 'S'
-            exif_dict['GPS'][piexif.GPSIFD.GPSLatitude] = lat_dms
-            
-            # Longitude tags
-            exif_dict['GPS'][piexif.GPSIFD.GPSLongitudeRef] = 'E' if random_long >= 0 else 'W'
-            exif_dict['GPS'][piexif.GPSIFD.GPSLongitude] = long_dms
-            
-            # Random altitude (0-8848m, with 8848 being the height of Mt. Everest)
-            random_altitude = random.uniform(0, 8848)
-            exif_dict['GPS'][piexif.GPSIFD.GPSAltitudeRef] = 0  # Above sea level
-            exif_dict['GPS'][piexif.GPSIFD.GPSAltitude] = (int(random_altitude * 100), 100)
-            
-            # Random timestamp
-            random_hour = random.randint(0, 23)
-            random_minute = random.randint(0, 59)
-            random_second = random.randint(0, 59)
-            exif_dict['GPS'][piexif.GPSIFD.GPSTimeStamp] = ((random_hour, 1), (random_minute, 1), (random_second, 1))
-            
-            # Random date (use same date as the photo)
-            gps_date_str = random_date.strftime("%Y:%m:%d")
-            exif_dict['GPS'][piexif.GPSIFD.GPSDateStamp] = gps_date_str
-            
-            changes.append(f"GPS Latitude: {random_lat:.6f} ({exif_dict['GPS'][piexif.GPSIFD.GPSLatitudeRef]})")
-            changes.append(f"GPS Longitude: {random_long:.6f} ({exif_dict['GPS'][piexif.GPSIFD.GPSLongitudeRef]})")
-            changes.append(f"GPS Altitude: {random_altitude:.2f}m")
+        # Random camera ID
+        random_id = ''.join(rng.choice('0123456789ABCDEF') for _ in range(10))
+        values['unique_id'] = random_id.encode('ascii')
         
-        # Dump EXIF data to bytes
-        exif_bytes = piexif.dump(exif_dict)
+        # Randomize GPS data
+        # Latitude between -90 and 90 degrees
+        random_lat = rng.uniform(-90, 90)
+        # Longitude between -180 and 180 degrees
+        random_long = rng.uniform(-180, 180)
         
-        # Save the new image with the randomized EXIF data
-        image_without_exif.save(output_path, "jpeg", exif=exif_bytes, quality=95)
-        print(f"Saved completely new image with randomized metadata to {output_path}")
-        print("Changed metadata fields:")
-        for change in changes:
-            print(f"  - {change}")
+        # Latitude and longitude in degrees, minutes, seconds format
+        values['latitude_ref'] = 'N' if random_lat >= 0 else 'S'
+        values['latitude'] = convert_to_dms(random_lat)
+        values['longitude_ref'] = 'E' if random_long >= 0 else 'W'
+        values['longitude'] = convert_to_dms(random_long)
         
-        # Create a Windows-friendly version by writing the image data directly
-        with open(output_path, 'rb') as f:
-            img_data = f.read()
+        # Random altitude (0-8848m, with 8848 being the height of Mt. Everest)
+        random_altitude = rng.uniform(0, 8848)
+        values['altitude'] = (int(random_altitude * 100), 100)
         
-        # Rewrite the file to force Windows to refresh metadata cache
-        with open(output_path, 'wb') as f:
-            f.write(img_data)
+        # Random timestamp
+        random_hour = rng.randint(0, 23)
+        random_minute = rng.randint(0, 59)
+        random_second = rng.randint(0, 59)
+        values['gps_time'] = ((random_hour, 1), (random_minute, 1), (random_second, 1))
+        
+        # Random date (use same date as the photo)
+        values['gps_date'] = random_date.strftime("%Y:%m:%d")
+
+    return values
+
+def draw_random_batch(count, randomize_all=True, seed=None, reference_date=None):
+    """
+    Draws the random values for count files at once and returns them as a list of value dicts.
+
+    With NumPy installed every field is drawn for all files in one vectorized
+    call (including the DMS conversion), so the per-file cost is just packing a
+    row. The same seed always gives the same rows. Without NumPy the rows are
+    drawn one at a time from random.Random(seed).
+    """
+    if reference_date is None:
+        reference_date = datetime.datetime.now()
+    if np is None:
+        rng = random.Random(seed)
+        return [_draw_values(randomize_all, rng, reference_date) for _ in range(count)]
+
+    rng = np.random.default_rng(seed)
+    columns = {
+        'make': [f"Camera{n}".encode('ascii') for n in rng.integers(1, 101, count).tolist()],
+        'model': [f"Model{n}".encode('ascii') for n in rng.integers(1, 101, count).tolist()],
+        'software': [f"Software{n}".encode('ascii') for n in rng.integers(1, 101, count).tolist()],
+    }
+    if randomize_all:
+        # Dates within the last 2 years, keeping the reference time of day
+        days = rng.integers(1, 731, count).astype('timedelta64[D]')
+        dates = np.datetime_as_string(np.datetime64(reference_date.replace(microsecond=0), 's') - days).tolist()
+        columns['date'] = [date.replace('-', ':').replace('T', ' ').encode('ascii') for date in dates]
+        columns['gps_date'] = [date[:10].replace('-', ':') for date in dates]
+
+        columns['iso'] = np.array(ISO_OPTIONS)[rng.integers(0, len(ISO_OPTIONS), count)].tolist()
+        for name, options in (('exposure', EXPOSURE_OPTIONS), ('fnumber', FNUMBER_OPTIONS),
+                              ('focal_length', FOCAL_OPTIONS)):
+            columns[name] = [options[index] for index in rng.integers(0, len(options), count).tolist()]
+
+        for name, prefix in (('document_name', 'Photo'), ('description', 'Description'),
+                             ('artist', 'Photographer'), ('copyright', 'Copyright')):
+            columns[name] = [f"{prefix}{n}".encode('ascii') for n in rng.integers(1000, 10000, count).tolist()]
+
+        hex_digits = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+        unique_ids = hex_digits[rng.integers(0, 16, (count, 10))].tobytes()
+        columns['unique_id'] = [unique_ids[start:start + 10] for start in range(0, count * 10, 10)]
+
+        for name, ref_name, limit, refs in (('latitude', 'latitude_ref', 90, ('N', 'S')),
+                                            ('longitude', 'longitude_ref', 180, ('E', 'W'))):
+            coordinates = rng.uniform(-limit, limit, count)
+            columns[ref_name] = np.where(coordinates >= 0, refs[0], refs[1]).tolist()
+            degrees, minutes, seconds = convert_to_dms_array(coordinates)
+            columns[name] = [((d, 1), (m, 1), (s, 100))
+                             for d, m, s in zip(degrees.tolist(), minutes.tolist(), seconds.tolist())]
+
+        altitudes = (rng.uniform(0, 8848, count) * 100).astype(np.int64)
+        columns['altitude'] = [(altitude, 100) for altitude in altitudes.tolist()]
+        hours, minutes, seconds = (rng.integers(0, 24, count).tolist(), rng.integers(0, 60, count).tolist(),
+                                   rng.integers(0, 60, count).tolist())
+        columns['gps_time'] = [((h, 1), (m, 1), (s, 1)) for h, m, s in zip(hours, minutes, seconds)]
+
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+# Pre-drawn values for unseeded runs, per randomize_all setting (see _next_random_values)
+_predrawn = {}
+_predrawn_lock = threading.Lock()
+
+def _next_random_values(randomize_all):
+    """Takes one file's values from this process's pre-drawn pool, drawing BULK_DRAW_SIZE more when it runs dry."""
+    with _predrawn_lock:
+        pid, rows = _predrawn.get(randomize_all, (None, None))
+        # A forked pool worker must not hand out the same rows as its parent and siblings
+        if not rows or pid != os.getpid():
+            rows = draw_random_batch(BULK_DRAW_SIZE, randomize_all)
+            _predrawn[randomize_all] = (os.getpid(), rows)
+        return rows.pop()
+
+# Compiled default policies, keyed by randomize_all
+_default_policies = {}
+
+def default_policy(randomize_all=True):
+    """
+    Returns the policy used when none is given (see metadata_policy).
+
+    Every generated field gets a random value and FIXED_TAGS_ALL (with
+    randomize_all) a fixed one. The file's own orientation, resolution and ICC
+    profile are kept, with FIXED_TAGS as fallbacks. Everything else is dropped.
+    """
+    policy = _default_policies.get(randomize_all)
+    if policy is None:
+        rules = {'default': DROP, 'icc': KEEP, '0th': {}, 'Exif': {}, 'GPS': {}}
+        for targets in RANDOM_FIELD_TAGS.values():
+            for ifd, tag in targets:
+                rules[ifd][tag] = RANDOMIZE
+        for ifd, tag, value in FIXED_TAGS:
+            rules[ifd][tag] = {KEEP: value}
+        for ifd, tag, value in (FIXED_TAGS_ALL if randomize_all else []):
+            rules[ifd][tag] = {FIXED: value}
+        policy = _default_policies[randomize_all] = compile_policy(rules)
+    return policy
+
+def manifest_options(layout=None, policy=None, engine='splice', max_pixels=DEFAULT_MAX_PIXELS, seed=None,
+                     seed_root=None, thumbnail=False, randomize_windows_props=True):
+    """
+    Returns the run options that decide what the outputs look like, for ProcessingManifest(options=...).
+
+    Outputs recorded under other options (another policy, engine, seed or
+    output layout) are then produced again instead of being skipped.
+    """
+    layout = layout or DEFAULT_LAYOUT
+    return {
+        'policy': (policy or default_policy()).key,
+        'engine': engine,
+        'max_pixels': max_pixels,
+        'seed': seed,
+        'seed_root': os.path.abspath(seed_root) if seed is not None and seed_root else None,
+        'thumbnail': thumbnail,
+        'windows_props': randomize_windows_props,
+        'layout': [os.path.abspath(layout.output_dir) if layout.output_dir else None,
+                   os.path.abspath(layout.input_root) if layout.input_root else None,
+                   layout.name_template, layout.in_place],
+    }
+
+def check_policy(policy):
+    """Raises ValueError if policy randomizes a tag there is no random value for."""
+    policy.check_randomizable(target for targets in RANDOM_FIELD_TAGS.values() for target in targets)
+
+def exif_dict_from_values(values, randomize_all=True, policy=None, source=None):
+    """
+    Builds a piexif exif_dict from draw_random_values() output and a policy (default: default_policy()).
+
+    source holds the original file's tags (see metadata_policy.read_source_tags) for the tags the policy keeps.
+    """
+    if policy is None:
+        policy = default_policy(randomize_all)
+    exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    for name, value in values.items():
+        for ifd, tag in RANDOM_FIELD_TAGS[name]:
+            if (ifd, tag) in policy.randomized:
+                exif_dict[ifd][tag] = value
+    return policy.apply(exif_dict, source)
+
+def build_random_exif(randomize_all=True, rng=None, reference_date=None):
+    """
+    Builds a brand new EXIF dictionary with random values and returns it with a list of changes.
+
+    Values are drawn from rng (a random.Random, default: the global random module).
+    Random dates fall within the two years before reference_date (default: now).
+    """
+    values, changes = draw_random_values(randomize_all, rng=rng, reference_date=reference_date)
+    return exif_dict_from_values(values, randomize_all), changes
+
+# Precompiled EXIF layouts, keyed by (policy key, randomize_all) (built on first use in each process)
+_exif_templates = {}
+
+def exif_template(randomize_all=True, policy=None):
+    """
+    Returns the ExifTemplate for randomized blocks under policy, serializing it on first use.
+
+    Its slots are the random value names plus an (ifd, tag) slot for every tag the
+    policy keeps. Only policies with a fixed_layout can use a template.
+    """
+    if policy is None:
+        policy = default_policy(randomize_all)
+    key = (policy.key, randomize_all)
+    template = _exif_templates.get(key)
+    if template is None:
+        values, _ = draw_random_values(randomize_all, rng=random.Random(0), reference_date=SEEDED_REFERENCE_DATE)
+        fields = {}
+        for name in values:
+            targets = [target for target in RANDOM_FIELD_TAGS[name] if target in policy.randomized]
+            if targets:
+                fields[name] = targets
+        for ifd, tag, _ in policy.kept:
+            fields[ifd, tag] = [(ifd, tag)]
+        template = ExifTemplate(exif_dict_from_values(values, randomize_all, policy), fields)
+        _exif_templates[key] = template
+    return template
+
+def _source_tags(policy, data, stats):
+    """Reads the tags policy keeps from the image in data, or returns None if it keeps none (or there are none)."""
+    if not policy.needs_source:
+        return None
+    with stats.stage('read_source'):
+        try:
+            return read_source_tags(find_exif_payload(data), policy.source_ifds)
+        except ValueError:
+            return None
+
+def _random_exif_bytes(randomize_all, rng, reference_date, stats, policy=None, source=None):
+    """
+    Draws random values and serializes them into an EXIF block, returning (exif_bytes, values).
+
+    policy (default: default_policy()) decides which tags are written; the ones it
+    keeps come from source (see _source_tags). Unseeded runs take their values from
+    the pre-drawn pool when NumPy is available.
+    """
+    if policy is None:
+        policy = default_policy(randomize_all)
+    with stats.stage('build_exif'):
+        if rng is None and reference_date is None and np is not None:
+            values = _next_random_values(randomize_all)
+        else:
+            values = _draw_values(randomize_all, rng, reference_date)
+    with stats.stage('exif_dump'):
+        exif_bytes = None
+        if policy.fixed_layout:
+            try:
+                # Patch the values into the precompiled layout instead of running piexif.dump
+                template = exif_template(randomize_all, policy)
+                slot_values = {name: value for name, value in values.items() if name in template.slots}
+                for ifd, tag, fallback in policy.kept:
+                    if source and tag in source.get(ifd, ()):
+                        slot_values[ifd, tag] = source[ifd][tag]
+                    else:
+                        slot_values[ifd, tag] = fallback
+                exif_bytes = template.render(slot_values)
+            except ValueError:
+                pass
+        if exif_bytes is None:
+            try:
+                exif_bytes = piexif.dump(exif_dict_from_values(values, randomize_all, policy, source))
+            except (ValueError, TypeError, struct.error) as e:
+                if not source:
+                    raise
+                # A malformed original value must not cost the whole file
+                logger.warning("Could not keep the original metadata tags (%s), writing the policy's values only", e)
+                exif_bytes = piexif.dump(exif_dict_from_values(values, randomize_all, policy))
+    return exif_bytes, values
+
+def _with_thumbnail(exif_bytes, image, stats):
+    """Returns exif_bytes with a thumbnail of image (an open PIL image) in its 1st IFD, or unchanged if that fails."""
+    with stats.stage('thumbnail'):
+        try:
+            return attach_thumbnail(exif_bytes, make_thumbnail(image))
+        except (OSError, ValueError) as e:
+            logger.warning("Could not add a thumbnail: %s", e)
+            return exif_bytes
+
+def randomize_metadata(image_path, randomize_all=True, randomize_windows_props=True, engine='splice',
+                       max_pixels=DEFAULT_MAX_PIXELS, fsync=False, rng=None, reference_date=None, stats=None,
+                       output_path=None, policy=None, thumbnail=False):
+    """
+    Writes a copy of the image with all metadata replaced by random values.
+
+    policy (a metadata_policy.CompiledPolicy, default: default_policy()) decides
+    which tags are randomized, kept from the original, set to fixed values or dropped.
+    Its ICC profile rule applies to both engines. With thumbnail, JPEG outputs get
+    a small preview in the EXIF block (see exif_thumbnail).
+
+    The copy goes to output_path (its folder is created if needed), by default
+    modified_<name> next to the input. output_path may be image_path itself to
+    replace the original.
+
+    engine='splice' swaps the metadata segments in the JPEG stream and copies the
+    compressed image data unchanged (no decode, no quality loss). engine='re-encode'
+    decodes the pixels and saves a brand new JPEG at quality=95; images with more
+    than `max_pixels` pixels are never decoded and go through the splice engine.
+    PNG, TIFF, WebP and HEIF images always use the splice engine, which rewrites
+    only their metadata containers (see image_formats).
+
+    The output is written once to a temp file and renamed into place (see
+    atomic_output), optionally fsync'ed first.
+
+    Pass rng (see file_rng) and a fixed reference_date to make the output reproducible.
+    Pass an instrumentation.FileStats as stats to record per-stage timings and byte counts.
+    """
+    if stats is None:
+        stats = FileStats(image_path)
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}")
+    if policy is None:
+        policy = default_policy(randomize_all)
+
+    create_folder = output_path is not None
+    if output_path is None:
+        # Create output path in the same directory but with "modified_" prefix
+        directory, filename = os.path.split(image_path)
+        output_path = os.path.join(directory, f"{OUTPUT_PREFIX}{filename}")
+    # A replaced original keeps its permissions (a private photo must stay private)
+    mode_from = image_path if os.path.abspath(output_path) == os.path.abspath(image_path) else None
+    
+    try:
+        logger.info("Processing image: %s", image_path)
+        if create_folder and os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        too_large = False
+        if engine == 're-encode' and format_for_path(image_path) not in (None, 'jpeg'):
+            logger.debug("Only JPEGs are re-encoded, splicing the metadata of %s", image_path)
+            engine = 'splice'
+        if engine == 're-encode':
+            with stats.stage('probe'):
+                too_large = exceeds_pixel_limit(image_path, max_pixels)
+        if too_large:
+            # Decoding would need width * height * bands bytes; the splice engine
+            # never decodes the pixels, so very large images are streamed through it.
+            logger.warning("%s is larger than %d pixels, using the splice engine instead of re-encoding",
+                           image_path, max_pixels)
+            engine = 'splice'
+
+        if engine == 'splice':
+            # Step 2: Drop every metadata segment (or chunk, box, tag) from the file and
+            # insert the new EXIF block. The compressed image data is copied through untouched.
+            # The input is memory-mapped and the kept segments are written straight
+            # from the mapping, so the image data is never copied onto the heap.
+            # The mapping is closed before the output is renamed (possibly over the input).
+            with atomic_output(output_path, fsync=fsync, mode_from=mode_from) as f, ExitStack() as mapping:
+                with stats.stage('read'):
+                    original_data = mapping.enter_context(mapped_file(image_path))
+                stats.bytes_read += len(original_data)
+                # Step 1: Create brand new EXIF data, with whatever the policy keeps from the original
+                exif_bytes, values = _random_exif_bytes(randomize_all, rng, reference_date, stats, policy,
+                                                        _source_tags(policy, original_data, stats))
+                if thumbnail and detect_format(original_data) == 'jpeg':
+                    with Image.open(image_path) as image:
+                        exif_bytes = _with_thumbnail(exif_bytes, image, stats)
+                with stats.stage('splice'):
+                    parts = splice_metadata_parts(original_data, exif_bytes, keep_icc=policy.keep_icc)
+                with stats.stage('write'):
+                    f.writelines(parts)
+                stats.bytes_written += f.tell()
+                # Drop the slices so the mapping can be closed
+                del parts
+        else:
+            # Step 1: Create brand new EXIF data, with whatever the policy keeps from the original
+            with mapped_file(image_path) as original_data:
+                source = _source_tags(policy, original_data, stats)
+            exif_bytes, values = _random_exif_bytes(randomize_all, rng, reference_date, stats, policy, source)
+            with Image.open(image_path) as image:
+                # Step 2: Completely strip all metadata by saving to a new image without EXIF
+                # This removes all metadata including the problematic ones Windows caches.
+                # The decoded pixel buffer is reused as-is; only the parsed info is dropped.
+                # The ICC profile is taken out first and written back unchanged, as the splice engine does.
+                icc_profile = image.info.get('icc_profile') if policy.keep_icc else None
+                with stats.stage('decode'):
+                    image_without_exif = strip_metadata(image)
+                stats.bytes_read += os.path.getsize(image_path)
+                if thumbnail:
+                    exif_bytes = _with_thumbnail(exif_bytes, image_without_exif, stats)
+
+                # Save the new image with the randomized EXIF data
+                with stats.stage('encode'):
+                    with atomic_output(output_path, fsync=fsync, mode_from=mode_from) as f:
+                        image_without_exif.save(f, "jpeg", exif=exif_bytes, quality=95, icc_profile=icc_profile)
+                        stats.bytes_written += f.tell()
+
+        logger.info("Saved completely new image with randomized metadata to %s", output_path)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Only build the per-field listing when someone will see it
+            logger.debug("Changed metadata fields:\n%s",
+                         "\n".join(f"  - {change}" for change in describe_values(values)))
         
         # Attempt to modify Windows-specific file properties 
         if randomize_windows_props and sys.platform == 'win32':
             try:
-                # Random values for Windows properties
-                random_title = f"Photo{random.randint(1000, 9999)}"
-                random_subject = f"Subject{random.randint(1000, 9999)}"
-                random_comments = f"Comments{random.randint(1000, 9999)}"
-                random_author = f"Author{random.randint(1000, 9999)}"
-                random_tags = f"tag{random.randint(1, 100)},tag{random.randint(1, 100)}"
+                # Random values for Windows properties (unseeded runs use the global random module)
+                if rng is None:
+                    rng = random
+                random_title = f"Photo{rng.randint(1000, 9999)}"
+                random_subject = f"Subject{rng.randint(1000, 9999)}"
+                random_comments = f"Comments{rng.randint(1000, 9999)}"
+                random_author = f"Author{rng.randint(1000, 9999)}"
+                random_tags = f"tag{rng.randint(1, 100)},tag{rng.randint(1, 100)}"
                 
                 # PowerShell commands to modify Windows file properties
                 ps_commands = [
@@ -252,171 +907,774 @@ def randomize_metadata(image_path, randomize_all=True, randomize_windows_props=T
                 Write-Host "Windows properties updated (as much as permissions allow)"
                 """
                 
-                print("\nNote: Attempting to set Windows file properties...")
-                print("Some Windows properties can only be modified through the Windows UI or with admin privileges.")
-                print("To change properties like 'Shared with', right-click the file > Properties > Security tab")
+                logger.debug("Attempting to set Windows file properties. Some Windows properties can only be "
+                             "modified through the Windows UI or with admin privileges. To change properties like "
+                             "'Shared with', right-click the file > Properties > Security tab")
                 
-                changes.append(f"Title: {random_title}")
-                changes.append(f"Subject: {random_subject}")
-                changes.append(f"Tags: {random_tags}")
-                changes.append(f"Comments: {random_comments}")
-                changes.append(f"Author: {random_author}")
+                logger.debug("Windows properties: Title: %s, Subject: %s, Tags: %s, Comments: %s, Author: %s",
+                             random_title, random_subject, random_tags, random_comments, random_author)
                 
             except Exception as e:
-                print(f"Warning: Could not modify Windows file properties: {e}")
-                print("You may need to modify these manually in Windows Explorer.")
+                logger.warning("Could not modify Windows file properties: %s. "
+                               "You may need to modify these manually in Windows Explorer.", e)
             
         return output_path
     except Exception as e:
-        print(f"Error processing image: {e}")
+        stats.errors += 1
+        logger.error("Error processing image %s: %s", image_path, e)
         return None
 
-def get_metadata_string(image_path):
-    """Reads EXIF data from an image and returns it as a formatted string."""
-    output_lines = []
+def randomize_bytes(data, randomize_all=True, engine='splice', max_pixels=DEFAULT_MAX_PIXELS, rng=None,
+                    reference_date=None, stats=None, policy=None, thumbnail=False):
+    """
+    Returns a copy of the image in data with all metadata replaced by random values, or None on error.
+
+    data may be bytes, a bytearray, a memoryview or any other buffer; nothing is
+    written to disk. The splice engine only slices the input buffer, so the
+    returned bytes are the one copy that is made. The re-encode engine has to
+    decode the pixels and works on its own copy of data (images with more than
+    max_pixels pixels are spliced instead); only JPEGs are re-encoded, other
+    formats are always spliced. Windows file properties are not touched.
+    policy and thumbnail work as in randomize_metadata.
+    """
+    if stats is None:
+        stats = FileStats('<bytes>')
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}")
+    if policy is None:
+        policy = default_policy(randomize_all)
+
     try:
-        image = Image.open(image_path)
+        view = memoryview(data)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        stats.bytes_read += view.nbytes
+        exif_bytes, values = _random_exif_bytes(randomize_all, rng, reference_date, stats, policy,
+                                                _source_tags(policy, view, stats))
 
-        # Check if image has EXIF data
-        if 'exif' not in image.info:
-            return f"No EXIF data found in {os.path.basename(image_path)}"
+        if engine == 're-encode' and detect_format(view) != 'jpeg':
+            engine = 'splice'
+        if engine == 're-encode':
+            with stats.stage('probe'):
+                if exceeds_pixel_limit(view, max_pixels):
+                    logger.warning("Image data is larger than %d pixels, using the splice engine instead of "
+                                   "re-encoding", max_pixels)
+                    engine = 'splice'
+
+        if engine == 'splice':
+            if thumbnail and detect_format(view) == 'jpeg':
+                with Image.open(io.BytesIO(view)) as image:
+                    exif_bytes = _with_thumbnail(exif_bytes, image, stats)
+            with stats.stage('splice'):
+                output = b''.join(splice_metadata_parts(view, exif_bytes, keep_icc=policy.keep_icc))
+        else:
+            with Image.open(io.BytesIO(view)) as image:
+                icc_profile = image.info.get('icc_profile') if policy.keep_icc else None
+                with stats.stage('decode'):
+                    image_without_exif = strip_metadata(image)
+                if thumbnail:
+                    exif_bytes = _with_thumbnail(exif_bytes, image_without_exif, stats)
+                with stats.stage('encode'):
+                    buffer = io.BytesIO()
+                    image_without_exif.save(buffer, "jpeg", exif=exif_bytes, quality=95, icc_profile=icc_profile)
+                    output = buffer.getvalue()
+        stats.bytes_written += len(output)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Changed metadata fields:\n%s",
+                         "\n".join(f"  - {change}" for change in describe_values(values)))
+        return output
+    except Exception as e:
+        stats.errors += 1
+        logger.error("Error randomizing image data: %s", e)
+        return None
 
-        exif_dict = piexif.load(image.info.get('exif', b''))
+def randomize_stream(source, destination, **options):
+    """
+    Reads an image from the binary file-like object source and writes the randomized copy to destination.
 
-        output_lines.append(f"Metadata for: {os.path.basename(image_path)}")
-        output_lines.append("="*30)
+    Takes the same options as randomize_bytes and returns the number of bytes
+    written, or None on error (destination is then left untouched). An
+    io.BytesIO source is read through its buffer without copying it. Either way
+    source is consumed: it is left at its end.
+    """
+    if hasattr(source, 'getbuffer'):
+        # Read from the current position and leave the stream at its end, like source.read() would
+        with source.getbuffer() as buffer:
+            output = randomize_bytes(buffer[source.tell():], **options)
+        source.seek(0, io.SEEK_END)
+    else:
+        output = randomize_bytes(source.read(), **options)
+    if output is None:
+        return None
+    destination.write(output)
+    return len(output)
 
-        if '0th' in exif_dict and exif_dict['0th']:
-            output_lines.append("Basic Image Information:")
-            for tag, value in exif_dict['0th'].items():
-                tag_name = piexif.TAGS['0th'].get(tag, {}).get('name', str(tag))
+def read_metadata(image_path):
+    """
+    Reads the EXIF data of an image and returns it as a piexif dictionary, or None if there is none.
+
+    For the supported formats only the metadata containers are read (see
+    image_formats), without PIL. Other formats fall back to PIL to locate the EXIF block.
+    """
+    try:
+        exif_payload = read_exif_payload(image_path)
+    except ValueError:
+        # Not a format image_formats knows
+        with Image.open(image_path) as image:
+            exif_payload = image.info.get('exif')
+    if not exif_payload:
+        return None
+    return piexif.load(exif_payload)
+
+def format_metadata(exif_dict, image_path):
+    """Formats a piexif dictionary (as returned by read_metadata) as readable text."""
+    output_lines = []
+    output_lines.append(f"Metadata for: {os.path.basename(image_path)}")
+    output_lines.append("="*30)
+
+    if '0th' in exif_dict and exif_dict['0th']:
+        output_lines.append("Basic Image Information:")
+        for tag, value in exif_dict['0th'].items():
+            tag_name = piexif.TAGS['0th'].get(tag, {}).get('name', str(tag))
+            if isinstance(value, bytes):
+                try:
+                    value = value.decode('ascii', errors='replace')
+                except:
+                    value = str(value)
+            output_lines.append(f"  {tag_name}: {value}")
+        output_lines.append("") # Add spacing
+
+    if 'Exif' in exif_dict and exif_dict['Exif']:
+        output_lines.append("Exif Information:")
+        for tag, value in exif_dict['Exif'].items():
+            tag_name = piexif.TAGS['Exif'].get(tag, {}).get('name', str(tag))
+            # Special formatting for rational types (like ExposureTime, FNumber)
+            if isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], int) and isinstance(value[1], int) and value[1] != 0:
+                 if tag_name == "ExposureTime":
+                     value_str = f"1/{int(value[1]/value[0])}s" if value[0] != 0 else "0s"
+                 elif tag_name == "FNumber":
+                     value_str = f"f/{value[0]/value[1]:.1f}"
+                 elif tag_name == "FocalLength":
+                      value_str = f"{value[0]/value[1]:.1f}mm"
+                 else:
+                     value_str = f"{value[0]}/{value[1]}"
+            elif isinstance(value, bytes):
+                try:
+                    value_str = value.decode('ascii', errors='replace')
+                except:
+                    value_str = str(value)
+            else:
+                value_str = str(value)
+            output_lines.append(f"  {tag_name}: {value_str}")
+        output_lines.append("")
+
+    if 'GPS' in exif_dict and exif_dict['GPS']:
+        output_lines.append("GPS Information:")
+        lat_ref = long_ref = None
+        latitude = longitude = None
+        gps_data_found = False
+
+        # Simplified GPS coordinate extraction/formatting
+        try:
+            lat_dms = exif_dict['GPS'].get(piexif.GPSIFD.GPSLatitude)
+            lat_ref = exif_dict['GPS'].get(piexif.GPSIFD.GPSLatitudeRef)
+            long_dms = exif_dict['GPS'].get(piexif.GPSIFD.GPSLongitude)
+            long_ref = exif_dict['GPS'].get(piexif.GPSIFD.GPSLongitudeRef)
+
+            if lat_dms and lat_ref and long_dms and long_ref:
+                if isinstance(lat_ref, bytes): lat_ref = lat_ref.decode('ascii', 'replace')
+                if isinstance(long_ref, bytes): long_ref = long_ref.decode('ascii', 'replace')
+
+                degrees = lat_dms[0][0] / lat_dms[0][1]
+                minutes = lat_dms[1][0] / lat_dms[1][1]
+                seconds = lat_dms[2][0] / lat_dms[2][1]
+                latitude = degrees + minutes/60 + seconds/3600
+                if lat_ref == 'S': latitude = -latitude
+
+                degrees = long_dms[0][0] / long_dms[0][1]
+                minutes = long_dms[1][0] / long_dms[1][1]
+                seconds = long_dms[2][0] / long_dms[2][1]
+                longitude = degrees + minutes/60 + seconds/3600
+                if long_ref == 'W': longitude = -longitude
+
+                output_lines.append(f"  GPS Coordinates: {latitude:.6f}, {longitude:.6f} ({lat_ref}, {long_ref})")
+                gps_data_found = True
+
+        except (KeyError, IndexError, ZeroDivisionError, TypeError) as gps_ex:
+            output_lines.append(f"  Could not parse GPS coordinates: {gps_ex}")
+
+        # Display other GPS tags
+        for tag, value in exif_dict['GPS'].items():
+             if tag not in [piexif.GPSIFD.GPSLatitude, piexif.GPSIFD.GPSLongitude]: # Avoid duplicate display
+                tag_name = piexif.TAGS['GPS'].get(tag, {}).get('name', str(tag))
                 if isinstance(value, bytes):
                     try:
                         value = value.decode('ascii', errors='replace')
                     except:
                         value = str(value)
+                elif isinstance(value, tuple) and len(value) > 0 and isinstance(value[0], tuple): # Handle timestamp, etc.
+                    value = ", ".join([f"{v[0]}/{v[1]}" if isinstance(v, tuple) and len(v)==2 else str(v) for v in value])
                 output_lines.append(f"  {tag_name}: {value}")
-            output_lines.append("") # Add spacing
-
-        if 'Exif' in exif_dict and exif_dict['Exif']:
-            output_lines.append("Exif Information:")
-            for tag, value in exif_dict['Exif'].items():
-                tag_name = piexif.TAGS['Exif'].get(tag, {}).get('name', str(tag))
-                # Special formatting for rational types (like ExposureTime, FNumber)
-                if isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], int) and isinstance(value[1], int) and value[1] != 0:
-                     if tag_name == "ExposureTime":
-                         value_str = f"1/{int(value[1]/value[0])}s" if value[0] != 0 else "0s"
-                     elif tag_name == "FNumber":
-                         value_str = f"f/{value[0]/value[1]:.1f}"
-                     elif tag_name == "FocalLength":
-                          value_str = f"{value[0]/value[1]:.1f}mm"
-                     else:
-                         value_str = f"{value[0]}/{value[1]}"
-                elif isinstance(value, bytes):
-                    try:
-                        value_str = value.decode('ascii', errors='replace')
-                    except:
-                        value_str = str(value)
-                else:
-                    value_str = str(value)
-                output_lines.append(f"  {tag_name}: {value_str}")
-            output_lines.append("")
+                gps_data_found = True
 
-        if 'GPS' in exif_dict and exif_dict['GPS']:
-            output_lines.append("GPS Information:")
-            lat_ref = long_ref = None
-            latitude = longitude = None
-            gps_data_found = False
+        if not gps_data_found:
+             output_lines.append("  No parsable GPS data tags found.")
 
-            # Simplified GPS coordinate extraction/formatting
-            try:
-                lat_dms = exif_dict['GPS'].get(piexif.GPSIFD.GPSLatitude)
-                lat_ref = exif_dict['GPS'].get(piexif.GPSIFD.GPSLatitudeRef)
-                long_dms = exif_dict['GPS'].get(piexif.GPSIFD.GPSLongitude)
-                long_ref = exif_dict['GPS'].get(piexif.GPSIFD.GPSLongitudeRef)
-
-                if lat_dms and lat_ref and long_dms and long_ref:
-                    if isinstance(lat_ref, bytes): lat_ref = lat_ref.decode('ascii', 'replace')
-                    if isinstance(long_ref, bytes): long_ref = long_ref.decode('ascii', 'replace')
-
-                    degrees = lat_dms[0][0] / lat_dms[0][1]
-                    minutes = lat_dms[1][0] / lat_dms[1][1]
-                    seconds = lat_dms[2][0] / lat_dms[2][1]
-                    latitude = degrees + minutes/60 + seconds/3600
-                    if lat_ref == 'S': latitude = -latitude
-
-                    degrees = long_dms[0][0] / long_dms[0][1]
-                    minutes = long_dms[1][0] / long_dms[1][1]
-                    seconds = long_dms[2][0] / long_dms[2][1]
-                    longitude = degrees + minutes/60 + seconds/3600
-                    if long_ref == 'W': longitude = -longitude
-
-                    output_lines.append(f"  GPS Coordinates: {latitude:.6f}, {longitude:.6f} ({lat_ref}, {long_ref})")
-                    gps_data_found = True
-
-            except (KeyError, IndexError, ZeroDivisionError, TypeError) as gps_ex:
-                output_lines.append(f"  Could not parse GPS coordinates: {gps_ex}")
-
-            # Display other GPS tags
-            for tag, value in exif_dict['GPS'].items():
-                 if tag not in [piexif.GPSIFD.GPSLatitude, piexif.GPSIFD.GPSLongitude]: # Avoid duplicate display
-                    tag_name = piexif.TAGS['GPS'].get(tag, {}).get('name', str(tag))
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('ascii', errors='replace')
-                        except:
-                            value = str(value)
-                    elif isinstance(value, tuple) and len(value) > 0 and isinstance(value[0], tuple): # Handle timestamp, etc.
-                        value = ", ".join([f"{v[0]}/{v[1]}" if isinstance(v, tuple) and len(v)==2 else str(v) for v in value])
-                    output_lines.append(f"  {tag_name}: {value}")
-                    gps_data_found = True
-
-            if not gps_data_found:
-                 output_lines.append("  No parsable GPS data tags found.")
-
-        elif 'GPS' in exif_dict:
-            output_lines.append("GPS Information:")
-            output_lines.append("  (Empty GPS IFD present)")
-
-        return "\n".join(output_lines)
+    elif 'GPS' in exif_dict:
+        output_lines.append("GPS Information:")
+        output_lines.append("  (Empty GPS IFD present)")
+
+    return "\n".join(output_lines)
+
+def get_metadata_string(image_path):
+    """Reads EXIF data from an image and returns it as a formatted string."""
+    try:
+        exif_dict = read_metadata(image_path)
+
+        # Check if image has EXIF data
+        if exif_dict is None:
+            return f"No EXIF data found in {os.path.basename(image_path)}"
+
+        return format_metadata(exif_dict, image_path)
 
     except FileNotFoundError:
         return f"Error: File not found - {os.path.basename(image_path)}"
     except Exception as e:
         return f"Error reading metadata for {os.path.basename(image_path)}: {e}"
 
-def process_images(image_paths, display_before=False, display_after=True, randomize_windows_props=True):
-    """Process multiple images from a list of paths."""
-    results = []
+def _matches_any(name, relative_path, patterns):
+    """Checks a file/folder name or its path relative to the scan root against glob patterns."""
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
 
-    for image_path in image_paths:
-        if not os.path.exists(image_path):
-            print(f"Error: Image '{image_path}' not found")
+def scan_images(folder, extensions=SUPPORTED_EXTENSIONS, include=None, exclude=None, max_depth=None):
+    """
+    Yields image paths under folder as they are found, walking subfolders with os.scandir.
+
+    Extensions are matched case-insensitively. include/exclude are glob patterns
+    matched against the file name or the path relative to folder (using '/'); an
+    excluded folder is not descended into. max_depth=0 only scans folder itself.
+    Symlinked folders are not followed.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    include = include or []
+    exclude = exclude or []
+
+    # Depth-first walk with an explicit stack so files are yielded while scanning continues
+    stack = [(folder, '', 0)]
+    while stack:
+        directory, relative_dir, depth = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logger.warning("Could not scan folder '%s': %s", directory, e)
             continue
 
-        if not image_path.lower().endswith(('.jpg', '.jpeg')):
-            print(f"Warning: '{image_path}' is not a JPEG file. Only JPEG files are supported.")
+        with entries:
+            for entry in entries:
+                relative_path = f"{relative_dir}{entry.name}"
+                if exclude and _matches_any(entry.name, relative_path, exclude):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if max_depth is None or depth < max_depth:
+                            stack.append((entry.path, relative_path + '/', depth + 1))
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if not entry.name.lower().endswith(extensions):
+                    continue
+                if include and not _matches_any(entry.name, relative_path, include):
+                    continue
+                yield entry.path
+
+def _fetch_cached(cache, image_path, output_path, policy, engine, max_pixels, thumbnail, stats):
+    """
+    Hashes image_path for the result cache and links a cached output to output_path if there is one.
+
+    Returns (key, how it was linked or None). The key also covers the options and
+    the tags policy keeps from the file; it is None if the file can't be hashed.
+    """
+    if policy is None:
+        policy = default_policy()
+    with stats.stage('cache'):
+        try:
+            with mapped_file(image_path) as data:
+                kept = None
+                if policy.needs_source:
+                    # What the policy takes from this file, after fallbacks
+                    source = read_source_tags(find_exif_payload(data), policy.source_ifds)
+                    kept = policy.apply({ifd: {} for ifd in ('0th', 'Exif', 'GPS')}, source)
+                    kept = sorted((ifd, sorted(tags.items())) for ifd, tags in kept.items())
+                options = json.dumps([policy.key, engine, max_pixels, thumbnail, repr(kept)])
+                key = content_digest(data, policy.keep_icc, options.encode('utf-8'))
+            if os.path.dirname(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            return key, cache.fetch(key, output_path)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.warning("Could not use the result cache for %s: %s", image_path, e)
+            return None, None
+
+def process_image(image_path, display_before=False, display_after=True, randomize_windows_props=True, engine='splice',
+                  max_pixels=DEFAULT_MAX_PIXELS, fsync=False, seed=None, seed_root=None, collect_stats=False,
+                  layout=None, policy=None, thumbnail=False, cache=None):
+    """
+    Validates and processes a single image, returning its result dict (or None if it was skipped).
+
+    layout (an OutputLayout) decides where the output goes; by default it is modified_<name> next to the input.
+    policy (a metadata_policy.CompiledPolicy) decides which tags are kept and
+    thumbnail whether JPEGs get an EXIF thumbnail (see randomize_metadata).
+    With a cache (a result_cache.ResultCache), copies of an already processed
+    image get its cached output linked into place instead of being randomized again.
+
+    With a seed, the random values come from file_rng(seed, path relative to seed_root).
+    With collect_stats, the result also carries the file's FileStats record under 'stats'.
+    """
+    if not os.path.exists(image_path):
+        logger.error("Image '%s' not found", image_path)
+        return None
+
+    if not image_path.lower().endswith(SUPPORTED_EXTENSIONS):
+        logger.warning("'%s' is not a supported image. Only JPEG, PNG, TIFF, WebP and HEIC files are supported.",
+                       image_path)
+        return None
+
+    output_path = layout.path_for(image_path) if layout is not None else None
+    if output_path is not None and not layout.in_place and os.path.abspath(output_path) == os.path.abspath(image_path):
+        logger.error("The output for '%s' would overwrite it; use in-place mode to replace originals", image_path)
+        return {'original': image_path, 'modified': None, 'success': False, 'skipped': False}
+
+    if display_before:
+        print("\n=== Original Metadata ===")
+        # Use the new function, but still print for CLI usage
+        print(get_metadata_string(image_path))
+
+    rng = reference_date = None
+    if seed is not None:
+        relative_path = os.path.relpath(image_path, seed_root) if seed_root else image_path
+        rng = file_rng(seed, relative_path)
+        reference_date = SEEDED_REFERENCE_DATE
+
+    stats = FileStats(image_path)
+    cache_key = cached = None
+    if cache is not None:
+        if output_path is None:
+            output_path = DEFAULT_LAYOUT.path_for(image_path)
+        cache_key, cached = _fetch_cached(cache, image_path, output_path, policy, engine, max_pixels, thumbnail,
+                                          stats)
+    if cached:
+        logger.info("Linked the cached output for %s to %s (%s)", image_path, output_path, cached)
+    else:
+        output_path = randomize_metadata(image_path, randomize_windows_props=randomize_windows_props, engine=engine,
+                                         max_pixels=max_pixels, fsync=fsync, rng=rng, reference_date=reference_date,
+                                         stats=stats, output_path=output_path, policy=policy, thumbnail=thumbnail)
+        if output_path and cache_key:
+            with stats.stage('cache'):
+                try:
+                    cache.store(cache_key, output_path)
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("Could not add %s to the result cache: %s", output_path, e)
+
+    if output_path and display_after:
+        print("\n=== New Randomized Metadata ===")
+        # Use the new function, but still print for CLI usage
+        print(get_metadata_string(output_path))
+
+    result = {
+        'original': image_path,
+        'modified': output_path,
+        'success': output_path is not None,
+        'skipped': False
+    }
+    if cache is not None:
+        result['cached'] = bool(cached)
+    if collect_stats:
+        result['stats'] = stats.to_dict()
+    return result
+
+def configure_logging(level=logging.INFO):
+    """Sends the randomizer's log messages to stderr as plain lines (no-op if logging is already set up)."""
+    logging.basicConfig(level=level, format='%(message)s')
+    logger.setLevel(level)
+
+def _run_batch(task, image_paths, workers=1, manifest=None, stats=None, on_result=None, layout=None, journal=None,
+               resume_event=None, mp_context=None):
+    """
+    Runs task over image_paths, either inline or in a process pool with a bounded number of files in flight.
+
+    Inputs the manifest reports as unchanged are skipped without being dispatched,
+    and every newly processed file is recorded in it as soon as it finishes.
+    A recorded output only counts if it is where layout would write it now.
+    Inputs the journal lists as finished are skipped too, and newly finished
+    ones are added to it. An input whose output path an earlier one already
+    takes fails without being processed.
+    Per-file stats records are moved out of the results into stats, and
+    on_result is called with every result as soon as it is known.
+    While resume_event (a threading.Event) is clear, no further input is taken
+    from image_paths, but files in flight are still collected and reported.
+    mp_context is the multiprocessing context for the pool.
+    """
+    results = {}
+    pending = {}
+    claimed = {}
+    max_in_flight = workers * QUEUE_DEPTH_PER_WORKER
+
+    def finish(index, result):
+        results[index] = result
+        if stats is not None and result is not None and 'stats' in result:
+            stats.add(result.pop('stats'))
+        if on_result is not None and result is not None:
+            on_result(result)
+        if manifest is not None and result is not None and result['success'] and not result['skipped']:
+            manifest.record(result['original'], result['modified'])
+        if journal is not None and result is not None and result['success'] and not result['skipped']:
+            journal.record(result['original'], result['modified'])
+
+    def collect(futures):
+        for future in futures:
+            index, image_path = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error("Error processing image '%s' in worker: %s", image_path, e)
+                result = {'original': image_path, 'modified': None, 'success': False, 'skipped': False}
+            finish(index, result)
+
+    def admitted(paths):
+        # A paused batch waits before taking the next input, so a cancel during the pause starts no more files
+        iterator = iter(paths)
+        while True:
+            while resume_event is not None and not resume_event.is_set():
+                if pending:
+                    done, _ = wait(pending, timeout=PAUSE_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                    collect(done)
+                else:
+                    resume_event.wait(PAUSE_POLL_INTERVAL)
+            image_path = next(iterator, None)
+            if image_path is None:
+                return
+            yield image_path
+
+    executor = None
+    if workers > 1:
+        # Spawned workers (Windows/macOS) don't inherit the logging setup, so pass the level along
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=configure_logging,
+                                       initargs=(logger.getEffectiveLevel(),))
+    try:
+        for index, image_path in enumerate(admitted(image_paths)):
+            conflict = _output_conflict(claimed, layout or DEFAULT_LAYOUT, image_path)
+            if conflict:
+                finish(index, conflict)
+                continue
+            if journal is not None:
+                previous_output = journal.output_for(image_path)
+                if previous_output:
+                    logger.debug("Skipping image finished before the restart: %s", image_path)
+                    finish(index, {'original': image_path, 'modified': previous_output, 'success': True,
+                                   'skipped': True, 'resumed': True})
+                    continue
+            if manifest is not None:
+                expected_output = (layout or DEFAULT_LAYOUT).path_for(image_path)
+                previous_output = manifest.lookup_unchanged(image_path, expected_output)
+                if previous_output:
+                    logger.info("Skipping unchanged image: %s", image_path)
+                    finish(index, {'original': image_path, 'modified': previous_output, 'success': True,
+                                   'skipped': True})
+                    continue
+
+            if executor is None:
+                finish(index, task(image_path))
+                continue
+
+            # Wait for a free slot so we never queue more work than the pool can chew through
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(task, image_path)] = (index, image_path)
+
+        if pending:
+            done, _ = wait(pending)
+            collect(done)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Report results in input order regardless of which worker finished first
+    return [results[index] for index in sorted(results) if results[index] is not None]
+
+def process_images(image_paths, display_before=False, display_after=True, randomize_windows_props=True, engine='splice',
+                   max_pixels=DEFAULT_MAX_PIXELS, workers=1, fsync=False, manifest=None, seed=None, seed_root=None,
+                   stats=None, on_result=None, layout=None, policy=None, thumbnail=False, cache=None, journal=None,
+                   resume_event=None, mp_context=None):
+    """
+    Process multiple images from a list of paths.
+
+    With workers > 1 the files are fanned out across a process pool. Results are
+    always returned in the same order as image_paths. If a ProcessingManifest is
+    given, inputs that haven't changed since their last run are skipped and
+    reported with 'skipped': True.
+
+    With a seed, each file gets its own RNG derived from the seed and its path
+    relative to seed_root, so outputs are byte-identical across runs regardless
+    of worker count or processing order.
+
+    If stats is given (an instrumentation.BatchStats, or anything with an
+    add(record) method), each processed file's FileStats record is passed to it.
+    on_result(result) is called in this process as each file finishes.
+    layout (an OutputLayout) sets the output folder and file names, policy
+    (a metadata_policy.CompiledPolicy) which tags are kept, and thumbnail
+    whether JPEGs get an EXIF thumbnail.
+
+    With a cache (a result_cache.ResultCache), inputs whose image data and kept
+    tags match an earlier file's get that file's output linked into place, so
+    duplicates cost one hash each. Those copies share the same random metadata,
+    so a cache can't be combined with a seed.
+
+    With a journal (a checkpoint_journal.CheckpointJournal), finished inputs are
+    recorded in checkpoints, and inputs it already lists (from an interrupted run
+    that is being resumed) are skipped and reported with 'resumed': True.
+
+    While resume_event (a threading.Event) is clear the batch is paused: no new
+    file is started, but files already in flight are still collected and
+    reported. mp_context (a multiprocessing context) sets how pool workers are
+    started, e.g. 'spawn' from a process that runs other threads.
+    """
+    if cache is not None and seed is not None:
+        raise ValueError("A result cache can't be combined with a seed")
+    task = partial(process_image, display_before=display_before, display_after=display_after,
+                   randomize_windows_props=randomize_windows_props, engine=engine, max_pixels=max_pixels,
+                   fsync=fsync, seed=seed, seed_root=seed_root, collect_stats=stats is not None, layout=layout,
+                   policy=policy, thumbnail=thumbnail, cache=cache)
+
+    return _run_batch(task, image_paths, workers=workers or 1, manifest=manifest, stats=stats, on_result=on_result,
+                      layout=layout, journal=journal, resume_event=resume_event, mp_context=mp_context)
+
+async def _aiter_paths(image_paths):
+    """Iterates over a plain or an async iterable of paths."""
+    if hasattr(image_paths, '__aiter__'):
+        async for image_path in image_paths:
+            yield image_path
+    else:
+        for image_path in image_paths:
+            yield image_path
+
+async def arandomize_many(image_paths, concurrency=DEFAULT_ASYNC_CONCURRENCY, randomize_windows_props=True,
+                          engine='splice', max_pixels=DEFAULT_MAX_PIXELS, fsync=False, seed=None, seed_root=None,
+                          executor=None, layout=None, policy=None, thumbnail=False, cache=None):
+    """
+    Asynchronously randomizes image_paths, yielding each file's result dict as soon as it is done.
+
+    The blocking work runs in an executor (a thread pool of `concurrency` threads
+    unless one is passed in), so the event loop stays free and the reads and
+    writes of different files overlap. image_paths may be a plain or an async
+    iterable; it is only consumed while fewer than `concurrency` files are in
+    flight, and no new file is started while the caller is busy with a result.
+
+    layout (an OutputLayout) sets the output folder and file names, policy
+    (a metadata_policy.CompiledPolicy) which tags are kept, and thumbnail
+    whether JPEGs get an EXIF thumbnail. cache works as in process_images.
+    Results come in completion order. Files process_image skips (missing or not a
+    supported image) are not reported. If the iteration is cancelled or closed early, files
+    that haven't started are dropped; files already being written finish in the
+    background (their outputs are still written atomically).
+    """
+    if cache is not None and seed is not None:
+        raise ValueError("A result cache can't be combined with a seed")
+    loop = asyncio.get_running_loop()
+    task = partial(process_image, display_before=False, display_after=False,
+                   randomize_windows_props=randomize_windows_props, engine=engine, max_pixels=max_pixels,
+                   fsync=fsync, seed=seed, seed_root=seed_root, layout=layout, policy=policy, thumbnail=thumbnail,
+                   cache=cache)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='randomize')
+    pending = {}
+    claimed = {}
+
+    def collect(futures):
+        for future in futures:
+            image_path = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error("Error processing image '%s' in worker: %s", image_path, e)
+                result = {'original': image_path, 'modified': None, 'success': False, 'skipped': False}
+            if result is not None:
+                yield result
+
+    try:
+        async for image_path in _aiter_paths(image_paths):
+            conflict = _output_conflict(claimed, layout or DEFAULT_LAYOUT, image_path)
+            if conflict:
+                yield conflict
+                continue
+            if len(pending) >= concurrency:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for result in collect(done):
+                    yield result
+            pending[loop.run_in_executor(executor, task, image_path)] = image_path
+
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for result in collect(done):
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            # Cancelling the asyncio futures above already cancelled the queued work items
+            executor.shutdown(wait=False)
+
+def enqueue_images(queue, image_paths, manifest=None, layout=None, policy=None, cache=None, **options):
+    """
+    Puts image_paths on queue (see work_queue) for run_queue_worker() and seals it.
+
+    options are process_image's (engine, max_pixels, fsync, seed, seed_root,
+    thumbnail, randomize_windows_props). They are stored on the queue together with
+    layout, policy (whose rules must be JSON-serializable, as loaded by load_policy)
+    and cache, so every worker handles its files the same way. Paths
+    are stored absolute, so all nodes need to see the files under the same paths.
+    Inputs the manifest reports as unchanged, or whose output path an earlier input
+    already takes, are not queued; their results are returned.
+    """
+    if cache is not None and options.get('seed') is not None:
+        raise ValueError("A result cache can't be combined with a seed")
+    layout = layout or DEFAULT_LAYOUT
+    seed_root = options.get('seed_root')
+    queue.set_config({
+        **options,
+        'seed_root': os.path.abspath(seed_root) if seed_root else None,
+        'layout': {'output_dir': os.path.abspath(layout.output_dir) if layout.output_dir else None,
+                   'input_root': os.path.abspath(layout.input_root) if layout.input_root else None,
+                   'name_template': layout.name_template, 'in_place': layout.in_place},
+        # Workers fall back to the default policy themselves (its rules hold bytes, which JSON can't)
+        'policy': policy.rules if policy is not None and policy is not default_policy() else None,
+        'cache': {'cache_dir': os.path.abspath(cache.cache_dir), 'max_bytes': cache.max_bytes} if cache else None,
+    })
+
+    skipped = []
+    batch = []
+    claimed = {}
+    for image_path in image_paths:
+        conflict = _output_conflict(claimed, layout, image_path)
+        if conflict:
+            skipped.append(conflict)
             continue
+        if manifest is not None and manifest.lookup_unchanged(image_path, layout.path_for(image_path)):
+            logger.info("Skipping unchanged image: %s", image_path)
+            skipped.append({'original': image_path, 'modified': layout.path_for(image_path), 'success': True,
+                            'skipped': True})
+            continue
+        batch.append(os.path.abspath(image_path))
+        if len(batch) >= ENQUEUE_BATCH_SIZE:
+            queue.put(batch)
+            batch = []
+    queue.put(batch)
+    queue.seal()
+    return skipped
+
+def wait_for_queue(queue, manifest=None, stats=None, on_result=None, poll_interval=QUEUE_POLL_INTERVAL):
+    """
+    Collects the results of every node from queue until all of its items are finished, and returns them.
+
+    Works like process_images' reporting: stats records go to stats, successes
+    are recorded in the manifest, and on_result is called as results arrive.
+    Each result names the worker that produced it under 'worker'.
+    """
+    results = []
+    seq = 0
+    while True:
+        # Counts first: results read afterwards include everything counted as finished
+        counts = queue.counts()
+        idle = queue.sealed() and not counts[PENDING] and not counts[LEASED]
+        for seq, result in queue.results_after(seq):
+            if stats is not None and 'stats' in result:
+                stats.add(result.pop('stats'))
+            if manifest is not None and result['success']:
+                manifest.record(result['original'], result['modified'])
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        if idle:
+            return results
+        time.sleep(poll_interval)
 
-        if display_before:
-            print("\n=== Original Metadata ===")
-            # Use the new function, but still print for CLI usage
-            print(get_metadata_string(image_path))
+def _run_queue_item(item, worker, layout, policy, cache, **options):
+    """Processes one leased (item_id, image_path) and returns (item_id, result dict)."""
+    item_id, image_path = item
+    try:
+        result = process_image(image_path, display_before=False, display_after=False, collect_stats=True,
+                               layout=layout, policy=policy, cache=cache, **options)
+    except Exception as e:
+        logger.error("Error processing image '%s' in worker: %s", image_path, e)
+        result = None
+    if result is None:
+        result = {'original': image_path, 'modified': None, 'success': False, 'skipped': False}
+    result['worker'] = worker
+    return item_id, result
 
-        output_path = randomize_metadata(image_path, randomize_windows_props=randomize_windows_props)
+def run_queue_worker(queue, workers=1, worker_id=None, on_result=None, poll_interval=QUEUE_POLL_INTERVAL):
+    """
+    Processes items from queue (filled by enqueue_images) until it is sealed and every item is finished.
 
-        if output_path and display_after:
-            print("\n=== New Randomized Metadata ===")
-            # Use the new function, but still print for CLI usage
-            print(get_metadata_string(output_path))
+    With workers > 1 the files run in a process pool. Leases are renewed while
+    the leased files wait, failed files go back on the queue (see work_queue for
+    retries), and on_result(result) is called for every attempt. Returns the
+    number of files this worker finished.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    config = queue.config()
+    while config is None:
+        time.sleep(poll_interval)
+        config = queue.config()
+    layout_options = config.pop('layout')
+    policy_rules = config.pop('policy')
+    cache_options = config.pop('cache')
+    task = partial(_run_queue_item, worker=worker_id, layout=OutputLayout(**layout_options),
+                   policy=compile_policy(policy_rules) if policy_rules is not None else None,
+                   cache=ResultCache(**cache_options) if cache_options else None, **config)
 
-        results.append({
-            'original': image_path,
-            'modified': output_path,
-            'success': output_path is not None
-        })
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=configure_logging,
+                                       initargs=(logger.getEffectiveLevel(),))
+    batch_size = max(1, workers) * QUEUE_DEPTH_PER_WORKER
+    finished = 0
+    try:
+        while True:
+            items = queue.lease(worker_id, batch_size)
+            if not items:
+                counts = queue.counts()
+                if queue.sealed() and not counts[PENDING] and not counts[LEASED]:
+                    return finished
+                time.sleep(poll_interval)
+                continue
 
-    return results
+            outstanding = {item_id for item_id, _ in items}
+            last_renewal = time.monotonic()
+            if executor is None:
+                outcomes = (task(item) for item in items)
+            else:
+                outcomes = (future.result() for future in as_completed([executor.submit(task, item)
+                                                                        for item in items]))
+            for item_id, result in outcomes:
+                outstanding.discard(item_id)
+                if result['success']:
+                    queue.complete(item_id, result)
+                    finished += 1
+                elif queue.fail(item_id, result, f"processing failed on {worker_id}"):
+                    logger.warning("Processing %s failed, it will be retried", result['original'])
+                if on_result is not None:
+                    on_result(result)
+                # Keep the rest of the batch ours while it waits
+                if outstanding and time.monotonic() - last_renewal > queue.lease_seconds / 3:
+                    queue.renew(outstanding, worker_id)
+                    last_renewal = time.monotonic()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
 
 def main():
     parser = argparse.ArgumentParser(description='Image Metadata Randomizer')
@@ -424,59 +1682,278 @@ def main():
     # Create a group for mutually exclusive input options
     input_group = parser.add_mutually_exclusive_group(required=True)
     input_group.add_argument('images', nargs='*', help='Path to image file(s)', default=[])
-    input_group.add_argument('--folder', '-f', help='Process all jpg/jpeg files in a folder')
+    input_group.add_argument('--folder', '-f', help='Process all JPEG, PNG, TIFF, WebP and HEIC files in a folder and its subfolders')
+    input_group.add_argument('--worker', metavar='QUEUE',
+                             help='Run as a worker: process images from this work queue (sqlite:///path or '
+                                  'redis://host) until the coordinator\'s batch is done')
     
     # Add other options
     parser.add_argument('--display-before', '-b', action='store_true', 
                         help='Display metadata before randomization')
-    parser.add_argument('--display-after', '-a', action='store_true', 
-                        help='Display metadata after randomization (default: True)', default=True)
+    parser.add_argument('--display-after', '-a', action='store_true', default=None,
+                        help='Display metadata after randomization (default: on, off with --quiet)')
+    parser.add_argument('--no-display-after', dest='display_after', action='store_false', default=None,
+                        help="Don't display metadata after randomization")
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='Only log warnings and errors and show a single progress line instead of per-file output')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Also log every changed metadata field')
+    parser.add_argument('--results-jsonl', metavar='PATH',
+                        help='Append one JSON line per processed file (written in the background)')
     parser.add_argument('--no-windows-props', action='store_true',
                         help="Don't try to modify Windows-specific properties")
+    parser.add_argument('--engine', choices=ENGINES, default='splice',
+                        help="How to write the output: 'splice' swaps metadata without touching the image data "
+                             "(default), 're-encode' decodes and re-saves the pixels")
+    parser.add_argument('--max-pixels', type=int, default=DEFAULT_MAX_PIXELS,
+                        help="Largest image (width x height) the re-encode engine will decode; bigger images "
+                             f"are spliced instead (default: {DEFAULT_MAX_PIXELS}, 0 disables the limit)")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Number of worker processes to spread the files across (default: 1)')
+    parser.add_argument('--fsync', action='store_true',
+                        help='Flush each output file to disk before renaming it into place')
+    parser.add_argument('--manifest', metavar='PATH',
+                        help='Manifest database used to skip inputs that are unchanged since the last run '
+                             f"(default with --folder: <folder>/{MANIFEST_FILENAME})")
+    parser.add_argument('--no-manifest', action='store_true',
+                        help='Process every input, ignoring and not updating the manifest')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run: skip every input its checkpoint journal lists as done')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='Checkpoint journal of finished inputs, for --resume '
+                             f"(default with --folder: <folder>/{JOURNAL_FILENAME})")
+    parser.add_argument('--manifest-hash', action='store_true',
+                        help='Also store a content hash so touched-but-identical files are still skipped')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Make the random metadata reproducible: each file gets its own RNG derived from this '
+                             'seed and its path (relative to --folder)')
+    parser.add_argument('--stats-jsonl', metavar='PATH',
+                        help='Append per-file stage timings and byte counts to this JSON lines file')
+    parser.add_argument('--stats-prometheus', metavar='PATH',
+                        help='Write run totals in Prometheus textfile format (for the node exporter)')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help='With --folder, only process files matching this glob pattern (repeatable)')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                        help='With --folder, skip files and subfolders matching this glob pattern (repeatable)')
+    parser.add_argument('--max-depth', type=int, default=None,
+                        help='With --folder, how many subfolder levels to descend (default: unlimited, 0 = top folder only)')
+    parser.add_argument('--output-dir', '-o', metavar='DIR',
+                        help='Write outputs into this folder instead of next to the inputs, mirroring the '
+                             '--folder tree (also holds the default manifest)')
+    parser.add_argument('--name-template', metavar='TEMPLATE',
+                        help="Output file name, using {name}, {stem} and {ext} "
+                             f"(default: '{DEFAULT_NAME_TEMPLATE}', or '{{name}}' with --output-dir)")
+    parser.add_argument('--in-place', action='store_true',
+                        help='Replace each input with its randomized version (atomically)')
+    parser.add_argument('--policy', metavar='PATH',
+                        help='JSON or YAML file saying which tags to keep, drop, randomize or set to fixed values '
+                             "(default: randomize everything, keep orientation, resolution and ICC profile)")
+    parser.add_argument('--thumbnail', action='store_true',
+                        help='Store a small preview in the EXIF data of JPEG outputs, so viewers don\'t have to '
+                             'generate one')
+    parser.add_argument('--queue', metavar='QUEUE',
+                        help='Run as the coordinator: put the images on this work queue (sqlite:///path or '
+                             'redis://host) for --worker processes on any node, and report their progress')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help='With --queue/--worker, how long a worker may hold a file before it is handed to '
+                             'another one (default: %(default)s)')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help='With --queue/--worker, how often a file is tried before it counts as failed '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='Keep randomized outputs in this folder, keyed by image content, and link them for '
+                             'duplicate inputs instead of processing them again (copies share their metadata)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), metavar='MB',
+                        help='Largest size of the --cache-dir contents; least recently used outputs are evicted '
+                             '(default: %(default)s)')
     
     args = parser.parse_args()
+
+    configure_logging(logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO)
+    queue_options = {'lease_seconds': args.lease_seconds, 'max_attempts': args.max_attempts}
+    if args.worker:
+        # Everything else comes from the coordinator's settings on the queue
+        try:
+            queue = open_queue(args.worker, **queue_options)
+        except (ValueError, sqlite3.Error) as e:
+            parser.error(f"Can't open work queue '{args.worker}': {e}")
+        progress = ProgressLine() if args.quiet else None
+        try:
+            finished = run_queue_worker(queue, workers=args.workers,
+                                        on_result=progress.update if progress is not None else None)
+        finally:
+            if progress is not None:
+                progress.finish()
+            queue.close()
+        print(f"Worker done: {finished} files processed")
+        return
+    display_after = args.display_after if args.display_after is not None else not args.quiet
+    try:
+        layout = OutputLayout(output_dir=args.output_dir, input_root=args.folder, name_template=args.name_template,
+                              in_place=args.in_place)
+    except ValueError as e:
+        parser.error(str(e))
+    policy = None
+    if args.policy:
+        try:
+            policy = load_policy(args.policy)
+            check_policy(policy)
+        except (OSError, ValueError) as e:
+            parser.error(f"Invalid policy file '{args.policy}': {e}")
+    if args.cache_dir and args.seed is not None:
+        parser.error("--cache-dir can't be combined with --seed")
+    cache = ResultCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024) if args.cache_dir else None
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
     
     # Check if we need to get images from a folder
     image_paths = []
+    manifest_path = args.manifest
     if args.folder:
         if not os.path.isdir(args.folder):
-            print(f"Error: Folder '{args.folder}' not found or is not a directory")
-            return
-            
-        # Get all jpg/jpeg files in the folder
-        image_paths = glob.glob(os.path.join(args.folder, '*.jpg'))
-        image_paths.extend(glob.glob(os.path.join(args.folder, '*.jpeg')))
-        
-        if not image_paths:
-            print(f"No jpg/jpeg files found in folder '{args.folder}'")
+            logger.error("Folder '%s' not found or is not a directory", args.folder)
             return
-            
-        print(f"Found {len(image_paths)} images in folder '{args.folder}'")
+
+        # Stream image files from the folder tree straight into processing.
+        # Outputs written into the scanned tree are never picked up as new inputs.
+        logger.info("Scanning folder '%s' for images...", args.folder)
+        exclude = args.exclude or []
+        exclude += [pattern for pattern in layout.scan_excludes(args.folder) if pattern not in exclude]
+        image_paths = scan_images(args.folder, include=args.include, exclude=exclude, max_depth=args.max_depth)
+        if manifest_path is None:
+            # Keep the manifest with the outputs, so a read-only source tree works
+            manifest_path = os.path.join(args.output_dir or args.folder, MANIFEST_FILENAME)
     else:
         # Use the images provided as arguments
         image_paths = args.images
+
+    if args.queue and (args.resume or args.journal):
+        parser.error("--queue runs are resumed by starting the coordinator again on the same queue")
+    journal_path = args.journal
+    if journal_path is None and args.folder and not args.queue:
+        journal_path = os.path.join(args.output_dir or args.folder, JOURNAL_FILENAME)
+    if args.resume and not journal_path:
+        parser.error("--resume needs --folder or --journal")
+
+    # Temp outputs a killed run left behind are removed from each output folder as the batch reaches it
+    image_paths = sweep_output_folders(image_paths, layout)
+
+    manifest = None
+    if manifest_path and not args.no_manifest:
+        manifest = ProcessingManifest(manifest_path, use_hash=args.manifest_hash,
+                                      options=manifest_options(layout, policy, engine=args.engine,
+                                                               max_pixels=args.max_pixels, seed=args.seed,
+                                                               seed_root=args.folder, thumbnail=args.thumbnail,
+                                                               randomize_windows_props=not args.no_windows_props))
+    journal = CheckpointJournal(journal_path, resume=args.resume) if journal_path else None
+    if journal is not None and journal.done:
+        logger.info("Resuming: %d files were already done", len(journal.done))
+    stats = BatchStats(jsonl_path=args.stats_jsonl)
+
+    # Per-file output: a batched progress line in quiet mode, results in the background
+    progress = ProgressLine() if args.quiet else None
+    results_writer = AsyncJsonlWriter(args.results_jsonl) if args.results_jsonl else None
+
+    def on_result(result):
+        if progress is not None:
+            progress.update(result)
+        if results_writer is not None:
+            results_writer.write(result)
     
+    queue = None
+    if args.queue:
+        try:
+            queue = open_queue(args.queue, **queue_options)
+        except (ValueError, sqlite3.Error) as e:
+            parser.error(f"Can't open work queue '{args.queue}': {e}")
+
     # Process the images
-    results = process_images(
-        image_paths, 
-        display_before=args.display_before,
-        display_after=args.display_after,
-        randomize_windows_props=not args.no_windows_props
-    )
+    try:
+        if queue is not None:
+            results = enqueue_images(queue, image_paths, manifest=manifest, layout=layout, policy=policy, cache=cache,
+                                     engine=args.engine, max_pixels=args.max_pixels, fsync=args.fsync, seed=args.seed,
+                                     seed_root=args.folder, thumbnail=args.thumbnail,
+                                     randomize_windows_props=not args.no_windows_props)
+            for result in results:
+                on_result(result)
+            logger.info("Images queued on %s, waiting for workers...", args.queue)
+            results += wait_for_queue(queue, manifest=manifest, stats=stats, on_result=on_result)
+        else:
+            results = process_images(
+                image_paths, 
+                display_before=args.display_before,
+                display_after=display_after,
+                randomize_windows_props=not args.no_windows_props,
+                engine=args.engine,
+                max_pixels=args.max_pixels,
+                workers=args.workers,
+                fsync=args.fsync,
+                manifest=manifest,
+                seed=args.seed,
+                seed_root=args.folder,
+                stats=stats,
+                on_result=on_result,
+                layout=layout,
+                policy=policy,
+                thumbnail=args.thumbnail,
+                cache=cache,
+                journal=journal
+            )
+    finally:
+        if progress is not None:
+            progress.finish()
+        if results_writer is not None:
+            results_writer.close()
+        if manifest is not None:
+            manifest.close()
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        if queue is not None:
+            queue.close()
+        stats.close()
+        if args.stats_prometheus:
+            stats.write_prometheus(args.stats_prometheus)
     
+    if args.folder and not results:
+        print(f"No supported image files found in folder '{args.folder}'")
+        return
+
     # Show a summary
-    success_count = sum(1 for r in results if r['success'])
+    skipped_count = sum(1 for r in results if r['skipped'])
+    failed_count = sum(1 for r in results if not r['success'])
     if results:
         print(f"\n====== Summary ======")
-        print(f"Processed {len(results)} images")
-        print(f"Success: {success_count}")
-        print(f"Failed: {len(results) - success_count}")
+        print(f"Found {len(results)} images")
+        print(f"Processed: {len(results) - skipped_count - failed_count}")
+        resumed_count = sum(1 for r in results if r.get('resumed'))
+        print(f"Skipped (unchanged): {skipped_count - resumed_count}")
+        if resumed_count:
+            print(f"Skipped (done before the restart): {resumed_count}")
+        if cache is not None:
+            print(f"From cache: {sum(1 for r in results if r.get('cached'))}")
+        print(f"Failed: {failed_count}")
+        if queue is not None:
+            per_worker = {}
+            for result in results:
+                if 'worker' in result:
+                    per_worker[result['worker']] = per_worker.get(result['worker'], 0) + 1
+            if per_worker:
+                print("\n====== Files per worker ======")
+                for worker, count in sorted(per_worker.items()):
+                    print(f"  {worker}: {count}")
+        if stats.files:
+            print("\n====== Time per stage ======")
+            for line in stats.summary_lines():
+                print(line)
 
 if __name__ == "__main__":
     # Check for command line arguments
     if len(sys.argv) > 1:
         main()
     else:
+        configure_logging()
         # Legacy mode: Process the single image specified in the code
         original_image = r"C:\path\to\image.jpg"
         print("=" * 80)
@@ -489,7 +1966,7 @@ if __name__ == "__main__":
         print("     python image_metadata_randomizer.py \"C:\\path\\to\\image.jpg\"")
         print("\n   - Process multiple images:")
         print("     python image_metadata_randomizer.py \"C:\\path\\to\\image1.jpg\" \"C:\\path\\to\\image2.jpg\"")
-        print("\n   - Process all JPEG images in a folder:")
+        print("\n   - Process all images in a folder:")
         print("     python image_metadata_randomizer.py --folder \"C:\\path\\to\\folder\"")
         print("\n   - Show original metadata too:")
         print("     python image_metadata_randomizer.py --display-before \"C:\\path\\to\\image.jpg\"")
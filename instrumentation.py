@@ -0,0 +1,131 @@
+"""
+Per-stage timing and counters for the metadata randomizer.
+
+randomize_metadata records into a FileStats object: how long each stage took
+(read, decode, build_exif, exif_dump, splice, encode, write, ...), how many bytes
+were read and written, and how many errors occurred. Batch runs collect the
+per-file records in a BatchStats, which can print a summary, stream every
+record to a JSON lines file and write a Prometheus textfile for node exporters.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Prefix for all exported Prometheus metric names
+METRIC_PREFIX = 'image_randomizer'
+
+class FileStats:
+    """Timings and counters for a single file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.durations = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block and adds it to the named stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - started
+
+    def to_dict(self):
+        """Returns a plain (picklable, JSON-friendly) copy of the stats."""
+        return {
+            'path': self.path,
+            'durations': dict(self.durations),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'errors': self.errors,
+        }
+
+class BatchStats:
+    """
+    Aggregates FileStats records for a batch.
+
+    If jsonl_path is given, every record is appended to that file as it arrives
+    (so memory use doesn't grow with the batch) and a summary line is written on close().
+    """
+
+    def __init__(self, jsonl_path=None):
+        self.files = 0
+        self.durations = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.started = time.time()
+        self._jsonl = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def add(self, record):
+        """Adds one FileStats.to_dict() record."""
+        self.files += 1
+        for name, seconds in record['durations'].items():
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.bytes_read += record['bytes_read']
+        self.bytes_written += record['bytes_written']
+        self.errors += record['errors']
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps({'type': 'file', **record}) + '\n')
+
+    def summary(self):
+        return {
+            'files': self.files,
+            'durations': dict(self.durations),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'errors': self.errors,
+            'wall_seconds': time.time() - self.started,
+        }
+
+    def summary_lines(self):
+        """Returns the per-stage summary as text lines for the end of a run."""
+        lines = [f"Bytes read: {self.bytes_read / (1024 * 1024):.1f} MB, "
+                 f"written: {self.bytes_written / (1024 * 1024):.1f} MB, errors: {self.errors}"]
+        total = sum(self.durations.values())
+        for name, seconds in sorted(self.durations.items(), key=lambda item: item[1], reverse=True):
+            share = seconds / total if total > 0 else 0.0
+            per_file = seconds / self.files * 1000 if self.files else 0.0
+            lines.append(f"  {name:<12} {seconds:9.3f}s {share:6.1%}  ({per_file:.2f} ms/file)")
+        return lines
+
+    def write_prometheus(self, path):
+        """Writes the totals in Prometheus textfile format, replacing path atomically."""
+        lines = [
+            f"# HELP {METRIC_PREFIX}_files_total Files randomized.",
+            f"# TYPE {METRIC_PREFIX}_files_total counter",
+            f"{METRIC_PREFIX}_files_total {self.files}",
+            f"# HELP {METRIC_PREFIX}_errors_total Files that failed to randomize.",
+            f"# TYPE {METRIC_PREFIX}_errors_total counter",
+            f"{METRIC_PREFIX}_errors_total {self.errors}",
+            f"# HELP {METRIC_PREFIX}_bytes_read_total Bytes read from input images.",
+            f"# TYPE {METRIC_PREFIX}_bytes_read_total counter",
+            f"{METRIC_PREFIX}_bytes_read_total {self.bytes_read}",
+            f"# HELP {METRIC_PREFIX}_bytes_written_total Bytes written to output images.",
+            f"# TYPE {METRIC_PREFIX}_bytes_written_total counter",
+            f"{METRIC_PREFIX}_bytes_written_total {self.bytes_written}",
+            f"# HELP {METRIC_PREFIX}_stage_seconds_total Time spent in each processing stage.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+        ]
+        for name, seconds in sorted(self.durations.items()):
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}')
+        lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds When the run finished.")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.0f}")
+
+        # The textfile collector may read at any moment, so never expose a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+
+    def close(self):
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps({'type': 'summary', **self.summary()}) + '\n')
+            self._jsonl.close()
+            self._jsonl = None
@@ -0,0 +1,243 @@
+"""
+Helpers for working directly on the JPEG marker stream.
+
+These functions let the randomizer swap metadata segments without decoding
+the pixels or re-encoding the image: the entropy-coded scan data is copied
+through byte for byte. They accept any bytes-like object (bytes, bytearray,
+memoryview, mmap), so callers can hand in a buffer without copying it first.
+Files are memory-mapped (see mapped_file), so only the pages that are actually
+touched are read, and kept segments are passed on as memoryview slices.
+"""
+
+import mmap
+import re
+from contextlib import contextmanager
+
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+APP0 = 0xE0
+APP1 = 0xE1
+APP2 = 0xE2
+APP13 = 0xED
+APP14 = 0xEE
+COM = 0xFE
+
+# Start-of-frame markers (SOF0-SOF15 minus DHT, JPG and DAC), whose header holds the image size
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Markers that have no length field (TEM and RST0-RST7)
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+# APPn segments that affect how the pixels are decoded (JFIF and Adobe colour
+# transform). Every other APPn segment and all COM segments are metadata.
+KEEP_APP_MARKERS = {APP0, APP14}
+
+# Identifier at the start of an APP1 segment that holds EXIF (as opposed to XMP)
+EXIF_HEADER = b'Exif\x00\x00'
+
+# Identifier at the start of an APP2 segment that holds (part of) an ICC profile
+ICC_HEADER = b'ICC_PROFILE\x00'
+
+# An APP1 payload is limited by the 16-bit segment length field
+MAX_SEGMENT_PAYLOAD = 0xFFFF - 2
+
+# Inside scan data a 0xFF is followed by 0x00 (stuffing), RST0-RST7 or another
+# 0xFF (fill); any other byte after it starts the next real marker. re works on
+# every buffer type, unlike bytes.find, which memoryview doesn't have.
+_SCAN_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+
+
+def _skip_scan_data(data, pos):
+    """Return the offset of the first real marker after entropy-coded data at `pos`."""
+    match = _SCAN_MARKER.search(data, pos)
+    return match.start() if match else len(data)
+
+
+def iter_segments(data, header_only=False):
+    """
+    Yield (marker, start, end) for every segment in a JPEG byte string.
+
+    `start` is the offset of the 0xFF marker prefix and `end` is the offset just
+    past the segment. The SOS range also covers the scan data that follows it.
+    Iteration stops at EOI, so anything appended after the image is not reported.
+    With `header_only`, iteration stops at the first SOS (reported without its
+    scan data), so the compressed image data is never touched.
+    `data` may be any bytes-like object with single-byte items.
+    """
+    if data[0:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG file (missing SOI marker)")
+    yield SOI, 0, 2
+
+    pos = 2
+    size = len(data)
+    while pos < size:
+        if data[pos] != 0xFF:
+            raise ValueError(f"Corrupt JPEG: expected a marker at offset {pos}")
+        start = pos
+        while pos < size and data[pos] == 0xFF:
+            pos += 1
+        if pos >= size:
+            break
+        marker = data[pos]
+        pos += 1
+
+        if marker == EOI:
+            yield marker, start, pos
+            return
+        if marker in STANDALONE_MARKERS:
+            yield marker, start, pos
+            continue
+
+        if pos + 2 > size:
+            raise ValueError(f"Corrupt JPEG: truncated segment at offset {start}")
+        length = (data[pos] << 8) | data[pos + 1]
+        if length < 2 or pos + length > size:
+            raise ValueError(f"Corrupt JPEG: bad segment length at offset {start}")
+        pos += length
+
+        if marker == SOS:
+            if header_only:
+                yield marker, start, pos
+                return
+            pos = _skip_scan_data(data, pos)
+        yield marker, start, pos
+
+
+def is_metadata_marker(marker):
+    """Return True for segments that only carry metadata (Exif, XMP, IPTC, comments, ...)."""
+    if marker == COM:
+        return True
+    return 0xE0 <= marker <= 0xEF and marker not in KEEP_APP_MARKERS
+
+
+def _payload_start(data, start):
+    """Return the offset of the payload of the segment whose marker (possibly after fill bytes) is at `start`."""
+    while data[start + 1] == 0xFF:
+        start += 1
+    return start + 4
+
+
+def is_icc_segment(data, marker, start):
+    """Return True if the segment at `start` is an APP2 segment holding ICC profile data."""
+    if marker != APP2:
+        return False
+    payload = _payload_start(data, start)
+    return data[payload:payload + len(ICC_HEADER)] == ICC_HEADER
+
+
+def build_app1_segment(exif_bytes):
+    """Wrap a `piexif.dump` blob in an APP1 marker segment."""
+    if len(exif_bytes) > MAX_SEGMENT_PAYLOAD:
+        raise ValueError(f"EXIF data too large for a single APP1 segment ({len(exif_bytes)} bytes)")
+    length = len(exif_bytes) + 2
+    return bytes((0xFF, APP1, length >> 8, length & 0xFF)) + exif_bytes
+
+
+def splice_parts(data, exif_bytes, keep_icc=False):
+    """
+    Return the pieces of the JPEG `data` with all metadata segments removed and
+    `exif_bytes` inserted as the only APP1 segment, as a list of buffers.
+    With `keep_icc`, the ICC profile (APP2) segments are kept byte for byte.
+
+    The new segment goes right after SOI (and after a leading JFIF APP0 segment,
+    which has to come first). Tables, frame headers and scan data are copied
+    unchanged, so the decoded pixels are identical to the original. With a
+    memoryview the kept segments are slices of it, so the pieces can be written
+    out (file.writelines) without ever copying the image data onto the heap.
+    """
+    app1 = build_app1_segment(exif_bytes)
+    parts = []
+    inserted = False
+    for marker, start, end in iter_segments(data):
+        if marker == SOI:
+            parts.append(data[start:end])
+            continue
+        if not inserted and marker != APP0:
+            parts.append(app1)
+            inserted = True
+        if is_metadata_marker(marker) and not (keep_icc and is_icc_segment(data, marker, start)):
+            continue
+        parts.append(data[start:end])
+    if not inserted:
+        parts.append(app1)
+    return parts
+
+
+def splice_exif(data, exif_bytes, keep_icc=False):
+    """Return a copy of the JPEG `data` with its metadata replaced by `exif_bytes` (see splice_parts)."""
+    return b''.join(splice_parts(data, exif_bytes, keep_icc=keep_icc))
+
+
+@contextmanager
+def mapped_file(path):
+    """
+    Yield a read-only memoryview of the file at `path`, memory-mapped where possible.
+
+    Pages are only read from disk when they are touched. Slices of the view must
+    not outlive the block. Files that can't be mapped (empty files, some network
+    filesystems) are read into memory instead.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            yield memoryview(f.read())
+            return
+        view = memoryview(mapping)
+        try:
+            yield view
+        finally:
+            try:
+                view.release()
+                mapping.close()
+            except BufferError:
+                # Slices are still referenced (e.g. by a traceback); the mapping goes away with them
+                pass
+
+
+def frame_size(data):
+    """
+    Return the (width, height) from the frame header of the JPEG in `data`, or None if it has none.
+
+    Only the marker segments in front of the first scan are looked at, so the
+    size is known without decoding anything. Raises ValueError if `data` is not a JPEG.
+    """
+    for marker, start, end in iter_segments(data, header_only=True):
+        if marker in SOF_MARKERS:
+            payload = _payload_start(data, start)
+            if payload + 5 > end:
+                raise ValueError(f"Corrupt JPEG: truncated frame header at offset {start}")
+            # Sample precision (1 byte), then height and width (2 bytes each)
+            height = (data[payload + 1] << 8) | data[payload + 2]
+            width = (data[payload + 3] << 8) | data[payload + 4]
+            return width, height
+    return None
+
+
+def find_exif_payload(data):
+    """
+    Return the APP1 Exif payload (starting with b'Exif\\0\\0') of the JPEG in `data`, or None.
+
+    Only the marker segments in front of the first scan are looked at.
+    Raises ValueError if `data` is not a JPEG.
+    """
+    for marker, start, end in iter_segments(data, header_only=True):
+        if marker != APP1:
+            continue
+        payload = _payload_start(data, start)
+        if data[payload:payload + len(EXIF_HEADER)] == EXIF_HEADER:
+            return bytes(data[payload:end])
+    return None
+
+
+def read_exif_payload(path):
+    """
+    Return the APP1 Exif payload (starting with b'Exif\\0\\0') of a JPEG file, or None.
+
+    The file is memory-mapped and only the segments in front of the first scan
+    are parsed, so the cost is a few page faults no matter how big the image is.
+    Raises ValueError if the file is not a JPEG.
+    """
+    with mapped_file(path) as data:
+        return find_exif_payload(data)
@@ -1,12 +1,91 @@
 import sys
 import os
+import logging
+import multiprocessing
+import time
+import threading
+from collections import OrderedDict
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLabel, QListWidget, QFileDialog,
-                             QMessageBox, QTextEdit, QSplitter, QListWidgetItem)
-from PySide6.QtCore import Qt, QUrl, Slot
+                             QMessageBox, QTextEdit, QSplitter, QListWidgetItem,
+                             QProgressBar)
+from PySide6.QtCore import Qt, QUrl, Slot, Signal, QThread, QRunnable, QThreadPool
 from PySide6.QtGui import QDragEnterEvent, QDropEvent
 
-from image_metadata_randomizer import randomize_metadata, get_metadata_string
+from image_metadata_randomizer import (process_images, scan_images, get_metadata_string, configure_logging,
+                                       manifest_options, DEFAULT_LAYOUT)
+from image_formats import SUPPORTED_EXTENSIONS
+from processing_manifest import ProcessingManifest, MANIFEST_FILENAME
+
+logger = logging.getLogger('metadata_gui')
+
+# File types the metadata preview is shown for
+PREVIEW_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp', '.heic', '.heif')
+
+# How many list items above and below the selection get their metadata prefetched
+PREFETCH_RADIUS = 3
+
+class MetadataPreviewCache:
+    """
+    Thread-safe LRU cache of metadata preview text, bounded by entry count and total size.
+
+    Entries remember the file's mtime and size and are re-read as soon as either changes.
+    """
+    def __init__(self, max_entries=512, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # path -> (mtime_ns, size, text, text_bytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the metadata text for path, from the cache if the file hasn't changed."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return get_metadata_string(path) # Produces the usual error message
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self._entries.move_to_end(path)
+                return entry[2]
+
+        # Read outside the lock so prefetching never blocks the UI thread
+        text = get_metadata_string(path)
+        self._store(path, stat.st_mtime_ns, stat.st_size, text)
+        return text
+
+    def _store(self, path, mtime_ns, size, text):
+        text_bytes = len(text.encode('utf-8'))
+        with self._lock:
+            old_entry = self._entries.pop(path, None)
+            if old_entry is not None:
+                self._total_bytes -= old_entry[3]
+            if text_bytes > self.max_bytes:
+                return
+            self._entries[path] = (mtime_ns, size, text, text_bytes)
+            self._total_bytes += text_bytes
+            # Evict least recently used entries until both limits are met
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+class MetadataPrefetchTask(QRunnable):
+    """Loads metadata for a few files into the preview cache on a background thread."""
+    def __init__(self, cache, paths):
+        super().__init__()
+        self.cache = cache
+        self.paths = paths
+
+    def run(self):
+        for path in self.paths:
+            self.cache.get(path)
 
 class DragDropArea(QLabel):
     """Custom QLabel subclass to handle drag and drop."""
@@ -66,6 +145,107 @@ class DragDropArea(QLabel):
             }
         """)
 
+class RandomizationWorker(QThread):
+    """
+    Runs the core batch engine (process_images) over a list of files off the UI thread, with pause and cancel support.
+
+    Files go through the same process pool, output layout and manifest as on
+    the command line; each result is forwarded as a progress signal. Pauses and
+    cancels take effect before the next file is handed out. Files already in
+    flight finish first, and their results are still reported while paused.
+    """
+    # files done, total files, current file, success, throughput (files/s), ETA in seconds (-1 if unknown)
+    progress = Signal(int, int, str, bool, float, float)
+    # processed count, error messages, cancelled
+    batch_finished = Signal(int, list, bool)
+
+    def __init__(self, files, workers=None, manifest_path=None, parent=None):
+        super().__init__(parent)
+        self.files = files
+        self.workers = workers or os.cpu_count() or 1
+        self.manifest_path = manifest_path
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._pause_lock = threading.Lock()
+        self._paused_at = None
+        self._paused_seconds = 0.0
+
+    def cancel(self):
+        self._cancel_event.set()
+        self.resume() # Wake the batch up if it is paused
+
+    def pause(self):
+        with self._pause_lock:
+            if self._paused_at is None:
+                self._paused_at = time.monotonic()
+        self._resume_event.clear()
+
+    def resume(self):
+        with self._pause_lock:
+            if self._paused_at is not None:
+                self._paused_seconds += time.monotonic() - self._paused_at
+                self._paused_at = None
+        self._resume_event.set()
+
+    def is_paused(self):
+        return not self._resume_event.is_set()
+
+    def _busy_seconds(self, started):
+        """Seconds since started, minus the time spent paused."""
+        now = time.monotonic()
+        with self._pause_lock:
+            paused = self._paused_seconds + (now - self._paused_at if self._paused_at is not None else 0.0)
+        return now - started - paused
+
+    def _pending_files(self):
+        """Yields the files to process until the batch is cancelled (process_images waits out pauses)."""
+        for file_path in self.files:
+            if self._cancel_event.is_set():
+                return
+            yield file_path
+
+    def run(self):
+        processed_count = 0
+        errors = []
+        total = len(self.files)
+        done = 0
+        started = time.monotonic()
+
+        def on_result(result):
+            nonlocal processed_count, done
+            done += 1
+            file_path = result['original']
+            if result['success']:
+                logger.info("Successfully created: %s", result['modified'])
+                processed_count += 1
+            else:
+                logger.warning("Failed to process: %s", file_path)
+                error = result.get('error')
+                errors.append(f"{os.path.basename(file_path)}: {error}" if error else os.path.basename(file_path))
+            # Throughput is based on time spent processing, excluding pauses
+            busy_seconds = self._busy_seconds(started)
+            files_per_second = done / busy_seconds if busy_seconds > 0 else 0.0
+            eta_seconds = (total - done) / files_per_second if files_per_second > 0 else -1.0
+            self.progress.emit(done, total, file_path, result['success'], files_per_second, eta_seconds)
+
+        manifest = None
+        if self.manifest_path:
+            manifest = ProcessingManifest(self.manifest_path, options=manifest_options(DEFAULT_LAYOUT))
+        try:
+            # Forking a process that runs Qt threads is unsafe, so pool workers start as fresh interpreters
+            process_images(self._pending_files(), display_after=False, workers=self.workers, manifest=manifest,
+                           on_result=on_result, layout=DEFAULT_LAYOUT, resume_event=self._resume_event,
+                           mp_context=multiprocessing.get_context('spawn'))
+        except Exception as batch_exc:
+            logger.error("Error processing batch: %s", batch_exc)
+            errors.append(str(batch_exc))
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+        self.batch_finished.emit(processed_count, errors, self._cancel_event.is_set())
+
 class MetadataRandomizerGUI(QWidget):
     def __init__(self):
         super().__init__()
@@ -73,6 +253,11 @@ class MetadataRandomizerGUI(QWidget):
         self.setGeometry(100, 100, 850, 550) # x, y, width, height
         self.selected_files = []
         self.currently_selected_path_for_metadata = None # Store path for post-randomization update
+        self.worker = None # Background RandomizationWorker while a batch is running
+        self.selected_original_path = None # Selection at the time the current batch started
+        self.metadata_cache = MetadataPreviewCache()
+        self.prefetch_pool = QThreadPool(self)
+        self.prefetch_pool.setMaxThreadCount(1) # Prefetching is I/O bound, one thread is plenty
 
         self.init_ui()
 
@@ -138,6 +323,20 @@ class MetadataRandomizerGUI(QWidget):
         """)
         left_v_layout.addWidget(self.randomize_button, alignment=Qt.AlignCenter)
 
+        # --- Progress Area (only visible while a batch is running) ---
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("%v / %m files")
+        progress_layout.addWidget(self.progress_bar, 1)
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.clicked.connect(self.toggle_pause)
+        progress_layout.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_randomization)
+        progress_layout.addWidget(self.cancel_button)
+        left_v_layout.addLayout(progress_layout)
+        self.set_progress_controls_visible(False)
+
         # Add left panel to splitter
         splitter.addWidget(left_panel_widget)
 
@@ -175,9 +374,10 @@ class MetadataRandomizerGUI(QWidget):
         if current_item:
             path = current_item.text()
             self.currently_selected_path_for_metadata = path # Store for later use
-            if os.path.isfile(path) and path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')):
-                metadata_str = get_metadata_string(path)
+            if os.path.isfile(path) and path.lower().endswith(PREVIEW_EXTENSIONS):
+                metadata_str = self.metadata_cache.get(path)
                 self.metadata_display.setText(metadata_str)
+                self.prefetch_neighbours(self.file_list_widget.row(current_item))
             elif os.path.isdir(path):
                 self.metadata_display.setText(f"Folder selected:\n{os.path.basename(path)}\n\n(Metadata preview is shown for individual image files)")
             else:
@@ -185,13 +385,26 @@ class MetadataRandomizerGUI(QWidget):
         else:
             self.metadata_display.clear()
 
+    def prefetch_neighbours(self, row):
+        """Warms the metadata cache for the items around row so arrow-key navigation stays instant."""
+        paths = []
+        for offset in range(1, PREFETCH_RADIUS + 1):
+            for neighbour in (row + offset, row - offset):
+                item = self.file_list_widget.item(neighbour)
+                if item is not None and item.text().lower().endswith(PREVIEW_EXTENSIONS):
+                    paths.append(item.text())
+        if paths:
+            # Drop stale prefetches queued for an earlier selection
+            self.prefetch_pool.clear()
+            self.prefetch_pool.start(MetadataPrefetchTask(self.metadata_cache, paths))
+
     @Slot()
     def select_files(self):
         files, _ = QFileDialog.getOpenFileNames(
             self,
             "Select Image Files",
             "", # Start directory
-            "Images (*.png *.jpg *.jpeg *.bmp *.gif *.tiff)" # Filter
+            "Images (*.jpg *.jpeg *.png *.tif *.tiff *.webp *.heic *.heif)" # Filter
         )
         if files:
             self.update_file_list(files)
@@ -234,8 +447,8 @@ class MetadataRandomizerGUI(QWidget):
     def get_all_image_files(self):
         """Gets all image file paths from the list widget, expanding folders."""
         all_files = []
-        # More specific image check for processing
-        image_extensions = {'.jpg', '.jpeg'} # Limit processing to JPEG for now based on core logic
+        # More specific image check for processing: only formats the randomizer can write
+        image_extensions = set(SUPPORTED_EXTENSIONS)
         items_to_process = []
         for i in range(self.file_list_widget.count()):
             items_to_process.append(self.file_list_widget.item(i).text())
@@ -254,20 +467,26 @@ class MetadataRandomizerGUI(QWidget):
                 if skip: continue
 
                 processed_folders.add(normalized_path)
-                # Recursively find images in the folder
-                for root, _, files in os.walk(normalized_path):
-                    for file in files:
-                        if os.path.splitext(file)[1].lower() in image_extensions:
-                            all_files.append(os.path.join(root, file))
+                # Recursively find images in the folder, leaving out outputs of earlier runs
+                all_files.extend(scan_images(normalized_path, extensions=image_extensions,
+                                             exclude=DEFAULT_LAYOUT.scan_excludes(normalized_path)))
             elif os.path.isfile(normalized_path) and os.path.splitext(normalized_path)[1].lower() in image_extensions:
                 all_files.append(normalized_path)
 
         return list(set(all_files)) # Return unique file paths
 
+    def set_progress_controls_visible(self, visible):
+        self.progress_bar.setVisible(visible)
+        self.pause_button.setVisible(visible)
+        self.cancel_button.setVisible(visible)
+
     @Slot()
     def start_randomization(self):
+        if self.worker is not None:
+            return # A batch is already running
+
         # Store the currently selected path *before* processing
-        selected_original_path = self.currently_selected_path_for_metadata
+        self.selected_original_path = self.currently_selected_path_for_metadata
 
         files_to_process = self.get_all_image_files()
 
@@ -278,31 +497,71 @@ class MetadataRandomizerGUI(QWidget):
         self.status_label.setText(f"Processing {len(files_to_process)} files...")
         self.randomize_button.setEnabled(False)
         self.file_list_widget.setEnabled(False) # Disable list during processing
-        QApplication.processEvents()
+        self.progress_bar.setRange(0, len(files_to_process))
+        self.progress_bar.setValue(0)
+        self.pause_button.setText("Pause")
+        self.pause_button.setEnabled(True)
+        self.cancel_button.setEnabled(True)
+        self.set_progress_controls_visible(True)
+
+        logger.debug("Files to process: %s", files_to_process)
+        # A single folder keeps a manifest, like a --folder run, so unchanged files are skipped next time
+        items = [self.file_list_widget.item(i).text() for i in range(self.file_list_widget.count())]
+        manifest_path = None
+        if len(items) == 1 and os.path.isdir(items[0]):
+            manifest_path = os.path.join(items[0], MANIFEST_FILENAME)
+
+        # The batch runs on a worker thread so the window stays responsive
+        self.worker = RandomizationWorker(files_to_process, manifest_path=manifest_path, parent=self)
+        self.worker.progress.connect(self.on_randomization_progress)
+        self.worker.batch_finished.connect(self.on_randomization_finished)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.start()
 
-        processed_count = 0
-        errors = []
+    @Slot()
+    def toggle_pause(self):
+        if self.worker is None:
+            return
+        if self.worker.is_paused():
+            self.worker.resume()
+            self.pause_button.setText("Pause")
+        else:
+            self.worker.pause()
+            self.pause_button.setText("Resume")
+            self.status_label.setText(f"Paused after {self.progress_bar.value()} of {self.progress_bar.maximum()} files")
+
+    @Slot()
+    def cancel_randomization(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        self.pause_button.setEnabled(False)
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling after the files in progress...")
+
+    @Slot(int, int, str, bool, float, float)
+    def on_randomization_progress(self, done, total, file_path, success, files_per_second, eta_seconds):
+        self.progress_bar.setValue(done)
+        if self.worker is not None and (self.worker.is_paused() or not self.cancel_button.isEnabled()):
+            return # Keep the paused/cancelling message visible
+        eta_text = "--:--"
+        if eta_seconds >= 0:
+            minutes, seconds = divmod(int(eta_seconds + 0.5), 60)
+            eta_text = f"{minutes}:{seconds:02d}"
+        self.status_label.setText(f"{done}/{total} files - {files_per_second:.1f} files/s - ETA {eta_text}")
+
+    @Slot(int, list, bool)
+    def on_randomization_finished(self, processed_count, errors, cancelled):
+        total = self.progress_bar.maximum()
+        self.worker = None
+        selected_original_path = self.selected_original_path
+        self.selected_original_path = None
 
         try:
-            print("Files to process:", files_to_process)
-            for file_path in files_to_process:
-                 print(f"Processing: {file_path}")
-                 try:
-                    # Corrected call based on user feedback:
-                    output_path = randomize_metadata(image_path=file_path, randomize_all=True, randomize_windows_props=True)
-                    if output_path:
-                        print(f"Successfully created: {output_path}")
-                        processed_count += 1
-                    else:
-                        print(f"Failed to process (returned None): {file_path}")
-                        errors.append(os.path.basename(file_path))
-                 except Exception as item_exc:
-                     print(f"Error processing file {file_path}: {item_exc}")
-                     errors.append(f"{os.path.basename(file_path)}: {item_exc}")
-
-
-            if processed_count > 0:
-                 QMessageBox.information(self, "Success", f"Successfully processed {processed_count} out of {len(files_to_process)} files.")
+            if cancelled:
+                QMessageBox.information(self, "Cancelled", f"Cancelled after processing {processed_count} out of {total} files.")
+            elif processed_count > 0:
+                 QMessageBox.information(self, "Success", f"Successfully processed {processed_count} out of {total} files.")
             if errors:
                  error_details = "\n".join(errors[:10]) # Show first 10 errors
                  if len(errors) > 10: error_details += "\n..."
@@ -311,9 +570,8 @@ class MetadataRandomizerGUI(QWidget):
             # --- Update metadata display for the originally selected item ---
             if selected_original_path and os.path.isfile(selected_original_path):
                 # Construct the expected modified path
-                directory = os.path.dirname(selected_original_path)
                 filename = os.path.basename(selected_original_path)
-                modified_path = os.path.join(directory, f"modified_{filename}")
+                modified_path = DEFAULT_LAYOUT.path_for(selected_original_path)
 
                 # Check if the modified file exists (meaning processing likely succeeded for it)
                 if os.path.exists(modified_path):
@@ -323,7 +581,7 @@ class MetadataRandomizerGUI(QWidget):
                     if items:
                         self.file_list_widget.setCurrentItem(items[0]) # Trigger signal again
                         # Explicitly set text to modified metadata
-                        modified_metadata_str = get_metadata_string(modified_path)
+                        modified_metadata_str = self.metadata_cache.get(modified_path)
                         self.metadata_display.setText(modified_metadata_str)
                 else:
                      # If modified file doesn't exist, but original was selected, show error/info
@@ -332,17 +590,28 @@ class MetadataRandomizerGUI(QWidget):
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"An unexpected error occurred during processing batch:\n{e}")
-            print(f"Error during processing batch: {e}") # Log to console as well
+            logger.error("Error during processing batch: %s", e) # Log to console as well
         finally:
             self.status_label.setText("Ready")
             self.randomize_button.setEnabled(True)
             self.file_list_widget.setEnabled(True) # Re-enable list
+            self.set_progress_controls_visible(False)
             # Optionally clear the list after processing? Decide based on UX preference
             # self.file_list_widget.clear()
             # self.metadata_display.clear()
 
+    def closeEvent(self, event):
+        # Don't leave a worker thread writing files after the window is gone
+        if self.worker is not None:
+            self.worker.batch_finished.disconnect(self.on_randomization_finished)
+            self.worker.cancel()
+            self.worker.wait()
+        self.prefetch_pool.clear()
+        self.prefetch_pool.waitForDone()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
+    configure_logging()
     app = QApplication(sys.argv)
     window = MetadataRandomizerGUI()
     window.show()
@@ -0,0 +1,263 @@
+"""
+Declarative rules for which metadata survives randomization.
+
+A policy says, per IFD ('0th', 'Exif', 'GPS'), what happens to each tag:
+
+    keep            copy the value from the original file, if it has one
+    drop            leave the tag out
+    randomize       write a random value (only for tags the randomizer generates)
+    {"fixed": v}    always write v
+    {"keep": v}     copy the value from the original file, or write v if it has none
+
+Tags are given by their piexif name ("Orientation") or number. Inside an IFD,
+"*" sets what happens to the tags that aren't listed (keep or drop); a
+top-level "default" does the same for every IFD. "icc": "keep" carries a
+JPEG's ICC profile segments over unchanged. For example, in YAML:
+
+    default: drop
+    icc: keep
+    0th:
+      Orientation: {keep: 1}
+      Make: randomize
+      Software: {fixed: "Photo Editor"}
+    GPS:
+      "*": drop
+
+Policy files are JSON, or YAML if PyYAML is installed. compile_policy() turns
+the rules into a CompiledPolicy once; per file only its lookup tables are used.
+"""
+
+import json
+import struct
+
+import piexif
+
+from image_formats import EXIF_IFD_TAG, GPS_IFD_TAG, TIFF_SUB_IFD_TAGS, tiff_byte_order, tiff_payload, read_tiff_ifd
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+KEEP = 'keep'
+DROP = 'drop'
+RANDOMIZE = 'randomize'
+FIXED = 'fixed'
+
+# The IFDs a policy can address, and where piexif looks up their tag names
+POLICY_IFDS = {'0th': 'Image', 'Exif': 'Exif', 'GPS': 'GPS'}
+SUB_IFD_POINTERS = {'Exif': EXIF_IFD_TAG, 'GPS': GPS_IFD_TAG}
+
+# Marks a keep rule without a fallback value
+NO_FALLBACK = None
+
+
+def _tag_number(ifd, name):
+    """Resolve a tag name (or number, possibly as a string) within an IFD."""
+    tags = piexif.TAGS[POLICY_IFDS[ifd]]
+    if isinstance(name, int) or (isinstance(name, str) and name.isdigit()):
+        tag = int(name)
+        if tag not in tags:
+            raise ValueError(f"Unknown tag {tag} in IFD '{ifd}'")
+        return tag
+    for tag, info in tags.items():
+        if info['name'] == name:
+            return tag
+    raise ValueError(f"Unknown tag '{name}' in IFD '{ifd}'")
+
+
+def _value(ifd, tag, value):
+    """Convert a JSON/YAML value into what piexif expects for the tag (lists become tuples, text becomes bytes)."""
+    if isinstance(value, list):
+        return tuple(_value(ifd, tag, item) for item in value)
+    if isinstance(value, str):
+        if piexif.TAGS[POLICY_IFDS[ifd]][tag]['type'] not in (piexif.TYPES.Ascii, piexif.TYPES.Undefined):
+            raise ValueError(f"Value for tag {tag} in IFD '{ifd}' must be a number")
+        return value.encode('utf-8')
+    return value
+
+
+class CompiledPolicy:
+    """
+    A metadata policy compiled into lookup tables.
+
+    actions maps (ifd, tag) to KEEP, DROP, RANDOMIZE or FIXED, and values holds
+    the value for FIXED tags and the fallback for KEEP tags (NO_FALLBACK if
+    there is none). defaults maps each IFD to what happens to unlisted tags.
+    rules is the policy dict it was compiled from, and key identifies it, so
+    caches can be shared by equal policies.
+    """
+
+    def __init__(self, rules, key):
+        self.actions = {}
+        self.values = {}
+        self.rules = rules
+        self.key = key
+
+        default = rules.get('default', DROP)
+        if default not in (KEEP, DROP):
+            raise ValueError(f"'default' must be '{KEEP}' or '{DROP}', not {default!r}")
+        self.defaults = dict.fromkeys(POLICY_IFDS, default)
+
+        icc = rules.get('icc', DROP)
+        if icc not in (KEEP, DROP):
+            raise ValueError(f"'icc' must be '{KEEP}' or '{DROP}', not {icc!r}")
+        self.keep_icc = icc == KEEP
+
+        for ifd, tag_rules in rules.items():
+            if ifd in ('default', 'icc'):
+                continue
+            if ifd not in POLICY_IFDS:
+                raise ValueError(f"Unknown IFD '{ifd}', expected one of: {', '.join(POLICY_IFDS)}")
+            for name, rule in (tag_rules or {}).items():
+                if name == '*':
+                    if rule not in (KEEP, DROP):
+                        raise ValueError(f"'*' in IFD '{ifd}' must be '{KEEP}' or '{DROP}', not {rule!r}")
+                    self.defaults[ifd] = rule
+                    continue
+                tag = _tag_number(ifd, name)
+                if isinstance(rule, dict) and len(rule) == 1 and next(iter(rule)) in (FIXED, KEEP):
+                    action, value = next(iter(rule.items()))
+                    self.actions[ifd, tag] = action
+                    self.values[ifd, tag] = _value(ifd, tag, value)
+                elif rule in (KEEP, DROP, RANDOMIZE):
+                    self.actions[ifd, tag] = rule
+                    if rule == KEEP:
+                        self.values[ifd, tag] = NO_FALLBACK
+                else:
+                    raise ValueError(f"Bad rule for '{name}' in IFD '{ifd}': {rule!r}")
+
+        # Precomputed lists, so applying the policy only walks what it has to
+        self.fixed = [(ifd, tag, self.values[ifd, tag]) for (ifd, tag), action in self.actions.items()
+                      if action == FIXED]
+        self.kept = [(ifd, tag, self.values[ifd, tag]) for (ifd, tag), action in self.actions.items()
+                     if action == KEEP]
+        self.dropped = {(ifd, tag) for (ifd, tag), action in self.actions.items() if action != KEEP}
+        self.randomized = {key for key, action in self.actions.items() if action == RANDOMIZE}
+        self.source_ifds = {ifd for ifd, _, _ in self.kept} | {ifd for ifd, rule in self.defaults.items()
+                                                                if rule == KEEP}
+
+    @property
+    def needs_source(self):
+        """True if the original file's metadata has to be read."""
+        return bool(self.source_ifds)
+
+    @property
+    def fixed_layout(self):
+        """True if every output has the same tags (so a precompiled template fits all of them)."""
+        return (all(rule == DROP for rule in self.defaults.values()) and
+                all(fallback is not NO_FALLBACK for _, _, fallback in self.kept))
+
+    def check_randomizable(self, targets):
+        """Raise ValueError if the policy randomizes a tag that isn't among targets ((ifd, tag) pairs)."""
+        for ifd, tag in sorted(self.randomized - set(targets)):
+            raise ValueError(f"Tag '{piexif.TAGS[POLICY_IFDS[ifd]][tag]['name']}' in IFD '{ifd}' "
+                             "has no random value generator")
+
+    def apply(self, exif_dict, source):
+        """
+        Add the kept and fixed tags to exif_dict (a piexif exif_dict).
+
+        source holds the original file's tags as returned by read_source_tags(), or None.
+        """
+        source = source or {}
+        for ifd, rule in self.defaults.items():
+            if rule == KEEP and source.get(ifd):
+                for tag, value in source[ifd].items():
+                    if (ifd, tag) not in self.dropped:
+                        exif_dict[ifd].setdefault(tag, value)
+        for ifd, tag, fallback in self.kept:
+            value = source.get(ifd, {}).get(tag, fallback)
+            if value is not NO_FALLBACK:
+                exif_dict[ifd][tag] = value
+        for ifd, tag, value in self.fixed:
+            exif_dict[ifd][tag] = value
+        return exif_dict
+
+
+def compile_policy(rules):
+    """Compile a policy dict (see the module docstring) into a CompiledPolicy."""
+    key = json.dumps(rules, sort_keys=True, default=repr)
+    return CompiledPolicy(rules, key)
+
+
+def load_policy(path):
+    """Read a JSON or YAML policy file and compile it."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise ValueError("YAML policies need PyYAML (pip install pyyaml); use a JSON file instead")
+        try:
+            rules = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(str(e))
+    else:
+        rules = json.loads(text)
+    if not isinstance(rules, dict):
+        raise ValueError(f"Policy file '{path}' must contain a mapping")
+    return compile_policy(rules)
+
+
+# struct formats for the TIFF types piexif reads, by type
+_TAG_FORMATS = {
+    piexif.TYPES.Byte: 'B',
+    piexif.TYPES.Short: 'H',
+    piexif.TYPES.Long: 'L',
+    piexif.TYPES.SLong: 'l',
+    piexif.TYPES.Rational: 'L',
+    piexif.TYPES.SRational: 'l',
+}
+
+
+def _tag_value(data, order, value_type, count, value_offset, size):
+    """Convert a raw tag value into the form piexif.load would return, or None for unsupported types."""
+    raw = bytes(data[value_offset:value_offset + size])
+    if value_type == piexif.TYPES.Ascii:
+        return raw[:-1] if raw.endswith(b'\x00') else raw
+    if value_type == piexif.TYPES.Undefined:
+        return raw
+    if value_type not in _TAG_FORMATS:
+        return None
+    code = _TAG_FORMATS[value_type]
+    items = struct.unpack(order + code * (size // struct.calcsize(order + code)), raw)
+    if value_type in (piexif.TYPES.Rational, piexif.TYPES.SRational):
+        items = tuple(zip(items[::2], items[1::2]))
+    return items[0] if count == 1 else tuple(items)
+
+
+def read_source_tags(exif_payload, ifds):
+    """
+    Return {ifd: {tag: value}} for the given IFDs of an EXIF block (as returned
+    by image_formats.find_exif_payload), with values in piexif's format.
+
+    Only the requested IFDs are parsed and only tags piexif knows are returned
+    (so the result can go through piexif.dump). Returns None for a missing or unreadable block.
+    """
+    if not exif_payload:
+        return None
+    try:
+        tiff = memoryview(tiff_payload(exif_payload))
+        order = tiff_byte_order(tiff)
+        (ifd0,) = struct.unpack_from(order + 'L', tiff, 4)
+        entries = {'0th': read_tiff_ifd(tiff, ifd0, order)[0]}
+        for ifd, pointer in SUB_IFD_POINTERS.items():
+            if ifd not in ifds:
+                continue
+            for tag, _, _, _, value_offset, size in entries['0th']:
+                if tag == pointer and size == 4:
+                    (sub_ifd,) = struct.unpack_from(order + 'L', tiff, value_offset)
+                    entries[ifd] = read_tiff_ifd(tiff, sub_ifd, order)[0]
+
+        tags = {}
+        for ifd in ifds:
+            known = piexif.TAGS[POLICY_IFDS[ifd]]
+            tags[ifd] = {}
+            for tag, value_type, count, _, value_offset, size in entries.get(ifd, ()):
+                if tag in known and tag not in TIFF_SUB_IFD_TAGS and value_offset + size <= len(tiff):
+                    value = _tag_value(tiff, order, value_type, count, value_offset, size)
+                    if value is not None:
+                        tags[ifd][tag] = value
+        return tags
+    except (ValueError, struct.error):
+        return None
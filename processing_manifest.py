@@ -0,0 +1,136 @@
+"""
+Persistent record of which images have already been randomized.
+
+The manifest is a small SQLite database (by default inside the processed folder)
+keyed by input path. Each row remembers the input's size and modification time,
+optionally a SHA-256 of its contents, the output that was produced and a digest
+of the run options that shaped it, so a re-run can skip unchanged inputs with a
+single indexed lookup. A re-run with different options (another policy, engine,
+seed or output layout) treats every input as changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Default manifest file name, created inside the folder being processed
+MANIFEST_FILENAME = '.metadata_randomizer_manifest.sqlite'
+
+# Number of recorded files between commits (each commit is a disk sync)
+COMMIT_INTERVAL = 100
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    """Returns the hex SHA-256 of a file's contents, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def options_digest(options):
+    """Returns the hex SHA-256 of a JSON-serializable dict of run options (None for None)."""
+    if options is None:
+        return None
+    encoded = json.dumps(options, sort_keys=True, default=repr).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class ProcessingManifest:
+    """
+    SQLite-backed manifest of processed inputs and the outputs they produced.
+
+    options (a JSON-serializable dict) describes how this run produces its
+    outputs; rows recorded under other options don't count as unchanged.
+    """
+
+    def __init__(self, db_path, use_hash=False, options=None):
+        self.db_path = db_path
+        self.use_hash = use_hash
+        self.options = options_digest(options)
+        self._uncommitted = 0
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT,
+                output TEXT NOT NULL,
+                processed_at REAL NOT NULL,
+                options TEXT
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(processed)")]
+        if 'options' not in columns:
+            # Manifests from before options were recorded: their rows count as made with other options
+            self.conn.execute("ALTER TABLE processed ADD COLUMN options TEXT")
+        self.conn.commit()
+
+    @staticmethod
+    def _key(image_path):
+        return os.path.abspath(image_path)
+
+    def lookup_unchanged(self, image_path, output_path=None):
+        """
+        Returns the recorded output path if image_path is unchanged since it was
+        processed and that output still exists, otherwise None. If output_path is
+        given, the recorded output must also be that file (outputs moved elsewhere
+        don't count).
+
+        Size and mtime are compared first. When hashing is enabled, a file whose
+        mtime changed but whose contents hash the same still counts as unchanged.
+        A row recorded under different run options never does.
+        """
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, sha256, output, options FROM processed WHERE path = ?", (self._key(image_path),)
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, sha256, output, options = row
+        if options != self.options:
+            return None
+
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        if output_path is not None and os.path.abspath(output_path) != output:
+            return None
+        if not os.path.exists(output) or stat.st_size != size:
+            return None
+        if stat.st_mtime_ns == mtime_ns:
+            return output
+        if self.use_hash and sha256 and file_sha256(image_path) == sha256:
+            return output
+        return None
+
+    def record(self, image_path, output_path):
+        """Records that image_path (in its current state) produced output_path."""
+        stat = os.stat(image_path)
+        sha256 = file_sha256(image_path) if self.use_hash else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO processed (path, size, mtime_ns, sha256, output, processed_at, options) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._key(image_path), stat.st_size, stat.st_mtime_ns, sha256, os.path.abspath(output_path), time.time(),
+             self.options)
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
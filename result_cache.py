@@ -0,0 +1,213 @@
+"""
+Content-addressed cache of randomized outputs.
+
+The same photo often sits in many folders. Its copies only differ in their
+metadata, so ResultCache keys outputs by a hash of what the randomizer carries
+over from the input: for JPEGs the tables, frame header and entropy-coded scan
+data (plus the ICC profile when it is kept), for other formats the whole file.
+The randomizer's options are hashed in as well. A duplicate is then served by
+linking the cached output into place instead of randomizing it again.
+
+Cached outputs live in <cache_dir>/objects. A small SQLite index next to them
+records each entry's size and when it was last used; once the total exceeds
+max_bytes the least recently used entries are evicted. Outputs are placed with a
+reflink where the filesystem supports it (an independent copy sharing the disk
+blocks), otherwise with a hardlink, otherwise with a plain copy.
+"""
+
+import hashlib
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+
+from jpeg_segments import iter_segments, is_metadata_marker, is_icc_segment
+from image_formats import detect_format
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows, which then falls back to hardlinks
+    fcntl = None
+
+# Default upper bound for the cached outputs, in bytes
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+INDEX_FILENAME = 'index.sqlite'
+
+# Linux ioctl that makes dst share src's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Seconds a worker waits for another one holding the index lock
+INDEX_TIMEOUT = 30
+
+
+def content_digest(data, keep_icc=False, options=b''):
+    """
+    Returns the hex BLAKE2b digest of the image content in data (a buffer) and options (bytes).
+
+    Metadata segments of JPEGs are left out (except ICC profile segments with
+    keep_icc), so copies that only differ in their metadata hash the same.
+    """
+    digest = hashlib.blake2b(options, digest_size=20)
+    digest.update(b'\x00')
+    if detect_format(data) == 'jpeg':
+        for marker, start, end in iter_segments(data):
+            if is_metadata_marker(marker) and not (keep_icc and is_icc_segment(data, marker, start)):
+                continue
+            digest.update(data[start:end])
+    else:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _reflink(src, dst):
+    """Creates dst as a reflink of src, raising OSError where that isn't supported."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'xb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+
+
+def link_file(src, dst, reflink=True):
+    """Creates dst with the contents of src as cheaply as possible and returns how ('reflink', 'hardlink' or 'copy')."""
+    if reflink:
+        try:
+            _reflink(src, dst)
+            return 'reflink'
+        except OSError:
+            pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(src, dst)
+        return 'copy'
+
+
+def _temp_path(path):
+    """A hidden temp file name next to path, as atomic_output uses."""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.{secrets.token_hex(6)}.tmp")
+
+
+class ResultCache:
+    """
+    On-disk cache of randomized outputs keyed by content_digest().
+
+    Safe to share between pool workers and threads: each of them opens its own
+    connection to the index, and objects are written under temp names and renamed into place.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Connections can't be pickled; workers open their own
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.cache_dir, INDEX_FILENAME), timeout=INDEX_TIMEOUT,
+                                   isolation_level=None)
+            self._local.conn = conn
+            # Losing the last few index updates on a crash only costs cache hits
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        return conn
+
+    def object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def fetch(self, key, output_path):
+        """
+        Places the cached output for key at output_path (replacing it atomically) and returns
+        how it was linked, or None on a miss.
+        """
+        row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        temp_path = _temp_path(output_path)
+        try:
+            method = link_file(self.object_path(key), temp_path)
+            os.replace(temp_path, output_path)
+        except OSError:
+            # The object went missing (evicted by another process, deleted by hand)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return method
+
+    def store(self, key, output_path):
+        """Adds output_path (a finished output) to the cache under key, then evicts down to max_bytes."""
+        object_path = self.object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = _temp_path(object_path)
+        # A hardlink costs no space as long as the output exists; reflinks don't add anything here
+        link_file(output_path, temp_path, reflink=False)
+        os.replace(temp_path, object_path)
+        size = os.path.getsize(object_path)
+        self.conn.execute("INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+                          (key, size, time.time()))
+        self.evict()
+
+    def total_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Removes the least recently used entries until the cache holds at most max_bytes."""
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if excess <= 0:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self.object_path(key))
+            except OSError:
+                pass
+            excess -= size
+
+    def close(self):
+        """Closes this thread's connection to the index."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
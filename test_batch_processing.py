@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Tests for batch processing in Image Metadata Randomizer.
+
+These check that process_images returns the same per-file results, in input
+order, whether it runs sequentially or across a process pool, that the
+folder scanner finds the right files, that the manifest skips unchanged
+inputs on re-runs, that seeded runs are reproducible, that per-stage
+stats are collected, that per-file results reach the reporting hooks,
+that the asyncio API yields every file with bounded concurrency, and
+that outputs can go to a mirrored tree, use name templates or replace the inputs.
+"""
+
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import sqlite3
+from image_metadata_randomizer import process_images, scan_images, arandomize_many, OutputLayout, manifest_options
+from metadata_policy import compile_policy
+from processing_manifest import ProcessingManifest, MANIFEST_FILENAME
+from instrumentation import BatchStats
+from batch_reporting import ProgressLine, AsyncJsonlWriter
+
+def create_test_folder(count=6):
+    """Create a folder with a few small JPEGs and return their paths."""
+    temp_dir = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        path = os.path.join(temp_dir, f"image_{i}.jpg")
+        Image.new('RGB', (32, 32), color=(i * 40 % 256, 0, 0)).save(path, "jpeg")
+        paths.append(path)
+    return temp_dir, paths
+
+def test_process_images_parallel_keeps_input_order():
+    temp_dir, paths = create_test_folder()
+    # Mix in a missing file and a non-JPEG, which are skipped like in sequential mode
+    inputs = list(reversed(paths)) + [os.path.join(temp_dir, "missing.jpg"), os.path.join(temp_dir, "notes.txt")]
+    open(inputs[-1], 'w').close()
+
+    results = process_images(inputs, display_after=False, randomize_windows_props=False, workers=3)
+
+    assert [r['original'] for r in results] == list(reversed(paths))
+    assert all(r['success'] for r in results)
+    for r in results:
+        assert r['modified'] == os.path.join(temp_dir, f"modified_{os.path.basename(r['original'])}")
+        assert os.path.exists(r['modified'])
+
+def test_process_images_sequential_matches_parallel():
+    _, paths = create_test_folder(3)
+    sequential = process_images(paths, display_after=False, randomize_windows_props=False)
+    parallel = process_images(paths, display_after=False, randomize_windows_props=False, workers=2)
+    assert sequential == parallel
+
+def create_test_tree():
+    """Create a nested folder tree with mixed-case extensions and return its root."""
+    root = tempfile.mkdtemp()
+    layout = ["a.jpg", "B.JPG", "c.jpeg", "d.gif", "sub/e.Jpeg", "sub/skip/f.jpg", "sub/deeper/g.jpg", "raw/h.jpg"]
+    for relative in layout:
+        path = os.path.join(root, *relative.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+    return root
+
+def relative_set(root, paths):
+    return {os.path.relpath(p, root).replace(os.sep, '/') for p in paths}
+
+def test_scan_images_recursive_and_case_insensitive():
+    root = create_test_tree()
+    found = relative_set(root, scan_images(root))
+    assert found == {"a.jpg", "B.JPG", "c.jpeg", "sub/e.Jpeg", "sub/skip/f.jpg", "sub/deeper/g.jpg", "raw/h.jpg"}
+
+def test_scan_images_depth_and_patterns():
+    root = create_test_tree()
+    assert relative_set(root, scan_images(root, max_depth=0)) == {"a.jpg", "B.JPG", "c.jpeg"}
+    assert relative_set(root, scan_images(root, exclude=["skip", "raw/*"])) == {
+        "a.jpg", "B.JPG", "c.jpeg", "sub/e.Jpeg", "sub/deeper/g.jpg"}
+    assert relative_set(root, scan_images(root, include=["sub/*"])) == {
+        "sub/e.Jpeg", "sub/skip/f.jpg", "sub/deeper/g.jpg"}
+
+def test_scan_images_is_lazy():
+    root = create_test_tree()
+    scanner = scan_images(root)
+    assert next(scanner)
+
+def test_manifest_skips_unchanged_inputs():
+    temp_dir, paths = create_test_folder(3)
+    manifest_path = os.path.join(temp_dir, MANIFEST_FILENAME)
+
+    with ProcessingManifest(manifest_path) as manifest:
+        first = process_images(paths, display_after=False, randomize_windows_props=False, manifest=manifest)
+    assert [r['skipped'] for r in first] == [False, False, False]
+
+    # Touch one input so its mtime changes
+    stat = os.stat(paths[1])
+    os.utime(paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    with ProcessingManifest(manifest_path) as manifest:
+        second = process_images(paths, display_after=False, randomize_windows_props=False, manifest=manifest, workers=2)
+    assert [r['skipped'] for r in second] == [True, False, True]
+    assert all(r['success'] for r in second)
+    assert second[0]['modified'] == os.path.abspath(first[0]['modified'])
+
+def test_manifest_hash_ignores_touched_files():
+    temp_dir, paths = create_test_folder(1)
+    manifest_path = os.path.join(temp_dir, MANIFEST_FILENAME)
+    with ProcessingManifest(manifest_path, use_hash=True) as manifest:
+        process_images(paths, display_after=False, randomize_windows_props=False, manifest=manifest)
+
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with ProcessingManifest(manifest_path, use_hash=True) as manifest:
+        assert manifest.lookup_unchanged(paths[0])
+        # A missing output means the input has to be processed again
+        os.remove(manifest.lookup_unchanged(paths[0]))
+        assert manifest.lookup_unchanged(paths[0]) is None
+
+def test_manifest_reprocesses_inputs_after_option_changes():
+    temp_dir, paths = create_test_folder(2)
+    manifest_path = os.path.join(temp_dir, MANIFEST_FILENAME)
+    def run(**options):
+        with ProcessingManifest(manifest_path, options=manifest_options(**options)) as manifest:
+            results = process_images(paths, display_after=False, randomize_windows_props=False, manifest=manifest,
+                                     engine=options.get('engine', 'splice'), policy=options.get('policy'))
+        return [r['skipped'] for r in results]
+
+    assert run() == [False, False]
+    assert run() == [True, True]
+    assert run(policy=compile_policy({'Exif': {'ImageUniqueID': 'randomize'}})) == [False, False]
+    assert run(engine='re-encode') == [False, False]
+    assert run(engine='re-encode') == [True, True]
+
+    # Rows of a manifest written before options were recorded count as changed
+    with sqlite3.connect(manifest_path) as conn:
+        conn.execute("ALTER TABLE processed DROP COLUMN options")
+    assert run(engine='re-encode') == [False, False]
+    assert run(engine='re-encode') == [True, True]
+
+def read_outputs(results):
+    outputs = {}
+    for r in results:
+        with open(r['modified'], 'rb') as f:
+            outputs[os.path.basename(r['original'])] = f.read()
+    return outputs
+
+def test_seeded_runs_are_byte_identical():
+    temp_dir, paths = create_test_folder(4)
+    first = read_outputs(process_images(paths, display_after=False, randomize_windows_props=False,
+                                        seed=42, seed_root=temp_dir))
+    second = read_outputs(process_images(list(reversed(paths)), display_after=False, randomize_windows_props=False,
+                                         seed=42, seed_root=temp_dir, workers=3))
+    assert first == second
+    # Every file gets its own random values
+    assert len(set(first.values())) == len(paths)
+
+    other_seed = read_outputs(process_images(paths, display_after=False, randomize_windows_props=False,
+                                             seed=43, seed_root=temp_dir))
+    assert all(other_seed[name] != first[name] for name in first)
+
+def test_process_images_collects_stage_stats():
+    temp_dir, paths = create_test_folder(3)
+    jsonl_path = os.path.join(temp_dir, "stats.jsonl")
+    stats = BatchStats(jsonl_path=jsonl_path)
+    results = process_images(paths, display_after=False, randomize_windows_props=False, workers=2, stats=stats)
+    stats.close()
+
+    assert all('stats' not in r for r in results)
+    assert stats.files == 3
+    assert stats.errors == 0
+    assert stats.bytes_read == sum(os.path.getsize(p) for p in paths)
+    assert stats.bytes_written == sum(os.path.getsize(r['modified']) for r in results)
+    assert {'build_exif', 'exif_dump', 'read', 'splice', 'write'} <= set(stats.durations)
+    with open(jsonl_path) as f:
+        assert len(f.readlines()) == 4
+
+    prometheus_path = os.path.join(temp_dir, "randomizer.prom")
+    stats.write_prometheus(prometheus_path)
+    with open(prometheus_path) as f:
+        assert "image_randomizer_files_total 3" in f.read()
+
+def test_on_result_feeds_progress_and_results_jsonl():
+    temp_dir, paths = create_test_folder(4)
+    open(os.path.join(temp_dir, "broken.jpg"), 'w').close()
+    inputs = paths + [os.path.join(temp_dir, "broken.jpg")]
+    jsonl_path = os.path.join(temp_dir, "results.jsonl")
+    stream = io.StringIO()
+    progress = ProgressLine(stream=stream, interval=3600)
+    writer = AsyncJsonlWriter(jsonl_path)
+
+    def on_result(result):
+        progress.update(result)
+        writer.write(result)
+
+    results = process_images(inputs, display_after=False, randomize_windows_props=False, workers=2,
+                             on_result=on_result)
+    progress.finish()
+    writer.close()
+
+    assert progress.done == len(results) == 5
+    assert progress.failed == 1
+    assert stream.getvalue().splitlines()[-1].startswith("5 files (0 skipped, 1 failed)")
+    with open(jsonl_path) as f:
+        written = [json.loads(line) for line in f]
+    assert sorted(r['original'] for r in written) == sorted(r['original'] for r in results)
+
+def test_arandomize_many_yields_every_file_with_bounded_concurrency():
+    temp_dir, paths = create_test_folder(6)
+    in_flight = []
+    active = set()
+
+    class TrackingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            active.add(args[0])
+            in_flight.append(len(active))
+            def run():
+                try:
+                    return fn(*args)
+                finally:
+                    active.discard(args[0])
+            return super().submit(run)
+
+    async def source():
+        for path in paths + [os.path.join(temp_dir, "missing.jpg")]:
+            yield path
+
+    async def run():
+        with TrackingExecutor(max_workers=2) as executor:
+            return [result async for result in arandomize_many(source(), concurrency=2, executor=executor,
+                                                                randomize_windows_props=False)]
+
+    results = asyncio.run(run())
+    assert sorted(r['original'] for r in results) == sorted(paths)
+    assert all(r['success'] and os.path.exists(r['modified']) for r in results)
+    assert max(in_flight) <= 2
+
+def test_arandomize_many_stops_when_closed_early():
+    _, paths = create_test_folder(8)
+
+    async def run():
+        results = arandomize_many(paths, concurrency=2, randomize_windows_props=False)
+        first = await results.__anext__()
+        await results.aclose()
+        return first
+
+    first = asyncio.run(run())
+    assert first['success']
+    # Only the files that were already in flight got written
+    written = [p for p in paths if os.path.exists(os.path.join(os.path.dirname(p), f"modified_{os.path.basename(p)}"))]
+    assert len(written) <= 3
+
+def test_output_dir_mirrors_tree_and_is_not_rescanned():
+    root = tempfile.mkdtemp()
+    sources = [os.path.join(root, "a.jpg"), os.path.join(root, "sub", "b.jpg")]
+    for path in sources:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (16, 16)).save(path, "jpeg")
+    output_dir = os.path.join(root, "out")
+    layout = OutputLayout(output_dir=output_dir, input_root=root, name_template="{stem}_anon{ext}")
+    manifest = ProcessingManifest(os.path.join(root, MANIFEST_FILENAME))
+
+    results = process_images(sources, display_after=False, randomize_windows_props=False, manifest=manifest,
+                             layout=layout)
+    assert [r['modified'] for r in results] == [os.path.join(output_dir, "a_anon.jpg"),
+                                                os.path.join(output_dir, "sub", "b_anon.jpg")]
+    assert all(os.path.exists(r['modified']) for r in results)
+    # Nothing but the manifest (and its journal) is added to the source tree
+    assert sorted(name for name in os.listdir(root) if not name.startswith(MANIFEST_FILENAME)) == ["a.jpg", "out", "sub"]
+    assert os.listdir(os.path.join(root, "sub")) == ["b.jpg"]
+    assert sorted(scan_images(root, exclude=layout.scan_excludes(root))) == sorted(sources)
+
+    # A different layout doesn't reuse the outputs recorded for the old one
+    other = OutputLayout(name_template="anon_{name}")
+    results = process_images(sources, display_after=False, randomize_windows_props=False, manifest=manifest,
+                             layout=other)
+    manifest.close()
+    assert not any(r['skipped'] for r in results)
+    assert other.scan_excludes(root) == ["anon_*"]
+
+def test_in_place_replaces_inputs():
+    temp_dir, paths = create_test_folder(2)
+    with open(paths[0], 'rb') as f:
+        original = f.read()
+    results = process_images(paths, display_after=False, randomize_windows_props=False,
+                             layout=OutputLayout(in_place=True))
+    assert [r['modified'] for r in results] == paths
+    with open(paths[0], 'rb') as f:
+        assert f.read() != original
+    assert sorted(os.listdir(temp_dir)) == ["image_0.jpg", "image_1.jpg"]
+
+    # Without in-place mode an output may never overwrite its input
+    results = process_images(paths, display_after=False, randomize_windows_props=False,
+                             layout=OutputLayout(name_template="{name}"))
+    assert not any(r['success'] for r in results)
+
+def test_in_place_keeps_file_permissions():
+    temp_dir, paths = create_test_folder(2)
+    os.chmod(paths[0], 0o600)
+    os.chmod(paths[1], 0o640)
+    for engine in ('splice', 're-encode'):
+        process_images(paths, display_after=False, randomize_windows_props=False, engine=engine,
+                       layout=OutputLayout(in_place=True))
+        assert [os.stat(path).st_mode & 0o777 for path in paths] == [0o600, 0o640]
+
+def test_output_dir_rejects_colliding_outputs():
+    root = tempfile.mkdtemp()
+    sources = [os.path.join(root, folder, "IMG_0001.jpg") for folder in ("a", "b")]
+    for i, path in enumerate(sources):
+        os.makedirs(os.path.dirname(path))
+        Image.new('RGB', (16, 16), (i * 100, 0, 0)).save(path, "jpeg")
+    output_dir = os.path.join(root, "out")
+    # Neither input is under input_root, so both would land at out/IMG_0001.jpg
+    layout = OutputLayout(output_dir=output_dir, input_root=os.path.join(root, "a"))
+    manifest = ProcessingManifest(os.path.join(root, MANIFEST_FILENAME))
+    for workers in (1, 2):
+        results = process_images(sources, display_after=False, randomize_windows_props=False, workers=workers,
+                                 layout=layout)
+        assert [r['success'] for r in results] == [True, False]
+        assert "a" + os.sep + "IMG_0001.jpg" in results[1]['error']
+
+    async def run():
+        return [r async for r in arandomize_many(sources, randomize_windows_props=False, layout=layout)]
+    assert sorted(r['success'] for r in asyncio.run(run())) == [False, True]
+
+    # The rejected input is not recorded as done
+    process_images(sources, display_after=False, randomize_windows_props=False, layout=layout, manifest=manifest)
+    assert manifest.lookup_unchanged(sources[1], layout.path_for(sources[1])) is None
+    manifest.close()
+
+def test_scan_excludes_only_cover_outputs_in_the_tree():
+    root = tempfile.mkdtemp()
+    for name in ("photo.jpg", "modified_photo.jpg"):
+        Image.new('RGB', (16, 16)).save(os.path.join(root, name), "jpeg")
+    def scan(layout):
+        return sorted(os.path.basename(path) for path in scan_images(root, exclude=layout.scan_excludes(root)))
+    assert scan(OutputLayout()) == ["photo.jpg"]
+    # No modified_ outputs are written next to the inputs, so files named like them are inputs
+    assert scan(OutputLayout(in_place=True)) == ["modified_photo.jpg", "photo.jpg"]
+    assert scan(OutputLayout(output_dir=tempfile.mkdtemp(), input_root=root)) == ["modified_photo.jpg", "photo.jpg"]
+
+def test_paused_batch_still_collects_files_in_flight():
+    temp_dir, paths = create_test_folder(12)
+    resume_event = threading.Event()
+    resume_event.set()
+    results = []
+    def on_result(result):
+        results.append(result)
+        # Pause as soon as the first file is done
+        if len(results) == 1:
+            resume_event.clear()
+
+    batch = threading.Thread(target=process_images, args=(paths,), daemon=True,
+                             kwargs=dict(display_after=False, randomize_windows_props=False, workers=2,
+                                         on_result=on_result, resume_event=resume_event))
+    batch.start()
+    time.sleep(1.5)
+    # The files that were in flight are reported, nothing new is started
+    paused_count = len(results)
+    assert 1 < paused_count < len(paths)
+    assert sum(os.path.exists(os.path.join(temp_dir, f"modified_{os.path.basename(p)}")) for p in paths) == paused_count
+    resume_event.set()
+    batch.join()
+    assert len(results) == len(paths)
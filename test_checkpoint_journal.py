@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for resuming interrupted batches.
+
+These kill a batch halfway (an exception from on_result), then check that a
+resumed run skips exactly the checkpointed files, that a line cut short by the
+crash is ignored, and that the startup sweep only removes stale temp outputs.
+"""
+
+import os
+import tempfile
+import time
+import pytest
+from PIL import Image
+from checkpoint_journal import CheckpointJournal
+from image_metadata_randomizer import process_images, sweep_temp_outputs, sweep_output_folders, scan_images, OutputLayout
+
+class Crash(Exception):
+    pass
+
+def make_images(folder, count):
+    paths = []
+    for i in range(count):
+        paths.append(os.path.join(folder, f"{i}.jpg"))
+        Image.new('RGB', (16, 16), (i, 0, 0)).save(paths[-1], "jpeg")
+    return paths
+
+def test_interrupted_batch_resumes_from_last_checkpoint():
+    folder = tempfile.mkdtemp()
+    paths = make_images(folder, 7)
+    journal_path = os.path.join(folder, "journal.jsonl")
+
+    finished = []
+    def crash_after_five(result):
+        finished.append(result)
+        if len(finished) == 5:
+            raise Crash()
+
+    journal = CheckpointJournal(journal_path, checkpoint_interval=2)
+    with pytest.raises(Crash):
+        process_images(paths, display_after=False, randomize_windows_props=False, journal=journal,
+                       on_result=crash_after_five)
+    # The process dies without closing the journal: only whole checkpoints (4 files) are on disk,
+    # and the last line was being written when it died
+    with open(journal_path, 'a') as f:
+        f.write('{"original": "/half')
+
+    with CheckpointJournal(journal_path, resume=True) as journal:
+        assert len(journal.done) == 4
+        results = process_images(paths, display_after=False, randomize_windows_props=False, journal=journal)
+    assert [r['original'] for r in results if r.get('resumed')] == paths[:4]
+    assert all(r['success'] for r in results)
+
+    # The journal is intact again and lists every file
+    with CheckpointJournal(journal_path, resume=True) as journal:
+        assert set(journal.done) == set(paths)
+    # A fresh (not resumed) run starts over
+    with CheckpointJournal(journal_path) as journal:
+        assert not journal.done
+
+def test_sweep_removes_only_stale_temp_outputs():
+    folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(folder, "sub"))
+    stale = os.path.join(folder, "sub", ".modified_a.jpg.0123456789ab.tmp")
+    fresh = os.path.join(folder, ".modified_b.jpg.ba9876543210.tmp")
+    unrelated = [os.path.join(folder, name) for name in (".notes.tmp", "a.jpg.0123456789ab.tmp", "modified_a.jpg")]
+    for path in [stale, fresh] + unrelated:
+        with open(path, 'wb') as f:
+            f.write(b"x")
+    old = time.time() - 3600
+    for path in [stale] + unrelated:
+        os.utime(path, (old, old))
+
+    assert sweep_temp_outputs(folder, recursive=False) == 0
+    assert sweep_temp_outputs(folder) == 1
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+    assert all(os.path.exists(path) for path in unrelated)
+
+def test_output_folders_are_swept_as_the_scan_reaches_them():
+    folder = tempfile.mkdtemp()
+    temp_outputs = {}
+    for sub in ("a", "b", "skip"):
+        os.makedirs(os.path.join(folder, sub))
+        make_images(os.path.join(folder, sub), 1)
+        temp_outputs[sub] = os.path.join(folder, sub, ".modified_0.jpg.0123456789ab.tmp")
+        with open(temp_outputs[sub], 'wb') as f:
+            f.write(b"x")
+        old = time.time() - 3600
+        os.utime(temp_outputs[sub], (old, old))
+
+    paths = sweep_output_folders(scan_images(folder, exclude=["skip"]), OutputLayout())
+    # Nothing is touched before the scan gets going
+    assert all(os.path.exists(path) for path in temp_outputs.values())
+    first = next(paths)
+    assert not os.path.exists(temp_outputs[os.path.basename(os.path.dirname(first))])
+    list(paths)
+    assert [sub for sub, path in sorted(temp_outputs.items()) if os.path.exists(path)] == ["skip"]
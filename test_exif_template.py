@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Tests for the precompiled EXIF template and bulk random values.
+
+These check that patching random values into the template gives the same
+EXIF data as building an exif_dict and running piexif.dump, that values
+which don't fit their slot are rejected instead of corrupting the block, and
+that bulk-drawn values are reproducible and unique across pool workers.
+"""
+
+import datetime
+import os
+import random
+import tempfile
+import piexif
+import pytest
+from PIL import Image
+from image_metadata_randomizer import (draw_random_values, draw_random_batch, exif_dict_from_values, exif_template,
+                                       convert_to_dms, process_images)
+
+def load_without_pointers(exif_bytes):
+    """piexif.load, minus the sub-IFD offsets (which differ between the two layouts)."""
+    exif_dict = piexif.load(exif_bytes)
+    exif_dict['0th'].pop(piexif.ImageIFD.ExifTag, None)
+    exif_dict['0th'].pop(piexif.ImageIFD.GPSTag, None)
+    return exif_dict
+
+@pytest.mark.parametrize("randomize_all", [True, False])
+def test_template_matches_piexif_dump(randomize_all):
+    template = exif_template(randomize_all)
+    for seed in range(50):
+        values, _ = draw_random_values(randomize_all, rng=random.Random(seed))
+        rendered = template.render(values)
+        dumped = piexif.dump(exif_dict_from_values(values, randomize_all))
+        assert load_without_pointers(rendered) == load_without_pointers(dumped)
+        # Every file gets a block of the same size
+        assert len(rendered) == len(template.data)
+
+def test_template_rejects_values_that_do_not_fit():
+    values, _ = draw_random_values(True, rng=random.Random(1))
+    template = exif_template(True)
+    with pytest.raises(ValueError):
+        template.render({**values, 'make': b"M" * 100})
+    with pytest.raises(ValueError):
+        template.render({**values, 'latitude': ((1, 1), (2, 1))})
+    # Short strings that fit inline in their IFD entry can't replace out-of-line ones
+    with pytest.raises(ValueError):
+        template.render({**values, 'model': b"M"})
+
+def test_random_batch_is_reproducible_and_templatable():
+    reference_date = datetime.datetime(2025, 1, 1, 12)
+    rows = draw_random_batch(100, seed=7, reference_date=reference_date)
+    assert rows == draw_random_batch(100, seed=7, reference_date=reference_date)
+    assert rows != draw_random_batch(100, seed=8, reference_date=reference_date)
+    single, _ = draw_random_values(True, rng=random.Random(0), reference_date=reference_date)
+    for row in rows:
+        assert set(row) == set(single)
+        assert row['date'].startswith(b"202") and row['date'].endswith(b"12:00:00")
+        exif_template(True).render(row)
+
+def test_vectorized_dms_matches_scalar():
+    np = pytest.importorskip("numpy")
+    from image_metadata_randomizer import convert_to_dms_array
+    coordinates = np.random.default_rng(0).uniform(-180, 180, 2000)
+    degrees, minutes, seconds = convert_to_dms_array(coordinates)
+    for coordinate, d, m, s in zip(coordinates.tolist(), degrees.tolist(), minutes.tolist(), seconds.tolist()):
+        assert convert_to_dms(coordinate) == ((d, 1), (m, 1), (s, 100))
+
+def test_unseeded_pool_workers_draw_different_values():
+    temp_dir = tempfile.mkdtemp()
+    paths = []
+    for i in range(8):
+        paths.append(os.path.join(temp_dir, f"image_{i}.jpg"))
+        Image.new('RGB', (16, 16)).save(paths[-1], "jpeg")
+    results = process_images(paths, display_after=False, randomize_windows_props=False, workers=4)
+    unique_ids = {piexif.load(r['modified'])['Exif'][piexif.ExifIFD.ImageUniqueID] for r in results}
+    assert len(unique_ids) == len(paths)
+
+def test_unseeded_runs_take_values_from_the_bulk_pool(monkeypatch):
+    pytest.importorskip("numpy")
+    import image_metadata_randomizer
+    calls = []
+    next_random_values = image_metadata_randomizer._next_random_values
+    def counting(randomize_all):
+        calls.append(randomize_all)
+        return next_random_values(randomize_all)
+    monkeypatch.setattr(image_metadata_randomizer, '_next_random_values', counting)
+
+    path = os.path.join(tempfile.mkdtemp(), "image.jpg")
+    Image.new('RGB', (16, 16)).save(path, "jpeg")
+    for engine in ('splice', 're-encode'):
+        output_path = image_metadata_randomizer.randomize_metadata(path, randomize_windows_props=False, engine=engine)
+        assert piexif.load(output_path)['Exif'][piexif.ExifIFD.ImageUniqueID]
+    with open(path, 'rb') as f:
+        assert image_metadata_randomizer.randomize_bytes(f.read())
+    assert len(calls) == 3
+    # Seeded runs draw from their own RNG
+    image_metadata_randomizer.randomize_metadata(path, randomize_windows_props=False, rng=random.Random(1))
+    assert len(calls) == 3
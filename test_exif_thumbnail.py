@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for EXIF thumbnails and ICC profiles on both engines.
+
+These check that the thumbnail lands in the 1st IFD where piexif and PIL find
+it, that it is made from a reduced-DCT decode, that blocks which can't take one
+are left alone, and that the re-encode engine carries the ICC profile over.
+"""
+
+import io
+import os
+import tempfile
+import piexif
+import pytest
+from PIL import Image
+from exif_thumbnail import make_thumbnail, attach_thumbnail, THUMBNAIL_SIZE
+from image_metadata_randomizer import randomize_bytes, process_images
+from test_metadata_policy import make_jpeg, ICC_PROFILE
+
+def make_photo(size=(1280, 960)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 60).convert('RGB').save(buffer, "jpeg", icc_profile=ICC_PROFILE)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("engine", ["splice", "re-encode"])
+def test_thumbnail_is_stored_in_the_1st_ifd(engine):
+    output = randomize_bytes(make_photo(), engine=engine, thumbnail=True)
+    exif_dict = piexif.load(output)
+    assert exif_dict['1st'][piexif.ImageIFD.Compression] == 6
+    assert exif_dict['0th'][piexif.ImageIFD.Make]
+    with Image.open(io.BytesIO(exif_dict['thumbnail'])) as thumbnail:
+        assert thumbnail.size == THUMBNAIL_SIZE
+    with Image.open(io.BytesIO(output)) as image:
+        assert image.info['icc_profile'] == ICC_PROFILE
+        assert image.size == (1280, 960)
+
+def test_thumbnail_uses_a_reduced_decode():
+    with Image.open(io.BytesIO(make_photo())) as image:
+        make_thumbnail(image)
+        # Decoded at 1/8 scale, the smallest that still covers 160x120
+        assert image.size == (160, 120)
+
+def test_attach_thumbnail_rejects_blocks_it_cannot_extend():
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.Make: b"Cam"}})
+    with pytest.raises(ValueError):
+        attach_thumbnail(exif_bytes, b"\xff\xd8" + b"\0" * 70000)
+    with pytest.raises(ValueError):
+        attach_thumbnail(attach_thumbnail(exif_bytes, b"\xff\xd8\xff\xd9"), b"\xff\xd8\xff\xd9")
+
+def test_re_encode_keeps_icc_profile_and_no_thumbnail_by_default():
+    output = randomize_bytes(make_jpeg(), engine='re-encode')
+    assert piexif.load(output)['thumbnail'] is None
+    with Image.open(io.BytesIO(output)) as image:
+        assert image.info['icc_profile'] == ICC_PROFILE
+
+def test_batch_thumbnails_skip_other_formats():
+    folder = tempfile.mkdtemp()
+    paths = [os.path.join(folder, "a.jpg"), os.path.join(folder, "b.png")]
+    Image.effect_noise((400, 300), 60).convert('RGB').save(paths[0], "jpeg")
+    Image.effect_noise((400, 300), 60).convert('RGB').save(paths[1], "png")
+    results = process_images(paths, display_after=False, randomize_windows_props=False, workers=2, thumbnail=True)
+    assert all(result['success'] for result in results)
+    assert piexif.load(results[0]['modified'])['thumbnail']
+    with Image.open(results[1]['modified']) as image:
+        assert image.format == 'PNG'
@@ -13,7 +13,7 @@ import sys
 import tempfile
 from PIL import Image
 import piexif
-from image_metadata_randomizer import randomize_metadata, display_metadata
+from image_metadata_randomizer import randomize_metadata
 
 def create_test_image_with_gps():
     """Create a test image with known GPS data."""
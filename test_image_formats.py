@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the PNG, TIFF, WebP and HEIF metadata writers.
+
+Each format is randomized with the splice engine and checked for: the old
+metadata being gone, the new EXIF block being readable (by PIL where it can
+read the format) and the image data being untouched.
+"""
+
+import os
+import struct
+import tempfile
+import piexif
+import pytest
+from PIL import Image, PngImagePlugin
+from image_formats import detect_format, find_exif_payload, read_exif_payload, splice_metadata_parts
+from image_metadata_randomizer import randomize_metadata, randomize_bytes, read_metadata, scan_images
+
+SECRET = b"SecretCam"
+
+def source_exif():
+    return piexif.dump({"0th": {piexif.ImageIFD.Make: SECRET, piexif.ImageIFD.Artist: b"Jane Doe"},
+                        "Exif": {piexif.ExifIFD.LensModel: b"SecretLens"}, "GPS": {}, "1st": {}, "thumbnail": None})
+
+def make_image():
+    return Image.effect_noise((48, 32), 60).convert('RGB')
+
+def randomize(path):
+    output_path = randomize_metadata(path, randomize_windows_props=False)
+    assert output_path is not None
+    with open(output_path, 'rb') as f:
+        data = f.read()
+    assert SECRET not in data and b"Jane Doe" not in data
+    new_make = read_metadata(output_path)['0th'][piexif.ImageIFD.Make]
+    assert new_make != SECRET
+    return output_path, data, new_make
+
+def assert_same_pixels(path_a, path_b):
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        assert a.tobytes() == b.tobytes()
+
+def test_png_chunks_are_replaced():
+    path = os.path.join(tempfile.mkdtemp(), "image.png")
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Author", "Jane Doe")
+    info.add_itxt("Comment", "SecretCam was here")
+    make_image().save(path, "png", pnginfo=info, exif=source_exif())
+
+    output_path, data, new_make = randomize(path)
+    assert b"tEXt" not in data and b"iTXt" not in data and data.count(b"eXIf") == 1
+    assert data.index(b"eXIf") < data.index(b"IDAT")
+    assert_same_pixels(path, output_path)
+    with Image.open(output_path) as image:
+        assert image.getexif()[piexif.ImageIFD.Make] == new_make.decode()
+
+@pytest.mark.parametrize("options", [{"lossless": True}, {"quality": 80}, {"quality": 80, "exif": source_exif()}])
+def test_webp_chunks_are_replaced(options):
+    path = os.path.join(tempfile.mkdtemp(), "image.webp")
+    image = make_image()
+    if "exif" not in options:
+        # Simple files without metadata need a VP8X header added
+        image = image.convert('RGBA')
+    image.save(path, "webp", **options)
+
+    output_path, data, new_make = randomize(path)
+    assert data[12:16] == b"VP8X" and data[20] & 0x08
+    assert struct.unpack_from('<L', data, 4)[0] == len(data) - 8
+    assert_same_pixels(path, output_path)
+    with Image.open(output_path) as image:
+        assert image.getexif()[piexif.ImageIFD.Make] == new_make.decode()
+
+def test_tiff_ifd_is_replaced():
+    path = os.path.join(tempfile.mkdtemp(), "image.tiff")
+    exif = Image.Exif()
+    exif[piexif.ImageIFD.Make] = SECRET.decode()
+    exif[piexif.ImageIFD.Artist] = "Jane Doe"
+    exif[piexif.ImageIFD.Orientation] = 6
+    make_image().save(path, "tiff", compression="tiff_lzw", exif=exif)
+
+    output_path, data, new_make = randomize(path)
+    assert_same_pixels(path, output_path)
+    with Image.open(output_path) as image:
+        tags = image.getexif()
+        assert tags[piexif.ImageIFD.Make] == new_make.decode()
+        # The file's own orientation is kept
+        assert tags[piexif.ImageIFD.Orientation] == 6
+        assert tags.get_ifd(piexif.ImageIFD.ExifTag)[piexif.ExifIFD.ImageUniqueID]
+
+def box(box_type, payload, version=None):
+    if version is not None:
+        payload = bytes((version, 0, 0, 0)) + payload
+    return struct.pack('>L4s', 8 + len(payload), box_type) + payload
+
+def make_heif(exif_payload, image_data, xmp):
+    """Builds a minimal HEIF file: one image item, one Exif item and one XMP item, all in a single mdat."""
+    infe = lambda item_id, item_type, extra=b'': box(b'infe', struct.pack('>HH4s', item_id, 0, item_type) + b'\0' + extra, 2)
+    iinf = box(b'iinf', struct.pack('>H', 3) + infe(1, b'hvc1') + infe(2, b'Exif') +
+               infe(3, b'mime', b'application/rdf+xml\0'), 0)
+    hdlr = box(b'hdlr', b'\0' * 4 + b'pict' + b'\0' * 13, 0)
+    items = [(1, image_data), (2, exif_payload), (3, xmp)]
+
+    def meta(offsets):
+        iloc = box(b'iloc', bytes((0x44, 0x00)) + struct.pack('>H', len(items)) + b''.join(
+            struct.pack('>HHHLL', item_id, 0, 1, offset, len(data)) for (item_id, data), offset in zip(items, offsets)), 0)
+        return box(b'meta', hdlr + iinf + iloc, 0)
+
+    head = box(b'ftyp', b'heic\0\0\0\0mif1heic') + meta([0, 0, 0])
+    offsets = []
+    position = len(head) + 8
+    for _, data in items:
+        offsets.append(position)
+        position += len(data)
+    return box(b'ftyp', b'heic\0\0\0\0mif1heic') + meta(offsets) + box(b'mdat', b''.join(data for _, data in items))
+
+@pytest.mark.parametrize("padding", [4096, 0])
+def test_heif_exif_item_is_replaced(padding):
+    # With padding the new block fits over the old one, without it it has to move
+    image_data = bytes(range(256)) * 4
+    xmp = b'<x:xmpmeta>SecretCam</x:xmpmeta>'
+    exif_payload = struct.pack('>L', 6) + source_exif() + b'\0' * padding
+    path = os.path.join(tempfile.mkdtemp(), "image.heic")
+    with open(path, 'wb') as f:
+        f.write(make_heif(exif_payload, image_data, xmp))
+    assert detect_format(make_heif(exif_payload, image_data, xmp)) == 'heif'
+
+    output_path, data, new_make = randomize(path)
+    assert image_data in data
+    assert data.index(image_data) == make_heif(exif_payload, image_data, xmp).index(image_data)
+    assert b"xmpmeta" not in data
+    if padding:
+        assert len(data) == os.path.getsize(path)
+    assert piexif.load(read_exif_payload(output_path))['Exif'][piexif.ExifIFD.ImageUniqueID]
+
+def test_heif_without_exif_item_is_rejected():
+    data = make_heif(b'', b'\1' * 16, b'')
+    data = data.replace(b'Exif', b'hvc1')
+    assert randomize_bytes(data) is None
+    with pytest.raises(ValueError):
+        splice_metadata_parts(data, source_exif())
+
+def test_mixed_folder_is_scanned_and_only_jpegs_are_re_encoded():
+    folder = tempfile.mkdtemp()
+    for name, image_format in [("a.jpg", "jpeg"), ("b.PNG", "png"), ("c.tif", "tiff"), ("d.webp", "webp"),
+                               ("e.gif", "gif")]:
+        make_image().save(os.path.join(folder, name), image_format)
+    assert {os.path.basename(p) for p in scan_images(folder)} == {"a.jpg", "b.PNG", "c.tif", "d.webp"}
+
+    # The re-encode engine would turn the PNG into a JPEG; it is spliced instead
+    with open(os.path.join(folder, "b.PNG"), 'rb') as f:
+        output = randomize_bytes(f.read(), engine='re-encode')
+    assert detect_format(output) == 'png'
+    assert piexif.load(find_exif_payload(output))['0th'][piexif.ImageIFD.Make]
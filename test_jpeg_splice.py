@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Tests for the lossless EXIF splice engine.
+
+These check that:
+1. Metadata segments (Exif, XMP, IPTC, comments) are removed from the stream
+2. The new EXIF block is readable and the scan data is copied byte for byte
+3. randomize_metadata produces pixel-identical output with the default engine
+4. The header-only reader finds the same EXIF block as PIL
+5. The in-memory API works on any buffer without touching the filesystem
+6. Files are spliced from a memory mapping without copying the image data
+"""
+
+import io
+import os
+import tempfile
+import tracemalloc
+import pytest
+from PIL import Image
+import piexif
+from image_metadata_randomizer import (randomize_metadata, read_metadata, get_metadata_string, randomize_bytes,
+                                       randomize_stream)
+from jpeg_segments import (iter_segments, splice_exif, read_exif_payload, find_exif_payload, frame_size, SOS, APP1,
+                           APP13, COM, SOF_MARKERS)
+
+def create_test_jpeg(size=(64, 48), progressive=False):
+    """Create a JPEG with EXIF, XMP, IPTC and a comment and return its bytes."""
+    img = Image.new('RGB', size)
+    img.putdata([(x * 4 % 256, y * 5 % 256, (x + y) % 256) for y in range(size[1]) for x in range(size[0])])
+
+    exif_dict = {"0th": {piexif.ImageIFD.Make: b"SecretCamera"}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    path = os.path.join(tempfile.mkdtemp(), "source.jpg")
+    img.save(path, "jpeg", exif=piexif.dump(exif_dict), quality=90, progressive=progressive,
+             comment=b"secret comment")
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # Add XMP (APP1) and IPTC (APP13) segments after SOI
+    xmp = b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta>secret</x:xmpmeta>"
+    iptc = b"Photoshop 3.0\x008BIMsecret"
+    extra = b""
+    for marker, payload in ((0xE1, xmp), (0xED, iptc)):
+        extra += bytes((0xFF, marker, (len(payload) + 2) >> 8, (len(payload) + 2) & 0xFF)) + payload
+    data = data[:2] + extra + data[2:]
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path, data
+
+def scan_bytes(data):
+    """Return the bytes from the first SOS marker to EOI."""
+    for marker, start, _ in iter_segments(data):
+        if marker == SOS:
+            return data[start:]
+    return b""
+
+def test_splice_replaces_metadata_segments():
+    path, data = create_test_jpeg()
+    new_exif = piexif.dump({"0th": {piexif.ImageIFD.Make: b"Camera1"}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None})
+
+    spliced = splice_exif(data, new_exif)
+
+    markers = [marker for marker, _, _ in iter_segments(spliced)]
+    assert markers.count(APP1) == 1
+    assert APP13 not in markers
+    assert COM not in markers
+    assert b"secret" not in spliced.split(b"\xff\xda", 1)[0]
+    assert scan_bytes(spliced) == scan_bytes(data)
+    assert piexif.load(spliced)["0th"][piexif.ImageIFD.Make] == b"Camera1"
+
+def test_splice_progressive_jpeg():
+    _, data = create_test_jpeg(progressive=True)
+    spliced = splice_exif(data, piexif.dump({"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}))
+    assert scan_bytes(spliced) == scan_bytes(data)
+    assert sum(1 for marker, _, _ in iter_segments(spliced) if marker == SOS) > 1
+
+def test_randomize_metadata_splice_is_lossless():
+    path, _ = create_test_jpeg()
+    output_path = randomize_metadata(path, randomize_windows_props=False)
+    assert output_path is not None
+
+    with Image.open(path) as original, Image.open(output_path) as modified:
+        assert list(original.getdata()) == list(modified.getdata())
+        exif = piexif.load(modified.info['exif'])
+    assert exif["0th"][piexif.ImageIFD.Make] != b"SecretCamera"
+    assert exif["GPS"]
+
+def test_randomize_metadata_reencode_engine():
+    path, _ = create_test_jpeg()
+    output_path = randomize_metadata(path, randomize_windows_props=False, engine='re-encode')
+    assert output_path is not None
+    with Image.open(output_path) as modified:
+        assert modified.size == (64, 48)
+        assert 'exif' in modified.info
+
+def test_reencode_strips_comments_and_segments():
+    path, _ = create_test_jpeg()
+    output_path = randomize_metadata(path, randomize_windows_props=False, engine='re-encode')
+    with open(output_path, 'rb') as f:
+        data = f.read()
+    markers = [marker for marker, _, _ in iter_segments(data)]
+    assert COM not in markers
+    assert APP13 not in markers
+    assert b"secret" not in data
+
+def test_reencode_pixel_limit_falls_back_to_splice():
+    path, data = create_test_jpeg()
+    output_path = randomize_metadata(path, randomize_windows_props=False, engine='re-encode', max_pixels=100)
+    with open(output_path, 'rb') as f:
+        assert scan_bytes(f.read()) == scan_bytes(data)
+
+def test_pixel_limit_reads_the_header_of_decompression_bombs():
+    path, data = create_test_jpeg()
+    assert frame_size(data) == (64, 48)
+    # Claim 20000x20000 pixels in the frame header; PIL refuses to even open that
+    [(start, end)] = [(start, end) for marker, start, end in iter_segments(data, header_only=True)
+                      if marker in SOF_MARKERS]
+    bomb = bytearray(data)
+    bomb[start + 5:start + 9] = (20000).to_bytes(2, 'big') * 2
+    with open(path, 'wb') as f:
+        f.write(bomb)
+    assert frame_size(bomb) == (20000, 20000)
+
+    output_path = randomize_metadata(path, randomize_windows_props=False, engine='re-encode')
+    with open(output_path, 'rb') as f:
+        assert scan_bytes(f.read()) == scan_bytes(bomb)
+    assert scan_bytes(randomize_bytes(bytes(bomb), engine='re-encode')) == scan_bytes(bomb)
+
+def test_output_written_atomically():
+    path, _ = create_test_jpeg()
+    directory = os.path.dirname(path)
+    output_path = randomize_metadata(path, randomize_windows_props=False, fsync=True)
+    assert sorted(os.listdir(directory)) == ["modified_source.jpg", "source.jpg"]
+
+    # A failing splice must not leave a partial output or temp file behind
+    with open(path, 'r+b') as f:
+        f.seek(2)
+        f.write(b"\x00\x00")
+    os.remove(output_path)
+    assert randomize_metadata(path, randomize_windows_props=False) is None
+    assert os.listdir(directory) == ["source.jpg"]
+
+def test_header_reader_matches_pil():
+    path, _ = create_test_jpeg()
+    # The XMP APP1 segment comes first; the reader has to skip it
+    payload = read_exif_payload(path)
+    assert payload.startswith(b"Exif\x00\x00")
+    with Image.open(path) as image:
+        assert piexif.load(payload) == piexif.load(image.info['exif'])
+    assert read_metadata(path)["0th"][piexif.ImageIFD.Make] == b"SecretCamera"
+
+def test_header_reader_without_exif():
+    path = os.path.join(tempfile.mkdtemp(), "plain.jpg")
+    Image.new('RGB', (8, 8)).save(path, "jpeg")
+    assert read_exif_payload(path) is None
+    assert read_metadata(path) is None
+    assert get_metadata_string(path) == "No EXIF data found in plain.jpg"
+
+def test_randomize_bytes_accepts_any_buffer():
+    path, data = create_test_jpeg()
+    os.remove(path)
+    directory = os.path.dirname(path)
+    for buffer in (data, bytearray(data), memoryview(data)):
+        output = randomize_bytes(buffer)
+        assert scan_bytes(output) == scan_bytes(data)
+        assert b"secret" not in output
+        with Image.open(io.BytesIO(output)) as modified:
+            assert piexif.load(modified.info['exif'])["0th"][piexif.ImageIFD.Make] != b"SecretCamera"
+    reencoded = randomize_bytes(memoryview(data), engine='re-encode')
+    assert b"secret" not in reencoded
+    assert randomize_bytes(b"not a jpeg") is None
+    assert os.listdir(directory) == []
+
+def test_randomize_stream_reads_from_current_position():
+    _, data = create_test_jpeg()
+    source = io.BytesIO(b"header" + data)
+    source.seek(6)
+    destination = io.BytesIO()
+    assert randomize_stream(source, destination) == len(destination.getvalue())
+    assert scan_bytes(destination.getvalue()) == scan_bytes(data)
+    # The source buffer is released again, so it can still be written to
+    source.write(b"more")
+
+    destination = io.BytesIO()
+    assert randomize_stream(io.BufferedReader(io.BytesIO(b"junk")), destination) is None
+    assert destination.getvalue() == b""
+
+@pytest.mark.parametrize("wrap", [io.BytesIO, lambda data: io.BufferedReader(io.BytesIO(data))])
+def test_randomize_stream_consumes_source(wrap):
+    _, data = create_test_jpeg()
+    source = wrap(b"header" + data)
+    source.seek(6)
+    assert randomize_stream(source, io.BytesIO())
+    # Buffer or read(), the source is left at its end
+    assert source.tell() == 6 + len(data) and source.read() == b""
+
+def test_header_scan_never_reads_scan_data():
+    _, data = create_test_jpeg()
+    # Truncate inside the scan and add fill bytes in front of the first marker
+    sos = data.index(b"\xff\xda")
+    damaged = data[:2] + b"\xff" + data[2:sos + 20]
+    markers = [marker for marker, _, _ in iter_segments(damaged, header_only=True)]
+    assert markers[-1] == SOS
+    payload = find_exif_payload(memoryview(damaged))
+    assert piexif.load(payload)["0th"][piexif.ImageIFD.Make] == b"SecretCamera"
+
+def test_splice_from_mapped_file_avoids_copies():
+    path = os.path.join(tempfile.mkdtemp(), "large.jpg")
+    Image.effect_noise((1024, 1024), 80).convert('RGB').save(path, "jpeg", quality=95)
+    size = os.path.getsize(path)
+
+    tracemalloc.start()
+    output_path = randomize_metadata(path, randomize_windows_props=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < size / 4
+    with open(path, 'rb') as f, open(output_path, 'rb') as g:
+        assert scan_bytes(g.read()) == scan_bytes(f.read())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the GUI's metadata preview cache.
+
+These check that the cache evicts the least recently used entries once it
+holds too many of them or too much text, and that an entry is read again
+after its file is rewritten. The cache needs no running Qt application.
+"""
+
+import os
+import tempfile
+import pytest
+
+pytest.importorskip("PySide6")
+import metadata_gui
+from metadata_gui import MetadataPreviewCache
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Replaces the metadata reader with one that records every path it reads."""
+    paths = []
+    def fake_metadata_string(path):
+        paths.append(path)
+        with open(path) as f:
+            return f.read()
+    monkeypatch.setattr(metadata_gui, 'get_metadata_string', fake_metadata_string)
+    return paths
+
+def make_files(contents):
+    folder = tempfile.mkdtemp()
+    paths = []
+    for i, text in enumerate(contents):
+        paths.append(os.path.join(folder, f"{i}.jpg"))
+        with open(paths[-1], 'w') as f:
+            f.write(text)
+    return paths
+
+def test_evicts_least_recently_used_by_count(reads):
+    a, b, c = make_files(["a", "b", "c"])
+    cache = MetadataPreviewCache(max_entries=2)
+    cache.get(a)
+    cache.get(b)
+    # Using a makes b the least recently used entry
+    assert cache.get(a) == "a"
+    cache.get(c)
+    assert reads == [a, b, c]
+    cache.get(a)
+    cache.get(c)
+    assert reads == [a, b, c]
+    cache.get(b)
+    assert reads == [a, b, c, b]
+
+def test_evicts_by_total_bytes(reads):
+    a, b, big = make_files(["x" * 40, "y" * 40, "z" * 200])
+    cache = MetadataPreviewCache(max_bytes=100)
+    cache.get(a)
+    cache.get(b)
+    assert cache._total_bytes == 80
+    # A third 40 byte entry doesn't fit next to both
+    cache.get(b)
+    cache.get(make_files(["w" * 40])[0])
+    assert a not in cache._entries and b in cache._entries
+    assert cache._total_bytes <= 100
+    # Text larger than the whole cache is returned but not kept
+    assert cache.get(big) == "z" * 200
+    assert big not in cache._entries
+    cache.get(big)
+    assert reads.count(big) == 2
+
+def test_rewritten_file_is_read_again(reads):
+    [path] = make_files(["old"])
+    cache = MetadataPreviewCache()
+    assert cache.get(path) == "old"
+    assert cache.get(path) == "old"
+    assert reads == [path]
+
+    with open(path, 'w') as f:
+        f.write("newer")
+    assert cache.get(path) == "newer"
+    # Same size, but a different mtime
+    with open(path, 'w') as f:
+        f.write("NEWER")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert cache.get(path) == "NEWER"
+    assert reads == [path] * 3
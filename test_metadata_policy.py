@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for metadata policies.
+
+These check the default policy (orientation, resolution and ICC profile
+survive, identifying tags don't), custom JSON/YAML policies with every kind of
+rule, that bad policies are rejected up front, and that the fast tag reader
+agrees with piexif.
+"""
+
+import io
+import json
+import os
+import random
+import tempfile
+import piexif
+import pytest
+from PIL import Image
+from metadata_policy import compile_policy, load_policy, read_source_tags
+from image_metadata_randomizer import (randomize_bytes, randomize_metadata, process_images, check_policy,
+                                       exif_template, draw_random_values, exif_dict_from_values, default_policy)
+from test_exif_template import load_without_pointers
+
+ICC_PROFILE = b"\x00\x00\x01\x00fake ICC profile" * 8
+
+def make_jpeg(orientation=6, icc_profile=ICC_PROFILE):
+    exif = piexif.dump({"0th": {piexif.ImageIFD.Make: b"SecretCam", piexif.ImageIFD.Orientation: orientation,
+                                piexif.ImageIFD.XResolution: (300, 1), piexif.ImageIFD.Artist: b"Jane Doe"},
+                        "Exif": {piexif.ExifIFD.LensModel: b"SecretLens"},
+                        "GPS": {piexif.GPSIFD.GPSLatitudeRef: b"N"}, "1st": {}, "thumbnail": None})
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 16), 'red').save(buffer, "jpeg", exif=exif, icc_profile=icc_profile)
+    return buffer.getvalue()
+
+def test_default_policy_keeps_orientation_resolution_and_icc():
+    output = randomize_bytes(make_jpeg())
+    exif_dict = piexif.load(output)
+    assert exif_dict['0th'][piexif.ImageIFD.Orientation] == 6
+    assert exif_dict['0th'][piexif.ImageIFD.XResolution] == (300, 1)
+    assert exif_dict['0th'][piexif.ImageIFD.Make] != b"SecretCam"
+    assert piexif.ImageIFD.Artist in exif_dict['0th'] and b"Jane Doe" not in output
+    assert b"SecretLens" not in output
+    with Image.open(io.BytesIO(output)) as image:
+        assert image.info['icc_profile'] == ICC_PROFILE
+
+    # Files without those tags get the fallbacks
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, "jpeg")
+    exif_dict = piexif.load(randomize_bytes(buffer.getvalue()))
+    assert exif_dict['0th'][piexif.ImageIFD.Orientation] == 1
+    assert exif_dict['0th'][piexif.ImageIFD.XResolution] == (72, 1)
+
+def test_custom_policy_rules():
+    policy = compile_policy({
+        'default': 'drop',
+        '0th': {'Make': 'keep', 'Model': 'randomize', 'Software': {'fixed': 'Photo Editor'},
+                'XResolution': {'fixed': [96, 1]}, 'Copyright': {'keep': 'Nobody'}},
+        'Exif': {'*': 'keep', 'LensModel': 'drop'},
+    })
+    check_policy(policy)
+    output = randomize_bytes(make_jpeg(), policy=policy)
+    exif_dict = piexif.load(output)
+    assert exif_dict['0th'][piexif.ImageIFD.Make] == b"SecretCam"
+    assert exif_dict['0th'][piexif.ImageIFD.Software] == b"Photo Editor"
+    assert exif_dict['0th'][piexif.ImageIFD.XResolution] == (96, 1)
+    assert exif_dict['0th'][piexif.ImageIFD.Copyright] == b"Nobody"
+    assert exif_dict['0th'][piexif.ImageIFD.Model].startswith(b"Model")
+    assert piexif.ImageIFD.Orientation not in exif_dict['0th'] and not exif_dict['GPS']
+    assert b"SecretLens" not in output
+    # ICC profiles are dropped unless the policy keeps them
+    with Image.open(io.BytesIO(output)) as image:
+        assert 'icc_profile' not in image.info
+
+@pytest.mark.parametrize("rules", [
+    {'0th': {'NoSuchTag': 'keep'}},
+    {'Thumbnail': {'Make': 'keep'}},
+    {'0th': {'Make': 'scramble'}},
+    {'0th': {'*': 'randomize'}},
+    {'0th': {'Orientation': {'fixed': 'sideways'}}},
+    {'default': 'fixed'},
+])
+def test_bad_policies_are_rejected(rules):
+    with pytest.raises(ValueError):
+        compile_policy(rules)
+
+def test_randomizing_an_unknown_field_is_rejected():
+    policy = compile_policy({'Exif': {'LensModel': 'randomize'}})
+    with pytest.raises(ValueError, match="LensModel"):
+        check_policy(policy)
+
+@pytest.mark.parametrize("extension", [".json", ".yaml"])
+def test_policy_files(extension):
+    if extension == ".yaml":
+        pytest.importorskip("yaml")
+    folder = tempfile.mkdtemp()
+    policy_path = os.path.join(folder, "policy" + extension)
+    with open(policy_path, 'w') as f:
+        if extension == ".json":
+            json.dump({'icc': 'keep', '0th': {'Orientation': 'keep', 'Make': 'randomize'}}, f)
+        else:
+            f.write("icc: keep\n0th:\n  Orientation: keep\n  Make: randomize\n")
+    image_path = os.path.join(folder, "image.jpg")
+    with open(image_path, 'wb') as f:
+        f.write(make_jpeg())
+
+    [result] = process_images([image_path], display_after=False, randomize_windows_props=False, workers=2,
+                              policy=load_policy(policy_path))
+    exif_dict = piexif.load(result['modified'])
+    assert set(exif_dict['0th']) == {piexif.ImageIFD.Orientation, piexif.ImageIFD.Make}
+    assert exif_dict['0th'][piexif.ImageIFD.Orientation] == 6
+
+def test_template_matches_dump_with_kept_tags():
+    policy = default_policy(True)
+    source = read_source_tags(piexif.dump(piexif.load(make_jpeg())), policy.source_ifds)
+    values, _ = draw_random_values(True, rng=random.Random(3))
+    template = exif_template(True, policy)
+    slot_values = dict(values)
+    slot_values.update({(ifd, tag): source[ifd].get(tag, fallback) for ifd, tag, fallback in policy.kept})
+    assert (load_without_pointers(template.render(slot_values)) ==
+            load_without_pointers(piexif.dump(exif_dict_from_values(values, True, policy, source))))
+
+def test_source_tags_match_piexif():
+    payload = piexif.dump(piexif.load(make_jpeg()))
+    expected = piexif.load(payload)
+    tags = read_source_tags(payload, ['0th', 'Exif', 'GPS'])
+    for ifd in tags:
+        assert tags[ifd] == {tag: value for tag, value in expected[ifd].items()
+                             if tag not in (piexif.ImageIFD.ExifTag, piexif.ImageIFD.GPSTag)}
+    assert read_source_tags(b"Exif\0\0garbage", ['0th']) is None
+
+def test_randomize_metadata_keeps_orientation_on_disk():
+    image_path = os.path.join(tempfile.mkdtemp(), "portrait.jpg")
+    with open(image_path, 'wb') as f:
+        f.write(make_jpeg(orientation=8))
+    output_path = randomize_metadata(image_path, randomize_windows_props=False, engine='re-encode')
+    assert piexif.load(output_path)['0th'][piexif.ImageIFD.Orientation] == 8
+
+def test_template_writes_fallbacks_for_missing_kept_tags():
+    policy = compile_policy({'0th': {'Artist': {'keep': 'Anonymous'}, 'Software': {'fixed': 'Editor'}},
+                             'Exif': {'ImageUniqueID': 'randomize'}})
+    assert policy.fixed_layout
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16)).save(buffer, "jpeg")
+    exif_dict = piexif.load(randomize_bytes(buffer.getvalue(), policy=policy))
+    assert exif_dict['0th'][piexif.ImageIFD.Artist] == b"Anonymous"
+    assert exif_dict['0th'][piexif.ImageIFD.Software] == b"Editor"
+    # The source's own value still wins
+    assert piexif.load(randomize_bytes(make_jpeg(), policy=policy))['0th'][piexif.ImageIFD.Artist] == b"Jane Doe"
+
+def test_template_fills_unpatched_slots_with_prototype_values():
+    policy = compile_policy({'0th': {'Artist': {'keep': 'Anonymous'}}})
+    template = exif_template(True, policy)
+    values, _ = draw_random_values(True, rng=random.Random(2))
+    exif_dict = piexif.load(template.render({name: values[name] for name in values if name in template.slots}))
+    assert exif_dict['0th'][piexif.ImageIFD.Artist] == b"Anonymous"
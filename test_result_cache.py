@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed result cache.
+
+These check that copies of an image differing only in their metadata are served
+from the cache, that anything changing the output (pixels, kept tags, options)
+misses it, that evicted or deleted objects are recreated, and that the cache
+works from pool workers.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import piexif
+import pytest
+from PIL import Image
+from result_cache import ResultCache, content_digest
+from image_metadata_randomizer import process_images, randomize_bytes
+from test_metadata_policy import make_jpeg
+
+def write(folder, name, data):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_digest_ignores_metadata_only():
+    data = make_jpeg()
+    assert content_digest(data) == content_digest(randomize_bytes(data))
+    assert content_digest(data) != content_digest(data, keep_icc=True)
+    assert content_digest(data) != content_digest(data, options=b'thumbnail')
+    assert content_digest(data) != content_digest(make_jpeg(icc_profile=None)[:-10] + b'\0' * 8 + data[-2:])
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_duplicates_are_linked_from_the_cache(workers):
+    folder = tempfile.mkdtemp()
+    cache = ResultCache(os.path.join(folder, "cache"))
+    original = write(folder, "a.jpg", make_jpeg())
+    # Same image, different metadata
+    copy = write(folder, "b.jpg", randomize_bytes(make_jpeg()))
+    # Same pixels, but the kept orientation differs
+    rotated = write(folder, "c.jpg", make_jpeg(orientation=8))
+
+    first = process_images([original], display_after=False, randomize_windows_props=False, cache=cache)
+    results = process_images([copy, rotated], display_after=False, randomize_windows_props=False,
+                             workers=workers, cache=cache)
+    assert first[0]['cached'] is False
+    assert [r['cached'] for r in results] == [True, False]
+    with open(first[0]['modified'], 'rb') as a, open(results[0]['modified'], 'rb') as b:
+        assert a.read() == b.read()
+    assert piexif.load(results[1]['modified'])['0th'][piexif.ImageIFD.Orientation] == 8
+
+    # A lost object is a miss, not an error
+    shutil.rmtree(cache.objects_dir)
+    [result] = process_images([copy], display_after=False, randomize_windows_props=False, cache=cache)
+    assert result['success'] and not result['cached']
+
+def test_least_recently_used_entries_are_evicted():
+    folder = tempfile.mkdtemp()
+    paths = []
+    for i in range(3):
+        buffer = io.BytesIO()
+        Image.effect_noise((64, 64), 20 + i).convert('RGB').save(buffer, "jpeg")
+        paths.append(write(folder, f"{i}.jpg", buffer.getvalue()))
+    sizes = [os.path.getsize(path) for path in paths]
+    cache = ResultCache(os.path.join(folder, "cache"), max_bytes=sum(sizes) + 2000)
+    process_images(paths, display_after=False, randomize_windows_props=False, cache=cache)
+    assert cache.total_bytes() <= cache.max_bytes
+    assert len(os.listdir(cache.objects_dir)) >= 1
+    # The first file was used least recently and is gone
+    [result] = process_images(paths[:1], display_after=False, randomize_windows_props=False, cache=cache)
+    assert not result['cached']
+
+def test_cache_and_seed_are_exclusive():
+    with pytest.raises(ValueError):
+        process_images([], seed=1, cache=ResultCache(tempfile.mkdtemp()))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for the distributed work queue.
+
+These check the SQLite queue's leases, retries and result log, and run a
+coordinator with two workers (threads with their own connections, as separate
+nodes would have) to check that every file is processed once and the results
+of both workers are collected.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import piexif
+from PIL import Image
+from work_queue import SqliteQueue, open_queue, PENDING, DONE, FAILED, LEASE_EXPIRED
+from image_metadata_randomizer import (enqueue_images, wait_for_queue, run_queue_worker, OutputLayout,
+                                       default_policy)
+from instrumentation import BatchStats
+
+def test_leases_expire_and_attempts_are_limited():
+    queue = SqliteQueue(os.path.join(tempfile.mkdtemp(), "queue.sqlite"), lease_seconds=0.05, max_attempts=2)
+    assert queue.put(["a.jpg", "b.jpg"]) == 2
+    assert queue.put(["a.jpg"]) == 0
+
+    [(a_id, path)] = queue.lease("node1")
+    assert path == "a.jpg"
+    assert queue.fail(a_id, {'success': False}, "boom")
+    # Crashed worker: the lease runs out and another worker takes the items over
+    assert len(queue.lease("node1", 5)) == 2
+    time.sleep(0.1)
+    taken_over = queue.lease("node2", 5)
+    # a.jpg was on its last attempt, so only b.jpg is handed out again
+    assert [path for _, path in taken_over] == ["b.jpg"]
+    queue.complete(taken_over[0][0], {'original': "b.jpg", 'success': True})
+    # A late completion of the same item is ignored
+    queue.complete(taken_over[0][0], {'original': "b.jpg", 'success': True})
+
+    results = [result for _, result in queue.results_after(0)]
+    assert results == [{'original': "a.jpg", 'modified': None, 'success': False, 'skipped': False,
+                        'error': LEASE_EXPIRED}, {'original': "b.jpg", 'success': True}]
+    assert queue.counts() == {PENDING: 0, 'leased': 0, DONE: 1, FAILED: 1}
+    assert queue.results_after(2) == []
+
+def test_coordinator_and_workers():
+    folder = tempfile.mkdtemp()
+    image_paths = []
+    for i in range(10):
+        image_paths.append(os.path.join(folder, "in", f"{i}.jpg"))
+        os.makedirs(os.path.dirname(image_paths[-1]), exist_ok=True)
+        Image.new('RGB', (16, 16), (i, 0, 0)).save(image_paths[-1], "jpeg")
+    # Corrupt files fail on every attempt and are reported once
+    with open(os.path.join(folder, "in", "broken.jpg"), 'wb') as f:
+        f.write(b"\xff\xd8 not a jpeg")
+    image_paths.append(os.path.join(folder, "in", "broken.jpg"))
+    queue_path = os.path.join(folder, "queue.sqlite")
+    layout = OutputLayout(output_dir=os.path.join(folder, "out"), input_root=os.path.join(folder, "in"))
+
+    with open_queue("sqlite://" + queue_path) as coordinator:
+        enqueue_images(coordinator, image_paths, layout=layout, policy=default_policy(), engine='splice',
+                       randomize_windows_props=False)
+        counts = {}
+
+        def work(name):
+            with SqliteQueue(queue_path) as queue:
+                counts[name] = run_queue_worker(queue, worker_id=name, poll_interval=0.01)
+
+        threads = [threading.Thread(target=work, args=(name,)) for name in ("node1", "node2")]
+        for thread in threads:
+            thread.start()
+        stats = BatchStats()
+        results = wait_for_queue(coordinator, stats=stats, poll_interval=0.01)
+        for thread in threads:
+            thread.join()
+
+    assert sum(counts.values()) == 10
+    assert len(results) == 11 and stats.files == 11
+    assert {result['worker'] for result in results} <= {"node1", "node2"}
+    [failed] = [result for result in results if not result['success']]
+    assert failed['original'].endswith("broken.jpg")
+    for i in range(10):
+        assert piexif.load(os.path.join(folder, "out", f"{i}.jpg"))['Exif'][piexif.ExifIFD.ImageUniqueID]
@@ -0,0 +1,348 @@
+"""
+Work queues for spreading a batch over several machines.
+
+A coordinator puts one item per image (its path) on a queue together with the
+job's options, then seals it. Workers on any number of nodes
+lease items, process them and report a result; a lease that runs out (a crashed
+or stuck worker) makes the item available again, and failed items are retried
+up to max_attempts times. Outputs are written with temp file + rename, so an
+item that ends up processed twice still leaves one complete output.
+
+Finished results are appended to a log the coordinator reads incrementally, so
+progress and the final summary cover every node. Two backends share the same
+interface:
+
+    SqliteQueue   a single SQLite file, for one machine or a shared filesystem
+                  that supports SQLite locking
+    RedisQueue    any Redis-compatible server (needs the redis package)
+
+open_queue() picks one from a URL: sqlite:///path/to/queue.sqlite (or a plain
+path) or redis://host:6379/0.
+"""
+
+import json
+import sqlite3
+import time
+from urllib.parse import urlsplit
+
+try:
+    import redis
+except ImportError: # Optional: only needed for redis:// queues
+    redis = None
+
+# Seconds a worker may hold an item before it is handed to someone else
+DEFAULT_LEASE_SECONDS = 300
+
+# Times an item is tried before it is reported as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds a worker waits for another one holding the SQLite lock
+SQLITE_TIMEOUT = 60
+
+# Error recorded for items whose worker stopped reporting on the last attempt
+LEASE_EXPIRED = 'lease expired'
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def expired_result(image_path):
+    """The result reported for an item whose last lease ran out."""
+    return {'original': image_path, 'modified': None, 'success': False, 'skipped': False, 'error': LEASE_EXPIRED}
+
+
+class SqliteQueue:
+    """A work queue in an SQLite database."""
+
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Transactions are managed explicitly, so leasing can take the write lock up front
+        self.conn = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                worker TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until);
+            CREATE TABLE IF NOT EXISTS results (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_id INTEGER NOT NULL,
+                result TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    def put(self, image_paths):
+        """Adds image_paths; paths already on the queue are left alone. Returns the number added."""
+        with self._transaction():
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO items (path, status) VALUES (?, ?)",
+                                  ((path, PENDING) for path in image_paths))
+            return self.conn.total_changes - before
+
+    def lease(self, worker, count=1):
+        """
+        Leases up to count items to worker and returns them as (item_id, image_path) tuples.
+
+        Leased items whose lease ran out are taken over (or reported as failed
+        if that was their last attempt).
+        """
+        now = time.time()
+        with self._transaction():
+            # Items whose last attempt's worker vanished are not tried again
+            for item_id, path in self.conn.execute(
+                    "SELECT id, path FROM items WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (LEASED, now, self.max_attempts)).fetchall():
+                self.conn.execute("UPDATE items SET status = ?, lease_until = NULL, error = ? WHERE id = ?",
+                                  (FAILED, LEASE_EXPIRED, item_id))
+                self.conn.execute("INSERT INTO results (item_id, result) VALUES (?, ?)",
+                                  (item_id, json.dumps(expired_result(path))))
+            rows = self.conn.execute(
+                "SELECT id, path FROM items WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY id LIMIT ?", (PENDING, LEASED, now, count)).fetchall()
+            self.conn.executemany(
+                "UPDATE items SET status = ?, lease_until = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+                ((LEASED, now + self.lease_seconds, worker, item_id) for item_id, _ in rows))
+        return rows
+
+    def renew(self, item_ids, worker):
+        """Extends worker's leases on item_ids."""
+        with self._transaction():
+            self.conn.executemany("UPDATE items SET lease_until = ? WHERE id = ? AND status = ? AND worker = ?",
+                                  ((time.time() + self.lease_seconds, item_id, LEASED, worker)
+                                   for item_id in item_ids))
+
+    def complete(self, item_id, result):
+        """
+        Records item_id as done with result (a JSON-serializable dict). Items that
+        are already finished (processed twice after a lease ran out) are left alone.
+        """
+        with self._transaction():
+            updated = self.conn.execute(
+                "UPDATE items SET status = ?, lease_until = NULL WHERE id = ? AND status IN (?, ?)",
+                (DONE, item_id, PENDING, LEASED)).rowcount
+            if updated:
+                self.conn.execute("INSERT INTO results (item_id, result) VALUES (?, ?)",
+                                  (item_id, json.dumps(result)))
+
+    def fail(self, item_id, result, error):
+        """
+        Puts item_id back on the queue after a failed attempt, or records it as failed with
+        result once it has had max_attempts. Returns True if it will be retried.
+        """
+        with self._transaction():
+            row = self.conn.execute("SELECT attempts, status FROM items WHERE id = ?", (item_id,)).fetchone()
+            if row is None or row[1] in (DONE, FAILED):
+                return False
+            retry = row[0] < self.max_attempts
+            self.conn.execute("UPDATE items SET status = ?, lease_until = NULL, error = ? WHERE id = ?",
+                              (PENDING if retry else FAILED, error, item_id))
+            if not retry:
+                self.conn.execute("INSERT INTO results (item_id, result) VALUES (?, ?)",
+                                  (item_id, json.dumps(result)))
+            return retry
+
+    def results_after(self, seq=0):
+        """Returns [(seq, result)] for the items finished after seq, in order."""
+        return [(row_seq, json.loads(result)) for row_seq, result in
+                self.conn.execute("SELECT seq, result FROM results WHERE seq > ? ORDER BY seq", (seq,))]
+
+    def counts(self):
+        """Returns the number of items per status."""
+        counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        counts.update(self.conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+        return counts
+
+    def set_config(self, config):
+        """Stores the job's options (a JSON-serializable dict) for the workers."""
+        with self._transaction():
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('config', ?)", (json.dumps(config),))
+
+    def config(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def seal(self):
+        """Marks that no more items will be added, so idle workers can stop."""
+        with self._transaction():
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', '1')")
+
+    def sealed(self):
+        return self.conn.execute("SELECT 1 FROM meta WHERE key = 'sealed'").fetchone() is not None
+
+    def _transaction(self):
+        return _SqliteTransaction(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _SqliteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# Atomically moves expired leases back to the pending list (or to the results,
+# after the last attempt), then leases up to ARGV[1] items
+_REDIS_LEASE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    if tonumber(redis.call('HGET', KEYS[3], id) or 0) >= tonumber(ARGV[5]) then
+        redis.call('HSET', KEYS[5], id, 'failed')
+        redis.call('RPUSH', KEYS[6], cjson.encode({original = id, modified = cjson.null, success = false,
+                                                  skipped = false, error = ARGV[6]}))
+    else
+        redis.call('RPUSH', KEYS[1], id)
+    end
+end
+local leased = {}
+for i = 1, tonumber(ARGV[1]) do
+    local id = redis.call('LPOP', KEYS[1])
+    if not id then break end
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+    redis.call('HINCRBY', KEYS[3], id, 1)
+    redis.call('HSET', KEYS[4], id, ARGV[4])
+    redis.call('HSET', KEYS[5], id, 'leased')
+    leased[#leased + 1] = id
+end
+return leased
+"""
+
+
+class RedisQueue:
+    """
+    A work queue on a Redis-compatible server, under keys starting with name.
+
+    Items are identified by their input path. Lease deadlines use the workers'
+    clocks, so the nodes' clocks should be roughly in sync (well within lease_seconds).
+    """
+
+    def __init__(self, url, name='metadata_randomizer', lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        if redis is None:
+            raise ValueError("redis:// queues need the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.keys = {key: f"{name}:{key}" for key in
+                     ('pending', 'leases', 'attempts', 'workers', 'status', 'results', 'meta')}
+        self._lease = self.client.register_script(_REDIS_LEASE)
+
+    def put(self, image_paths):
+        added = 0
+        for path in image_paths:
+            if self.client.hsetnx(self.keys['status'], path, PENDING):
+                self.client.rpush(self.keys['pending'], path)
+                added += 1
+        return added
+
+    def lease(self, worker, count=1):
+        now = time.time()
+        ids = [item_id.decode('utf-8') for item_id in self._lease(
+            keys=[self.keys[key] for key in ('pending', 'leases', 'attempts', 'workers', 'status', 'results')],
+            args=[count, now, now + self.lease_seconds, worker, self.max_attempts, LEASE_EXPIRED])]
+        return [(item_id, item_id) for item_id in ids]
+
+    def renew(self, item_ids, worker):
+        deadline = time.time() + self.lease_seconds
+        for item_id in item_ids:
+            if self.client.hget(self.keys['workers'], item_id) == worker.encode('utf-8'):
+                # XX: only items that are still leased
+                self.client.zadd(self.keys['leases'], {item_id: deadline}, xx=True)
+
+    def _finish(self, item_id, status, result):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.keys['leases'], item_id)
+        pipe.hset(self.keys['status'], item_id, status)
+        pipe.rpush(self.keys['results'], json.dumps(result))
+        pipe.execute()
+
+    def complete(self, item_id, result):
+        if self.client.hget(self.keys['status'], item_id) in (PENDING.encode('utf-8'), LEASED.encode('utf-8')):
+            self._finish(item_id, DONE, result)
+
+    def fail(self, item_id, result, error):
+        status = self.client.hget(self.keys['status'], item_id)
+        if status in (DONE.encode('utf-8'), FAILED.encode('utf-8')):
+            return False
+        attempts = int(self.client.hget(self.keys['attempts'], item_id) or 0)
+        if attempts >= self.max_attempts:
+            self._finish(item_id, FAILED, result)
+            return False
+        pipe = self.client.pipeline()
+        pipe.zrem(self.keys['leases'], item_id)
+        pipe.hset(self.keys['status'], item_id, PENDING)
+        pipe.rpush(self.keys['pending'], item_id)
+        pipe.execute()
+        return True
+
+    def results_after(self, seq=0):
+        return [(seq + index + 1, json.loads(result))
+                for index, result in enumerate(self.client.lrange(self.keys['results'], seq, -1))]
+
+    def counts(self):
+        counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        for status in self.client.hvals(self.keys['status']):
+            counts[status.decode('utf-8')] += 1
+        return counts
+
+    def set_config(self, config):
+        self.client.hset(self.keys['meta'], 'config', json.dumps(config))
+
+    def config(self):
+        value = self.client.hget(self.keys['meta'], 'config')
+        return json.loads(value) if value else None
+
+    def seal(self):
+        self.client.hset(self.keys['meta'], 'sealed', 1)
+
+    def sealed(self):
+        return bool(self.client.hexists(self.keys['meta'], 'sealed'))
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_queue(url, **options):
+    """Opens the queue at url (sqlite:///path, a plain path, or redis://...), passing options to the backend."""
+    scheme = urlsplit(url).scheme
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisQueue(url, **options)
+    if scheme == 'sqlite':
+        return SqliteQueue(url[len('sqlite://'):], **options)
+    if scheme and len(scheme) > 1:
+        raise ValueError(f"Unsupported queue URL '{url}', expected sqlite:///path or redis://host")
+    return SqliteQueue(url, **options)